@@ -0,0 +1,102 @@
+import argparse
+import logging
+import os
+import time
+
+# los extractores leen la fuente local, debe definirse antes de importar extract.config.sources
+os.environ["EXTRACT_SOURCE_BACKEND"] = "local"
+
+
+def parse_arguments():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark de extracción contra la fuente local sintética",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--source', type=str, default='./resources/local_source/fuentes.duckdb',
+                        help='Base local que reemplaza a las fuentes Oracle')
+    parser.add_argument('--generate', action='store_true', help='Regenerar la base local antes del benchmark')
+    parser.add_argument('--covid-rows', type=int, default=1_000_000, help='Filas de vacunación COVID a generar')
+    parser.add_argument('--rutinario-rows', type=int, default=1_000_000,
+                        help='Filas de vacunación de rutina a generar')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    parser.add_argument('--since', type=str, default='1900-01-01', help='Inicio de la ventana de extracción')
+    parser.add_argument('--until', type=str, default='2024-12-31', help='Fin de la ventana de extracción')
+    parser.add_argument('--chunk-sizes', type=str, default='100000,500000', help='Tamaños de chunk a comparar')
+    parser.add_argument('--fetch-modes', type=str, default='dataframe,arrow', help='Modos de lectura a comparar')
+    parser.add_argument('--max-workers', type=int, default=4, help='Workers de extracción')
+    parser.add_argument('--array-size', type=int, default=50000, help='Filas por record batch en modo arrow')
+    parser.add_argument('--workdir', type=str, default='./resources/bench',
+                        help='Directorio de trabajo, el lago del benchmark se crea en su resources/data_lake')
+    return parser.parse_args()
+
+
+def _discard_chunk(chunk) -> int:
+    # consume el chunk sin escribirlo, mide solo la lectura y la paginación
+    if hasattr(chunk, 'to_reader'):
+        for _ in chunk:
+            pass
+        return chunk.rows
+    return chunk.height
+
+
+def _reset_lake():
+    from lake.session import close_sessions
+
+    # la sesión mantiene abierto el archivo, se cierra antes de borrarlo
+    close_sessions()
+    os.makedirs('./resources/data_lake', exist_ok=True)
+    for name in os.listdir('./resources/data_lake'):
+        if name.startswith('vacunacion.duckdb'):
+            os.remove(os.path.join('./resources/data_lake', name))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+    os.environ["EXTRACT_LOCAL_SOURCE_PATH"] = os.path.abspath(args.source)
+
+    from extract.chunking import month_partitions
+    from extract.db_vacunacion_covid import _fetch_partition, get_meses_db_vacunacion, load_lake_db_vacunacion_covid
+    from extract.pipeline import extract_partitions
+    from extract.synthetic_data import generate_local_source
+
+    if args.generate or not os.path.exists(args.source):
+        start_time = time.perf_counter()
+        generate_local_source(os.path.abspath(args.source), args.covid_rows, args.rutinario_rows, args.seed)
+        logging.info(f"|- Fuente generada en {time.perf_counter() - start_time:.2f} segundos")
+
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    meses = get_meses_db_vacunacion(args.since, args.until)
+    partitions = month_partitions(meses.select('ANIO', 'MES').rows(), args.since, args.until)
+
+    results = []
+    for fetch_mode in args.fetch_modes.split(','):
+        for chunk_size in [int(size) for size in args.chunk_sizes.split(',')]:
+            # solo lectura y paginación
+            start_time = time.perf_counter()
+            fetched = extract_partitions(
+                partitions,
+                lambda since, until: _fetch_partition(since, until, chunk_size, fetch_mode, args.array_size),
+                _discard_chunk,
+                args.max_workers)
+            fetch_seconds = time.perf_counter() - start_time
+
+            # lectura y escritura al lago
+            _reset_lake()
+            start_time = time.perf_counter()
+            load_lake_db_vacunacion_covid(args.since, args.until, chunk_size, args.max_workers, fetch_mode,
+                                          args.array_size)
+            load_seconds = time.perf_counter() - start_time
+            results.append((fetch_mode, chunk_size, fetched, fetch_seconds, load_seconds))
+
+    logging.info(f"|- Resultados ({len(partitions)} particiones, {args.max_workers} workers)")
+    for fetch_mode, chunk_size, rows, fetch_seconds, load_seconds in results:
+        logging.info(f" |- {fetch_mode:<9} chunk {chunk_size:>9,}: {rows:,} filas, "
+                     f"lectura {fetch_seconds:.2f}s ({rows / fetch_seconds:,.0f} filas/s), "
+                     f"lectura + lago {load_seconds:.2f}s ({rows / load_seconds:,.0f} filas/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import polars as pl
+
+from extract.synthetic_data import cedulas
+from utils.clean.identification_transform import cedula_valida, es_cedula_valida, pasaporte_valido, ruc_valido
+
+# filas generadas por bloque, la generación de dígitos con numpy no cabe en memoria de una sola vez
+_BLOCK_ROWS = 5_000_000
+
+
+def _es_cedula_valida(cedula: str) -> bool:
+    # validación que aplicaba dim_persona con map_elements antes de cedula_valida, la referencia de velocidad.
+    # Solo revisa el dígito verificador, sin las reglas de provincia y tercer dígito
+    if not cedula or len(cedula) != 10 or not cedula.isdigit():
+        return False
+
+    coeficientes = [2, 1, 2, 1, 2, 1, 2, 1, 2]
+    total = 0
+
+    for i in range(9):
+        val = int(cedula[i]) * coeficientes[i]
+        if val >= 10:
+            val -= 9
+        total += val
+
+    digito_verificador = 10 - (total % 10) if (total % 10) != 0 else 0
+
+    return digito_verificador == int(cedula[9])
+
+
+def parse_arguments():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Benchmark de la validación de identificaciones: expresión de Polars contra la función escalar "
+                    "que usaba dim_persona",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--rows', type=int, default=50_000_000, help='Cédulas sintéticas a validar')
+    parser.add_argument('--reference-rows', type=int, default=None,
+                        help='Filas que valida la función escalar con map_elements, por defecto todas')
+    parser.add_argument('--seed', type=int, default=42, help='Semilla del generador')
+    return parser.parse_args()
+
+
+def _generate(rows: int, seed: int) -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+    blocks = [cedulas(rng, min(_BLOCK_ROWS, rows - start)) for start in range(0, rows, _BLOCK_ROWS)]
+    return pl.DataFrame({"num_iden": pl.concat(blocks)})
+
+
+def _measure(name: str, df: pl.DataFrame, expression: pl.Expr) -> tuple[str, int, float, pl.Series]:
+    # la conversión a entero va en una columna temporal, como en dim_persona
+    start_time = time.perf_counter()
+    result = (
+        df.lazy()
+        .with_columns(pl.col("num_iden").str.to_integer(strict=False).alias("_numero"))
+        .select(expression.alias("valida"))
+        .collect()
+        .to_series()
+    )
+    return name, df.height, time.perf_counter() - start_time, result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+
+    start_time = time.perf_counter()
+    df = _generate(args.rows, args.seed)
+    logging.info(f"|- {df.height:,} cédulas generadas en {time.perf_counter() - start_time:.2f} segundos")
+    reference = df.head(args.reference_rows) if args.reference_rows else df
+    # mismas cadenas con tres dígitos de establecimiento, RUC de persona natural
+    rucs = df.select(pl.col("num_iden") + "001")
+
+    results = [
+        _measure("cedula_valida", df, cedula_valida("num_iden", pl.col("_numero"))),
+        _measure("_es_cedula_valida", reference,
+                 pl.col("num_iden").map_elements(_es_cedula_valida, return_dtype=pl.Boolean)),
+        _measure("ruc_valido", rucs, ruc_valido("num_iden", pl.col("_numero"))),
+        _measure("pasaporte_valido", df, pasaporte_valido("num_iden")),
+    ]
+
+    # las diferencias con la validación anterior vienen de las reglas de provincia y tercer dígito, en esas
+    # filas cedula_valida debe coincidir con es_cedula_valida
+    vectorized, scalar = results[0][3], results[1][3]
+    compared = reference.with_columns(vectorizada=vectorized.head(scalar.len()), anterior=scalar)
+    differences = compared.filter(pl.col("vectorizada") != pl.col("anterior"))
+    unexplained = differences.filter(
+        pl.col("num_iden").map_elements(es_cedula_valida, return_dtype=pl.Boolean) != pl.col("vectorizada"))
+    logging.info(f"|- Resultados ({pl.thread_pool_size()} hilos de Polars)")
+    for name, rows, seconds, result in results:
+        logging.info(f" |- {name:<17} {rows:>12,} filas en {seconds:8.2f}s ({rows / seconds:,.0f} filas/s), "
+                     f"{result.sum():,} válidas")
+    speedup = (results[0][1] / results[0][2]) / (results[1][1] / results[1][2])
+    logging.info(f" |- Aceleración de cedula_valida: {speedup:.1f}x sobre _es_cedula_valida")
+    logging.info(f" |- {differences.height:,} diferencias con _es_cedula_valida por provincia o tercer dígito, "
+                 f"{unexplained.height:,} sin explicar según es_cedula_valida")
+
+
+if __name__ == "__main__":
+    main()
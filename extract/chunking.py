@@ -0,0 +1,234 @@
+import itertools
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Iterator, Optional, TypeVar, Union
+
+import polars as pl
+import pyarrow as pa
+
+# reintentos por chunk ante errores de la fuente, la espera se duplica en cada intento
+FETCH_RETRIES = int(os.getenv("EXTRACT_FETCH_RETRIES", 3))
+FETCH_RETRY_BACKOFF = float(os.getenv("EXTRACT_FETCH_RETRY_BACKOFF", 5))
+
+T = TypeVar("T")
+
+
+def keyset_predicate(key_expressions: list[str], last_key: Optional[tuple]) -> tuple[str, dict]:
+    """
+    Construye el predicado de búsqueda (seek) para continuar después de last_key.
+    Para llaves compuestas genera (A > :k0 OR (A = :k0 AND B > :k1)), que Oracle resuelve sobre el índice
+    sin necesidad de comparar tuplas.
+    """
+    if last_key is None:
+        return "1 = 1", {}
+
+    params = {f"k{i}": value for i, value in enumerate(last_key)}
+    conditions = []
+    for i, expression in enumerate(key_expressions):
+        equals = [f"{key_expressions[j]} = :k{j}" for j in range(i)]
+        conditions.append("(" + " AND ".join(equals + [f"{expression} > :k{i}"]) + ")")
+    return "(" + " OR ".join(conditions) + ")", params
+
+
+def with_retry(fetch: Callable[[], T], description: str, retries: int = FETCH_RETRIES,
+               backoff: float = FETCH_RETRY_BACKOFF) -> tuple[T, int]:
+    """
+    Ejecuta fetch reintentando con espera exponencial, retorna el resultado y el número de intentos usados
+    """
+    attempt = 1
+    while True:
+        try:
+            return fetch(), attempt
+        except Exception as e:
+            if attempt > retries:
+                raise
+            wait = backoff * 2 ** (attempt - 1)
+            logging.warning(f" |- Intento {attempt} de {description} falló ({e}), reintentando en {wait:.0f}s")
+            time.sleep(wait)
+            attempt += 1
+
+
+class KeysetChunk:
+    """
+    Chunk de una paginación por llave: los datos (DataFrame o BatchStream) y su rango de llaves (key_from, key_to]
+    """
+
+    def __init__(self, data: Union[pl.DataFrame, "BatchStream"], number: int, key_from: Optional[tuple],
+                 key_to: Optional[tuple] = None, attempts: int = 1, started_at: float = 0.0):
+        self.data = data
+        self.number = number
+        self.key_from = key_from
+        self._key_to = key_to
+        self.attempts = attempts
+        self.started_at = started_at
+
+    @property
+    def key_to(self) -> Optional[tuple]:
+        # en un BatchStream la última llave se conoce cuando el chunk terminó de consumirse
+        if isinstance(self.data, BatchStream):
+            return self.data.last_key
+        return self._key_to
+
+    @property
+    def rows(self) -> int:
+        if isinstance(self.data, BatchStream):
+            return self.data.rows
+        return self.data.height
+
+
+def keyset_chunks(fetch_chunk: Callable[[Optional[tuple], int], pl.DataFrame],
+                  key_columns: list[str],
+                  chunk_size: int,
+                  start_key: Optional[tuple] = None) -> Iterator[KeysetChunk]:
+    """
+    Recorre una consulta por chunks paginando por llave en lugar de OFFSET/FETCH.
+    fetch_chunk(last_key, chunk_size) debe devolver como máximo chunk_size filas con llave mayor a last_key,
+    ordenadas por key_columns. Cada chunk cuesta lo mismo sin importar qué tan profundo se esté en la tabla.
+    Con start_key la paginación continúa después de esa llave, así se retoma una partición interrumpida.
+    """
+    last_key = start_key
+    chunk_number = 0
+    while True:
+        started_at = time.perf_counter()
+        df, attempts = with_retry(lambda: fetch_chunk(last_key, chunk_size), f"chunk después de {last_key}")
+        if df.is_empty():
+            break
+        chunk_number += 1
+        # la llave se toma antes de entregar el chunk, el consumidor puede renombrar columnas
+        key_from, last_key = last_key, tuple(df.get_column(col)[-1] for col in key_columns)
+        logging.debug(f" |- Chunk {chunk_number} con {df.height:,} filas, última llave {last_key}")
+        yield KeysetChunk(df, chunk_number, key_from, last_key, attempts, started_at)
+        if df.height < chunk_size:
+            break
+
+
+def arrow_schema(schema: dict) -> pa.Schema:
+    """
+    Convierte un esquema declarado de polars ({columna: tipo}) a un esquema de Arrow
+    """
+    return pl.DataFrame(schema=schema).to_arrow().schema
+
+
+def cast_record_batch(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Castea el batch al esquema declarado por nombre de columna, sin inferir tipos sobre los datos.
+    Las columnas que no vienen en el batch se completan con nulos.
+    """
+    columns = []
+    for field in schema:
+        index = batch.schema.get_field_index(field.name)
+        if index < 0:
+            columns.append(pa.nulls(batch.num_rows, field.type))
+        else:
+            columns.append(batch.column(index).cast(field.type, safe=False))
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class BatchStream:
+    """
+    Record batches de un chunk, registra filas y última llave a medida que el escritor los consume
+    """
+
+    def __init__(self, first_batch: pa.RecordBatch, batches: Iterator[pa.RecordBatch], key_columns: list[str]):
+        self.schema = first_batch.schema
+        self.rows = 0
+        self.last_key = None
+        self._batches = itertools.chain([first_batch], batches)
+        self._key_columns = key_columns
+
+    def __iter__(self) -> Iterator[pa.RecordBatch]:
+        for batch in self._batches:
+            if batch.num_rows == 0:
+                continue
+            self.rows += batch.num_rows
+            self.last_key = tuple(batch.column(col)[batch.num_rows - 1].as_py() for col in self._key_columns)
+            yield batch
+
+    def to_reader(self, rename: Optional[Callable[[str], str]] = None) -> pa.RecordBatchReader:
+        if rename is None:
+            return pa.RecordBatchReader.from_batches(self.schema, iter(self))
+        names = [rename(name) for name in self.schema.names]
+        schema = pa.schema([field.with_name(name) for field, name in zip(self.schema, names)])
+        return pa.RecordBatchReader.from_batches(schema, (batch.rename_columns(names) for batch in self))
+
+
+def keyset_batch_chunks(fetch_batches: Callable[[Optional[tuple], int], Iterable[pa.RecordBatch]],
+                        key_columns: list[str],
+                        chunk_size: int,
+                        start_key: Optional[tuple] = None) -> Iterator[KeysetChunk]:
+    """
+    Igual que keyset_chunks pero cada chunk es un BatchStream que se consume en streaming, el chunk nunca
+    se materializa completo en memoria. La siguiente página se pide cuando el consumidor terminó el chunk actual.
+    Solo se reintenta la apertura del chunk, un error a mitad del stream se propaga al escritor.
+    """
+    last_key = start_key
+    chunk_number = 0
+    while True:
+        started_at = time.perf_counter()
+
+        def _open():
+            batches = iter(fetch_batches(last_key, chunk_size))
+            return batches, next((batch for batch in batches if batch.num_rows), None)
+
+        (batches, first_batch), attempts = with_retry(_open, f"chunk después de {last_key}")
+        if first_batch is None:
+            break
+        chunk_number += 1
+        stream = BatchStream(first_batch, batches, key_columns)
+        yield KeysetChunk(stream, chunk_number, last_key, attempts=attempts, started_at=started_at)
+        # si el consumidor no agotó el chunk se descarta el resto para conocer la última llave
+        for _ in stream:
+            pass
+        last_key = stream.last_key
+        logging.debug(f" |- Chunk {chunk_number} con {stream.rows:,} filas, última llave {last_key}")
+        if stream.rows < chunk_size:
+            break
+
+
+def _to_date(value: Union[str, date]) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def date_window(since: Union[str, date], until: Union[str, date]) -> tuple[str, str]:
+    """
+    Ventana semiabierta [since, until + 1 día) que incluye completo el día until
+    """
+    return _to_date(since).isoformat(), (_to_date(until) + timedelta(days=1)).isoformat()
+
+
+def date_partitions(since: Union[str, date], until: Union[str, date]) -> list[tuple[str, str]]:
+    """
+    Divide la ventana [since, until] en particiones mensuales semiabiertas [inicio, fin).
+    El día until queda incluido completo, la última partición termina en until + 1 día.
+    """
+    start = _to_date(since)
+    end = _to_date(until) + timedelta(days=1)
+    partitions = []
+    while start < end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        partition_end = min(next_month, end)
+        partitions.append((start.isoformat(), partition_end.isoformat()))
+        start = partition_end
+    return partitions
+
+
+def month_partitions(months: list[tuple[int, int]], since: Union[str, date],
+                     until: Union[str, date]) -> list[tuple[str, str]]:
+    """
+    Particiones mensuales semiabiertas [inicio, fin) solo de los meses (año, mes) con datos, recortadas a la
+    ventana [since, until + 1 día). Un mes aislado, como el de una fecha centinela, no arrastra los meses vacíos
+    que lo separan del resto.
+    """
+    first, end = (date.fromisoformat(value) for value in date_window(since, until))
+    partitions = []
+    for year, month in sorted(set(months)):
+        start = date(int(year), int(month), 1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        partitions.append((max(start, first).isoformat(), min(next_month, end).isoformat()))
+    return partitions
@@ -0,0 +1,81 @@
+import logging
+import os
+import re
+import threading
+from typing import Iterator, Optional
+
+import dotenv
+import duckdb
+import polars
+import pyarrow
+
+dotenv.load_dotenv()
+
+# base embebida que reemplaza a las fuentes Oracle, se genera con extract.synthetic_data
+LOCAL_SOURCE_PATH = os.getenv("EXTRACT_LOCAL_SOURCE_PATH", "./resources/local_source/fuentes.duckdb")
+
+# esquemas de las fuentes Oracle, las consultas los usan calificando cada tabla
+LOCAL_SOURCE_SCHEMAS = ["HCUE_VACUNACION_DEPURADA", "HCUE_AMED", "HCUE_SISTEMA", "HCUE_CATALOGOS", "MPI", "SYAPP"]
+
+# variables de enlace de Oracle (:nombre), no toca literales de hora como '00:00:00'
+_BIND_PATTERN = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+_connection: Optional[duckdb.DuckDBPyConnection] = None
+_connection_lock = threading.Lock()
+
+
+def translate_query(query: str) -> str:
+    """
+    Adapta una consulta escrita para Oracle al dialecto de DuckDB: las variables :nombre pasan a $nombre.
+    TO_DATE se resuelve con una macro, FETCH FIRST n ROWS ONLY y los hints /*+ */ ya son válidos en DuckDB.
+    """
+    return _BIND_PATTERN.sub(r"$\1", query)
+
+
+def _cursor() -> duckdb.DuckDBPyConnection:
+    # una sola conexión de solo lectura por proceso, cada consulta usa su propio cursor (seguro entre hilos)
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            logging.info(f" |- Fuente local: {LOCAL_SOURCE_PATH}")
+            _connection = duckdb.connect(LOCAL_SOURCE_PATH, read_only=True)
+        cursor = _connection.cursor()
+    cursor.execute("CREATE TEMP MACRO to_date(value, format) AS CAST(value AS DATE)")
+    return cursor
+
+
+def _execute(query: str, params: Optional[dict]) -> duckdb.DuckDBPyConnection:
+    cursor = _cursor()
+    query = translate_query(query)
+    # DuckDB rechaza parámetros que la consulta no usa
+    used = set(re.findall(r"\$(\w+)", query))
+    params = {name: value for name, value in (params or {}).items() if name in used}
+    return cursor.execute(query, params)
+
+
+def read_database(query: str, params: Optional[dict] = None) -> polars.DataFrame:
+    """
+    Igual que sources.read_database pero contra la base local. Las columnas se entregan en mayúsculas como
+    las entrega Oracle para identificadores sin comillas.
+    """
+    df = _execute(query, params).pl()
+    return df.rename({col: col.upper() for col in df.columns})
+
+
+def iter_record_batches(query: str, params: Optional[dict] = None,
+                        array_size: int = 50000) -> Iterator[pyarrow.RecordBatch]:
+    """
+    Igual que sources.iter_record_batches pero contra la base local
+    """
+    reader = _execute(query, params).fetch_record_batch(array_size)
+    names = [name.upper() for name in reader.schema.names]
+    for batch in reader:
+        yield pyarrow.RecordBatch.from_arrays(batch.columns, names=names)
+
+
+def close_local_source():
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
@@ -1,12 +1,36 @@
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 import dotenv
 import polars
+import pyarrow
 from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Connection, Engine
+
+from extract.config import local_source
 
 dotenv.load_dotenv()
 
+# tamaño del pool por fuente, se comparte entre todos los workers del proceso
+POOL_SIZE = int(os.getenv("CNN_ORACLE_POOL_SIZE", 4))
+POOL_MAX_OVERFLOW = int(os.getenv("CNN_ORACLE_POOL_MAX_OVERFLOW", 4))
+POOL_TIMEOUT = int(os.getenv("CNN_ORACLE_POOL_TIMEOUT", 60))
+
+# modo de lectura de los chunks: 'dataframe' (polars.read_database) o 'arrow' (record batches del driver)
+FETCH_MODE = os.getenv("EXTRACT_FETCH_MODE", "dataframe")
+FETCH_ARRAY_SIZE = int(os.getenv("EXTRACT_FETCH_ARRAY_SIZE", 50000))
+
+# 'oracle' consulta las fuentes reales, 'local' sirve las mismas consultas desde la base embebida de
+# extract.config.local_source (benchmarks y pruebas sin acceso a la red de producción)
+SOURCE_BACKEND = os.getenv("EXTRACT_SOURCE_BACKEND", "oracle")
+
+# días que se vuelven a leer antes del watermark en cargas incrementales, cubre registros que llegan tarde
+LOOKBACK_DAYS = int(os.getenv("EXTRACT_LOOKBACK_DAYS", 7))
+
 DB_VACUNACION = {
     "host": os.getenv("CNN_ORACLE_DB_VACUNACION_HOST", "localhost"),
     "port": int(os.getenv("CNN_ORACLE_DB_VACUNACION_PORT", 1521)),
@@ -40,17 +64,112 @@ DB_REPLICA = {
 }
 
 
+_engines: dict[tuple, Engine] = {}
+_pool_stats: dict[tuple, dict] = {}
+_registry_lock = threading.Lock()
+
+
+def _engine_key(options: dict) -> tuple:
+    return (
+        options.get("user", "user"),
+        options.get("host", "localhost"),
+        options.get("port", 1521),
+        options.get("service_name", "orclpdb1"),
+    )
+
+
 def get_oracle_engine(options: dict) -> Engine:
-    user = options.get("user", "user")
-    password = options.get("password", "password")
-    host = options.get("host", "localhost")
-    port = options.get("port", 1521)
-    service_name = options.get("service_name", "orclpdb1")
-    connection_string = f'oracle+oracledb://{user}:{password}@{host}:{port}/?service_name={service_name}'
-    engine: Engine = create_engine(connection_string, pool_pre_ping=True)
+    """
+    Retorna el engine de la fuente, se crea una sola vez por configuración y se reutiliza en todo el proceso
+    """
+    key = _engine_key(options)
+    with _registry_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            user, host, port, service_name = key
+            password = options.get("password", "password")
+            connection_string = f'oracle+oracledb://{user}:{password}@{host}:{port}/?service_name={service_name}'
+            engine = create_engine(connection_string,
+                                   pool_pre_ping=True,
+                                   pool_size=options.get("pool_size", POOL_SIZE),
+                                   max_overflow=options.get("max_overflow", POOL_MAX_OVERFLOW),
+                                   pool_timeout=POOL_TIMEOUT)
+            _engines[key] = engine
+            _pool_stats[key] = {"checkouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            logging.debug(f" |- Engine creado para {user}@{host}:{port}/{service_name}")
     return engine
 
 
+@contextmanager
+def oracle_connection(options: dict) -> Iterator[Connection]:
+    """
+    Toma una conexión del pool de la fuente y la devuelve al salir del bloque, aun si hay errores
+    """
+    engine = get_oracle_engine(options)
+    key = _engine_key(options)
+    start_time = time.perf_counter()
+    connection = engine.connect()
+    wait = time.perf_counter() - start_time
+    with _registry_lock:
+        stats = _pool_stats[key]
+        stats["checkouts"] += 1
+        stats["wait_seconds"] += wait
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def read_database(options: dict, query: str, params: Optional[dict] = None, **kwargs) -> polars.DataFrame:
+    """
+    Ejecuta la consulta en la fuente con una conexión del pool y retorna un DataFrame de polars
+    """
+    if SOURCE_BACKEND == "local":
+        return local_source.read_database(query, params)
+    with oracle_connection(options) as connection:
+        return polars.read_database(query, connection=connection, execute_options={"parameters": params or {}},
+                                    **kwargs)
+
+
+def iter_record_batches(options: dict, query: str, params: Optional[dict] = None,
+                        array_size: int = FETCH_ARRAY_SIZE) -> Iterator[pyarrow.RecordBatch]:
+    """
+    Ejecuta la consulta y entrega el resultado en record batches de Arrow de array_size filas, directo desde el
+    driver y sin construir objetos fila de Python. La conexión se mantiene tomada hasta consumir el iterador.
+    """
+    if SOURCE_BACKEND == "local":
+        yield from local_source.iter_record_batches(query, params, array_size)
+        return
+    with oracle_connection(options) as connection:
+        driver_connection = connection.connection.driver_connection
+        for oracle_df in driver_connection.fetch_df_batches(statement=query, parameters=params or {}, size=array_size):
+            yield from pyarrow.table(oracle_df).to_batches()
+
+
+def get_pool_stats() -> dict[str, dict]:
+    """
+    Contadores por fuente: conexiones entregadas, tiempo de espera acumulado y máximo, estado del pool
+    """
+    summary = {}
+    with _registry_lock:
+        for key, stats in _pool_stats.items():
+            user, host, port, service_name = key
+            summary[f"{user}@{host}:{port}/{service_name}"] = {**stats, "pool": _engines[key].pool.status()}
+    return summary
+
+
+def dispose_engines():
+    """
+    Cierra todas las conexiones abiertas de los pools registrados
+    """
+    with _registry_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _pool_stats.clear()
+
+
 def postgres_get_engine(options: dict) -> Engine:
     user = options.get("user", "user")
     password = options.get("password", "password")
@@ -1,14 +1,24 @@
 import logging
 import time
+from datetime import timedelta
+from functools import partial
+from typing import Iterator, Optional, Union
 
 import polars as pl
+import pyarrow as pa
 
-from extract.config.sources import DB_VACUNACION, get_oracle_engine
+from extract.chunking import (BatchStream, arrow_schema, cast_record_batch, date_window, keyset_batch_chunks,
+                              keyset_chunks, keyset_predicate, month_partitions)
+from extract.config.sources import (DB_VACUNACION, FETCH_ARRAY_SIZE, FETCH_MODE, LOOKBACK_DAYS, iter_record_batches,
+                                    read_database)
+from extract.pipeline import extract_partitions
 from lake.init_lake import add_new_elements_to_lake
+from lake.manifest import resume_run, start_run
+from lake.watermark import get_last_key_in_lake, get_watermark, set_watermark
 
 VACUNACION_SCHEMA = {
     "ID_VAC_DEPU": pl.String,
-    "FECHA_APLICACION": pl.Date,
+    "FECHA_APLICACION": pl.Datetime,
     "PUNTO_VACUNACION": pl.String,
     "UNICODIGO": pl.String,
     "TIPO_IDEN": pl.String,
@@ -17,7 +27,7 @@ VACUNACION_SCHEMA = {
     "NOMBRES": pl.String,
     "NOMBRES_COMPLETOS": pl.String,
     "SEXO": pl.String,
-    "FECHA_NACIMIENTO": pl.Date,
+    "FECHA_NACIMIENTO": pl.Datetime,
     "NACIONALIDAD": pl.String,
     "ETNIA": pl.String,
     "POBLA_VACUNA": pl.String,
@@ -35,15 +45,20 @@ VACUNACION_SCHEMA = {
     "ID_VAC_CONS": pl.String,
 }
 
-def get_db_vacunacion_covid_chunk(since: str, until: str, offset: int = 0, chunk_size: int = 100000) -> pl.DataFrame:
-    """
-    Versión optimizada de la consulta con mejores prácticas SQL
-    """
-    db_vacunacion_engine = get_oracle_engine(DB_VACUNACION)
+VACUNACION_ARROW_SCHEMA = arrow_schema(VACUNACION_SCHEMA)
+
+# llave de paginación, el orden debe coincidir con el ORDER BY de la consulta
+VACUNACION_KEY_COLUMNS = ["FECHA_APLICACION", "ID_VAC_DEPU"]
+
+WATERMARK_SOURCE = 'db_vacunacion_covid'
+
+def _query_db_vacunacion_covid_chunk(since: str, until: str, last_key: Optional[tuple],
+                                     chunk_size: int) -> tuple[str, dict]:
+    seek, params = keyset_predicate(VACUNACION_KEY_COLUMNS, last_key)
     
-    # Query optimizada con hints de Oracle y ORDER BY para consistencia
+    # Query paginada por llave (seek), cada chunk parte del índice en la última llave leída
     query = f"""
-            SELECT /*+ FIRST_ROWS({chunk_size}) INDEX_RANGE_SCAN */
+            SELECT /*+ FIRST_ROWS({chunk_size}) */
                 ID_VAC_DEPU,
                 FECHA_APLICACION,
                 PUNTO_VACUNACION,
@@ -71,47 +86,150 @@ def get_db_vacunacion_covid_chunk(since: str, until: str, offset: int = 0, chunk
                 REGISTRO_CIVIL,
                 ID_VAC_CONS
             FROM HCUE_VACUNACION_DEPURADA.DB_VACUNACION_CONSOLIDADA_DEPURADA_COVID
-            WHERE FECHA_APLICACION BETWEEN TO_DATE('{since}', 'YYYY-MM-DD') AND TO_DATE('{until}', 'YYYY-MM-DD')
-            OFFSET {offset} ROWS FETCH NEXT {chunk_size} ROWS ONLY
+            WHERE FECHA_APLICACION >= TO_DATE('{since}', 'YYYY-MM-DD')
+            AND FECHA_APLICACION < TO_DATE('{until}', 'YYYY-MM-DD')
+            AND {seek}
+            ORDER BY FECHA_APLICACION, ID_VAC_DEPU
+            FETCH FIRST {chunk_size} ROWS ONLY
             """
+    return query, params
+
+def get_db_vacunacion_covid_chunk(since: str, until: str, last_key: Optional[tuple] = None,
+                                  chunk_size: int = 100000) -> pl.DataFrame:
+    """
+    Obtiene el siguiente chunk de la partición [since, until) ordenado por (FECHA_APLICACION, ID_VAC_DEPU)
+    a partir de last_key
+    """
+    query, params = _query_db_vacunacion_covid_chunk(since, until, last_key, chunk_size)
     try:
         start_time = time.time()
-        df = pl.read_database(query, connection=db_vacunacion_engine.connect(), infer_schema_length=None)
+        df = read_database(DB_VACUNACION, query, params, infer_schema_length=None)
         end_time = time.time()
         logging.debug(f" |- Chunk consultado en {end_time - start_time:.2f} segundos")
         return df
     except Exception as e:
-        logging.error(f"Error en consulta chunk offset {offset}: {e}")
-        return pl.DataFrame()
+        # sin OFFSET no es posible saltar el chunk, un chunk vacío terminaría la paginación sin aviso
+        logging.error(f"Error en consulta chunk después de la llave {last_key}: {e}")
+        raise
+
+def get_db_vacunacion_covid_batches(since: str, until: str, last_key: Optional[tuple] = None, chunk_size: int = 100000,
+                                    array_size: int = FETCH_ARRAY_SIZE) -> Iterator[pa.RecordBatch]:
+    """
+    Igual que get_db_vacunacion_covid_chunk pero entrega el chunk en record batches de Arrow ya casteados a
+    VACUNACION_SCHEMA, sin materializar el chunk completo
+    """
+    query, params = _query_db_vacunacion_covid_chunk(since, until, last_key, chunk_size)
+    try:
+        for batch in iter_record_batches(DB_VACUNACION, query, params, array_size):
+            yield cast_record_batch(batch, VACUNACION_ARROW_SCHEMA)
+    except Exception as e:
+        logging.error(f"Error en consulta chunk después de la llave {last_key}: {e}")
+        raise
 
 def get_count_db_vacunacion(since, until):
-    db_vacunacion_engine = get_oracle_engine(DB_VACUNACION)
+    # con la hora del DATE un BETWEEN dejaría fuera el día until, la ventana es la misma de date_partitions
+    since, until = date_window(since, until)
     query = f"""
             SELECT 
                 COUNT(*) AS total_count
             FROM HCUE_VACUNACION_DEPURADA.DB_VACUNACION_CONSOLIDADA_DEPURADA_COVID
             WHERE 
-                FECHA_APLICACION BETWEEN TO_DATE('{since}', 'YYYY-MM-DD') 
-                AND TO_DATE('{until}', 'YYYY-MM-DD')
+                FECHA_APLICACION >= TO_DATE('{since}', 'YYYY-MM-DD') 
+                AND FECHA_APLICACION < TO_DATE('{until}', 'YYYY-MM-DD')
             """  # Replace with actual query
-    df = pl.read_database(query, connection=db_vacunacion_engine.connect())
+    df = read_database(DB_VACUNACION, query)
     return df['TOTAL_COUNT'][0]
 
-def load_lake_db_vacunacion_covid(since: str, until: str, chunk_size: int = 1000000):
+def get_meses_db_vacunacion(since, until) -> pl.DataFrame:
     """
-    Carga datos de vacunación COVID en paralelo con persistencia directa en DuckDB
+    Filas por mes (ANIO, MES, TOTAL_COUNT) dentro de la ventana, solo los meses con datos
     """
-    total_count = get_count_db_vacunacion(since, until)
-    logging.info(f"|- Total de registros a procesar: {total_count:,}")
-    offset = 0
-    
-    while offset < total_count:
-        logging.info(f" |- Procesando chunk con offset {offset}")
-        df_chunk = get_db_vacunacion_covid_chunk(since, until, offset, chunk_size)
+    since, until = date_window(since, until)
+    query = f"""
+            SELECT 
+                EXTRACT(YEAR FROM FECHA_APLICACION) AS ANIO,
+                EXTRACT(MONTH FROM FECHA_APLICACION) AS MES,
+                COUNT(*) AS TOTAL_COUNT
+            FROM HCUE_VACUNACION_DEPURADA.DB_VACUNACION_CONSOLIDADA_DEPURADA_COVID
+            WHERE 
+                FECHA_APLICACION >= TO_DATE('{since}', 'YYYY-MM-DD') 
+                AND FECHA_APLICACION < TO_DATE('{until}', 'YYYY-MM-DD')
+            GROUP BY EXTRACT(YEAR FROM FECHA_APLICACION), EXTRACT(MONTH FROM FECHA_APLICACION)
+            """
+    return read_database(DB_VACUNACION, query)
+
+def _fetch_partition(since: str, until: str, chunk_size: int, fetch_mode: str, array_size: int,
+                     resume_keys: Optional[dict] = None):
+    # al retomar una ejecución la partición continúa después del último chunk completado
+    start_key = (resume_keys or {}).get((since, until))
+    if fetch_mode == 'arrow':
+        fetch_batches = partial(get_db_vacunacion_covid_batches, since, until, array_size=array_size)
+        yield from keyset_batch_chunks(fetch_batches, VACUNACION_KEY_COLUMNS, chunk_size, start_key)
+        return
+    fetch_chunk = partial(get_db_vacunacion_covid_chunk, since, until)
+    for chunk in keyset_chunks(fetch_chunk, VACUNACION_KEY_COLUMNS, chunk_size, start_key):
         ## convertir en minusculas las columnas 
-        df_chunk.columns = [col.lower() for col in df_chunk.columns]
-        add_new_elements_to_lake('vacunacion', 'lk_vacunacion_covid', ['num_iden','num_iden'], df_chunk)
-        offset += chunk_size
-        logging.info(f" |- Chunk con offset {offset} procesado y almacenado en el lago")
+        chunk.data.columns = [col.lower() for col in chunk.data.columns]
+        yield chunk
+
+def _write_chunk(chunk: Union[pl.DataFrame, BatchStream]) -> int:
+    # ID_VAC_DEPU identifica el registro de vacunación, una persona tiene varias dosis
+    keys = ['id_vac_depu']
+    if isinstance(chunk, BatchStream):
+        ## los batches pasan al lago en streaming, con las columnas en minusculas
+        add_new_elements_to_lake('vacunacion', 'lk_vacunacion_covid', keys, chunk.to_reader(str.lower))
+        return chunk.rows
+    add_new_elements_to_lake('vacunacion', 'lk_vacunacion_covid', keys, chunk)
+    return chunk.height
+
+def _incremental_since(since: str, lookback_days: int) -> str:
+    """
+    Inicio de la ventana incremental: la última FECHA_APLICACION cargada menos los días de traslape
+    """
+    watermark = get_watermark('vacunacion', WATERMARK_SOURCE)
+    if watermark is None or watermark['fecha'] is None:
+        logging.info(f" |- Sin watermark para {WATERMARK_SOURCE}, se carga desde {since}")
+        return since
+    desde = (watermark['fecha'] - timedelta(days=lookback_days)).date().isoformat()
+    logging.info(f" |- Watermark {WATERMARK_SOURCE} en {watermark['fecha']}, carga incremental desde {desde}")
+    return desde
+
+def load_lake_db_vacunacion_covid(since: str, until: str, chunk_size: int = 1000000, max_workers: int = 4,
+                                  fetch_mode: str = FETCH_MODE, array_size: int = FETCH_ARRAY_SIZE,
+                                  incremental: bool = False, lookback_days: int = LOOKBACK_DAYS,
+                                  resume: bool = False):
+    """
+    Carga datos de vacunación COVID en paralelo por particiones mensuales con persistencia directa en DuckDB.
+    En modo incremental solo se leen las filas desde el watermark menos lookback_days.
+    Con resume se retoma la última ejecución interrumpida: solo las particiones pendientes y cada una desde su
+    último chunk completado según lk_chunk_manifest.
+    """
+    resumed = resume_run('vacunacion', WATERMARK_SOURCE) if resume else None
+    if resumed is not None:
+        manifest, partitions, resume_keys = resumed
+        total_count = None
+    else:
+        if incremental:
+            since = _incremental_since(since, lookback_days)
+        meses = get_meses_db_vacunacion(since, until)
+        total_count = int(meses['TOTAL_COUNT'].sum())
+        logging.info(f"|- Total de registros a procesar: {total_count:,}")
+        if total_count == 0:
+            return
+        
+        # una partición por mes con datos, la fecha centinela 1900-01-01 no abre los meses vacíos hasta 2021
+        partitions = month_partitions(meses.select('ANIO', 'MES').rows(), since, until)
+        manifest, resume_keys = start_run('vacunacion', WATERMARK_SOURCE, partitions), None
+    
+    fetch_partition = partial(_fetch_partition, chunk_size=chunk_size, fetch_mode=fetch_mode, array_size=array_size,
+                              resume_keys=resume_keys)
+    processed = extract_partitions(partitions, fetch_partition, _write_chunk, max_workers, manifest=manifest)
+    logging.info(f" |- Registros procesados y almacenados en el lago: {processed:,}"
+                 + (f" de {total_count:,}" if total_count is not None else ""))
+    
+    # el watermark avanza solo cuando todas las particiones terminaron
+    last_key = get_last_key_in_lake('vacunacion', 'lk_vacunacion_covid', ['fecha_aplicacion', 'id_vac_depu'])
+    if last_key is not None:
+        set_watermark('vacunacion', WATERMARK_SOURCE, *last_key)
     
 VACUNACION_COLUMNS = ['id_vac_depu', 'fecha_aplicacion', 'punto_vacunacion', 'unicodigo', 'tipo_iden', 'num_iden', 'apellidos', 'nombres', 'nombres_completos', 'sexo', 'fecha_nacimiento', 'nacionalidad', 'etnia', 'pobla_vacuna', 'grupo_riesgo', 'nombre_vacuna', 'lote_vacuna', 'dosis_aplicada', 'profesional_aplica', 'iden_profesional_aplica', 'fase_vacuna', 'fase_vacuna_depurada', 'grupo_riesgo_depurada', 'sistema', 'registro_civil', 'id_vac_cons']
\ No newline at end of file
@@ -1,15 +1,20 @@
 import logging
-import os
-import queue
-import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Optional
+from datetime import timedelta
+from functools import partial
+from typing import Iterator, Optional, Union
 
 import polars as pl
+import pyarrow as pa
 
-from extract.config.sources import DB_REPLICA, DB_VACUNACION, get_oracle_engine
+from extract.chunking import (BatchStream, arrow_schema, cast_record_batch, date_window, keyset_batch_chunks,
+                              keyset_chunks, keyset_predicate, month_partitions)
+from extract.config.sources import (DB_REPLICA, FETCH_ARRAY_SIZE, FETCH_MODE, LOOKBACK_DAYS, iter_record_batches,
+                                    read_database)
+from extract.pipeline import extract_partitions
 from lake.init_lake import add_new_elements_to_lake
+from lake.manifest import resume_run, start_run
+from lake.watermark import get_max_values_in_lake, get_watermark, set_watermark
 
 VACUNACION_REGULAR_SCHEMA = {
     "ID":pl.Int64,
@@ -17,35 +22,47 @@ VACUNACION_REGULAR_SCHEMA = {
     "ACTIVO":pl.Int64, 
     "PACIENTE_ID":pl.Int64,
     "PERSONA_ID":pl.Int64,
-    "FECHAVACUNACION" :pl.Date,
+    "FECHAVACUNACION" :pl.Datetime,
     "NUMEROIDENTIFICACION" :pl.String,
-    "FECHANACIMIENTO":pl.Date,
+    "FECHANACIMIENTO":pl.Datetime,
     "ESTADO":pl.Int64,
     "CTSEXO_ID":pl.Int64, 
     "SEXO":pl.String,
+    "FECHACREACION":pl.Datetime,
+    "FECHAMODIFICACION":pl.Datetime,
     "ENTIDAD_ID":pl.Int64,
     "ESQUEMAVACUNACION_ID":pl.Int64,
-    "ID":pl.Int64,
-    "ESTADO":pl.Int64,
-    "FECHACREACION":pl.Date,
-    "FECHAMODIFICACION":pl.Date,
+    "ESTADO_PACIENTE":pl.Int64,
+    "FECHACREACION_PACIENTE":pl.Datetime,
+    "FECHAMODIFICACION_PACIENTE":pl.Datetime,
     "PUNTOVACUNACION_ID":pl.Int64,
     "LOTE":pl.String,
     "FASEVACUNACION":pl.String,
     "REFUERZO":pl.String
 }
 
-def get_db_vacunacion_rutinario_chunk(since: str, until: str, offset: int = 0, chunk_size: int = 100000) -> pl.DataFrame:
-    """
-    Versión optimizada de la consulta con mejores prácticas SQL
-    """
-    db_vacunacion_engine = get_oracle_engine(DB_REPLICA)
+VACUNACION_REGULAR_ARROW_SCHEMA = arrow_schema(VACUNACION_REGULAR_SCHEMA)
+
+# llave de paginación, R.ID es la llave primaria de REGISTROVACUNACION
+VACUNACION_REGULAR_KEY_COLUMNS = ["ID"]
+
+WATERMARK_SOURCE = 'db_vacunacion_rutinario'
+
+def _query_db_vacunacion_rutinario_chunk(since: str, until: str, last_key: Optional[tuple], chunk_size: int,
+                                         delta: Optional[dict] = None) -> tuple[str, dict]:
+    seek, params = keyset_predicate(["R.ID"], last_key)
+    
+    # en modo incremental solo registros nuevos (R.ID) o personas modificadas desde el watermark
+    delta_filter = "1 = 1"
+    if delta is not None:
+        delta_filter = "(R.ID > :wm_id OR pe.FECHAMODIFICACION >= :wm_desde)"
+        params = {**params, **delta}
     
-    # Query optimizada con hints de Oracle y ORDER BY para consistencia
+    # Query paginada por llave (seek) sobre la llave primaria del registro
     query = f"""
-            SELECT /*+ FIRST_ROWS({chunk_size}) INDEX_RANGE_SCAN */
+            SELECT /*+ FIRST_ROWS({chunk_size}) */
                 R.ID,
-                'HACUE_AMED',
+                'HACUE_AMED' AS HACUE_AMED,
                 P.ACTIVO ,
                 r.PACIENTE_ID,
                 PE.ID AS PERSONA_ID,
@@ -59,10 +76,9 @@ def get_db_vacunacion_rutinario_chunk(since: str, until: str, offset: int = 0, c
                 pe.FECHAMODIFICACION ,
                 R.ENTIDAD_ID,
                 R.ESQUEMAVACUNACION_ID,
-                P.ID,
-                P.ESTADO ,
-                P.FECHACREACION ,
-                P.FECHAMODIFICACION ,
+                P.ESTADO AS ESTADO_PACIENTE,
+                P.FECHACREACION AS FECHACREACION_PACIENTE,
+                P.FECHAMODIFICACION AS FECHAMODIFICACION_PACIENTE,
                 R.PUNTOVACUNACION_ID,
                 R.LOTE,
                 R.FASEVACUNACION,
@@ -71,49 +87,160 @@ def get_db_vacunacion_rutinario_chunk(since: str, until: str, offset: int = 0, c
             HCUE_AMED.REGISTROVACUNACION R INNER JOIN HCUE_AMED.PACIENTE P ON
             R.PACIENTE_ID = P.ID INNER JOIN HCUE_SISTEMA.PERSONA PE ON
             PE.ID = p.PERSONA_ID LEFT JOIN HCUE_CATALOGOS.DETALLECATALOGO d ON d.ID = pe.CTSEXO_ID 
-            WHERE r.FECHAVACUNACION BETWEEN TO_DATE('{since}', 'YYYY-MM-DD') AND TO_DATE('{until}', 'YYYY-MM-DD')
-            OFFSET {offset} ROWS FETCH NEXT {chunk_size} ROWS ONLY
+            WHERE r.FECHAVACUNACION >= TO_DATE('{since}', 'YYYY-MM-DD')
+            AND r.FECHAVACUNACION < TO_DATE('{until}', 'YYYY-MM-DD')
+            AND {delta_filter}
+            AND {seek}
+            ORDER BY R.ID
+            FETCH FIRST {chunk_size} ROWS ONLY
             """
+    return query, params
+
+
+def get_db_vacunacion_rutinario_chunk(since: str, until: str, last_key: Optional[tuple] = None,
+                                      chunk_size: int = 100000, delta: Optional[dict] = None) -> pl.DataFrame:
+    """
+    Obtiene el siguiente chunk de la partición [since, until) ordenado por R.ID a partir de last_key
+    """
+    query, params = _query_db_vacunacion_rutinario_chunk(since, until, last_key, chunk_size, delta)
     
     try:
         start_time = time.time()
-        df = pl.read_database(query, connection=db_vacunacion_engine.connect(), infer_schema_length=None)
+        df = read_database(DB_REPLICA, query, params, infer_schema_length=None)
         end_time = time.time()
         logging.debug(f" |- Chunk consultado en {end_time - start_time:.2f} segundos")
         return df
     except Exception as e:
-        logging.error(f"Error en consulta chunk offset {offset}: {e}")
-        return pl.DataFrame()
+        # sin OFFSET no es posible saltar el chunk, un chunk vacío terminaría la paginación sin aviso
+        logging.error(f"Error en consulta chunk después de la llave {last_key}: {e}")
+        raise
+
+
+def get_db_vacunacion_rutinario_batches(since: str, until: str, last_key: Optional[tuple] = None,
+                                        chunk_size: int = 100000, array_size: int = FETCH_ARRAY_SIZE,
+                                        delta: Optional[dict] = None) -> Iterator[pa.RecordBatch]:
+    """
+    Igual que get_db_vacunacion_rutinario_chunk pero entrega el chunk en record batches de Arrow ya casteados a
+    VACUNACION_REGULAR_SCHEMA
+    """
+    query, params = _query_db_vacunacion_rutinario_chunk(since, until, last_key, chunk_size, delta)
+    try:
+        for batch in iter_record_batches(DB_REPLICA, query, params, array_size):
+            yield cast_record_batch(batch, VACUNACION_REGULAR_ARROW_SCHEMA)
+    except Exception as e:
+        logging.error(f"Error en consulta chunk después de la llave {last_key}: {e}")
+        raise
 
 
 def get_count_db_vacunacion_rutinario(since, until):
-    db_vacunacion_engine = get_oracle_engine(DB_REPLICA)
+    # misma ventana semiabierta de date_partitions, FECHAVACUNACION trae hora
+    since, until = date_window(since, until)
     query = f"""
             SELECT
                 count(*) as TOTAL_COUNT
             FROM
                 HCUE_AMED.REGISTROVACUNACION R
             WHERE
-                R.FECHAVACUNACION > TO_DATE('{since}', 'yyyy-mm-dd') 
+                R.FECHAVACUNACION >= TO_DATE('{since}', 'yyyy-mm-dd') 
                 AND R.FECHAVACUNACION < TO_DATE('{until}', 'yyyy-mm-dd')
             """  # Replace with actual query
-    df = pl.read_database(query, connection=db_vacunacion_engine.connect())
+    df = read_database(DB_REPLICA, query)
     return df['TOTAL_COUNT'][0]
 
 
-def load_lake_db_vacunacion_rutinario(since, until, chunk_size=100000):
+def get_meses_db_vacunacion_rutinario(since, until) -> pl.DataFrame:
+    """
+    Filas por mes (ANIO, MES, TOTAL_COUNT) dentro de la ventana, solo los meses con datos
+    """
+    since, until = date_window(since, until)
+    query = f"""
+            SELECT
+                EXTRACT(YEAR FROM R.FECHAVACUNACION) AS ANIO,
+                EXTRACT(MONTH FROM R.FECHAVACUNACION) AS MES,
+                COUNT(*) AS TOTAL_COUNT
+            FROM
+                HCUE_AMED.REGISTROVACUNACION R
+            WHERE
+                R.FECHAVACUNACION >= TO_DATE('{since}', 'yyyy-mm-dd') 
+                AND R.FECHAVACUNACION < TO_DATE('{until}', 'yyyy-mm-dd')
+            GROUP BY EXTRACT(YEAR FROM R.FECHAVACUNACION), EXTRACT(MONTH FROM R.FECHAVACUNACION)
+            """
+    return read_database(DB_REPLICA, query)
+
+
+def _fetch_partition(since: str, until: str, chunk_size: int, fetch_mode: str, array_size: int,
+                     delta: Optional[dict] = None, resume_keys: Optional[dict] = None):
+    # al retomar una ejecución la partición continúa después del último chunk completado
+    start_key = (resume_keys or {}).get((since, until))
+    if fetch_mode == 'arrow':
+        fetch_batches = partial(get_db_vacunacion_rutinario_batches, since, until, array_size=array_size, delta=delta)
+        yield from keyset_batch_chunks(fetch_batches, VACUNACION_REGULAR_KEY_COLUMNS, chunk_size, start_key)
+        return
+    fetch_chunk = partial(get_db_vacunacion_rutinario_chunk, since, until, delta=delta)
+    yield from keyset_chunks(fetch_chunk, VACUNACION_REGULAR_KEY_COLUMNS, chunk_size, start_key)
+
+
+def _write_chunk(chunk: Union[pl.DataFrame, BatchStream]) -> int:
+    # R.ID es la llave primaria del registro; en modo incremental vuelven registros de personas modificadas y se
+    # reemplazan con los datos actuales
+    keys = ['ID']
+    if isinstance(chunk, BatchStream):
+        add_new_elements_to_lake('vacunacion', 'db_vacunacion_rutinario', keys, chunk.to_reader(), mode='upsert')
+        return chunk.rows
+    add_new_elements_to_lake('vacunacion', 'db_vacunacion_rutinario', keys, chunk, mode='upsert')
+    return chunk.height
+
+
+def _incremental_delta(lookback_days: int) -> Optional[dict]:
+    """
+    Filtro incremental a partir del watermark: último R.ID cargado y FECHAMODIFICACION menos los días de traslape
+    """
+    watermark = get_watermark('vacunacion', WATERMARK_SOURCE)
+    if watermark is None or watermark['llave'] is None:
+        logging.info(f" |- Sin watermark para {WATERMARK_SOURCE}, se realiza la carga completa")
+        return None
+    wm_desde = watermark['fecha'] - timedelta(days=lookback_days) if watermark['fecha'] is not None else None
+    logging.info(f" |- Watermark {WATERMARK_SOURCE}: R.ID > {watermark['llave']} o modificados desde {wm_desde}")
+    return {"wm_id": int(watermark['llave']), "wm_desde": wm_desde}
+
+
+def load_lake_db_vacunacion_rutinario(since, until, chunk_size=100000, max_workers=4,
+                                      fetch_mode=FETCH_MODE, array_size=FETCH_ARRAY_SIZE,
+                                      incremental=False, lookback_days=LOOKBACK_DAYS, resume=False):
     """
-    Carga los datos en el lago de datos desde la base de datos en chunks
+    Carga los datos en el lago de datos desde la base de datos en chunks, particionando por mes en paralelo.
+    En modo incremental solo se leen los registros posteriores al watermark en una sola partición.
+    Con resume se retoma la última ejecución interrumpida desde lk_chunk_manifest.
     """
-    total_count = get_count_db_vacunacion_rutinario(since, until)
-    logging.info(f"|- Total de registros a procesar: {total_count:,}")
+    delta = _incremental_delta(lookback_days) if incremental else None
+    resumed = resume_run('vacunacion', WATERMARK_SOURCE) if resume else None
+    resume_keys = None
+    if resumed is not None:
+        manifest, partitions, resume_keys = resumed
+        total_count = None
+    elif delta is not None:
+        # el delta es pequeño y se resuelve por R.ID, no se justifica contar ni particionar la ventana
+        partitions = [date_window(since, until)]
+        total_count = None
+    else:
+        meses = get_meses_db_vacunacion_rutinario(since, until)
+        total_count = int(meses['TOTAL_COUNT'].sum())
+        logging.info(f"|- Total de registros a procesar: {total_count:,}")
+        if total_count == 0:
+            return
+        # una partición por mes con datos, una fecha centinela no abre los meses vacíos intermedios
+        partitions = month_partitions(meses.select('ANIO', 'MES').rows(), since, until)
+    if resumed is None:
+        manifest = start_run('vacunacion', WATERMARK_SOURCE, partitions)
     
-    offset = 0
+    fetch_partition = partial(_fetch_partition, chunk_size=chunk_size, fetch_mode=fetch_mode, array_size=array_size,
+                              delta=delta, resume_keys=resume_keys)
+    processed = extract_partitions(partitions, fetch_partition, _write_chunk, max_workers, manifest=manifest)
+    logging.info(f" |- Registros procesados y almacenados en el lago: {processed:,}"
+                 + (f" de {total_count:,}" if total_count is not None else ""))
     
-    while offset < total_count:
-        logging.info(f" |- Procesando chunk con offset {offset}")
-        df_chunk = get_db_vacunacion_rutinario_chunk(since, until, offset, chunk_size)
-        add_new_elements_to_lake('vacunacion', 'db_vacunacion_rutinario', ['NUMEROIDENTIFICACION', 'FECHAVACUNACION', 'PUNTOVACUNACION_ID'], df_chunk)
-        offset += chunk_size
-        logging.info(f" |- Chunk con offset {offset} procesado y almacenado en el lago")
+    # el watermark avanza solo cuando todas las particiones terminaron
+    max_values = get_max_values_in_lake('vacunacion', 'db_vacunacion_rutinario', ['FECHAMODIFICACION', 'ID'])
+    if max_values is not None:
+        set_watermark('vacunacion', WATERMARK_SOURCE, *max_values)
 
@@ -1,10 +1,9 @@
 import polars as pl
 
-from extract.config.sources import DB_GEOSALUD, get_oracle_engine
+from extract.config.sources import DB_GEOSALUD, read_database
 
 
 def get_geo_salud_data():
-    db_geo_salud_data = get_oracle_engine(DB_GEOSALUD)
     query = f"""
             SELECT
                 UNI_CODIGO,
@@ -25,5 +24,5 @@ def get_geo_salud_data():
             FROM
                 SYAPP.VM_ESTABLECIMIENTOS_INGRESADOS
             """
-    df = pl.read_database(query, connection=db_geo_salud_data.connect())
+    df = read_database(DB_GEOSALUD, query)
     return df
\ No newline at end of file
@@ -1,27 +1,31 @@
 import logging
+from functools import partial
 
+from extract.config.sources import FETCH_ARRAY_SIZE, FETCH_MODE, LOOKBACK_DAYS, get_pool_stats
 from extract.db_vacunacion_covid import load_lake_db_vacunacion_covid
 from extract.db_vacunacion_rutinario import load_lake_db_vacunacion_rutinario
 from extract.geo_salud import get_geo_salud_data
-from extract.mpi import get_mpi_data
+from extract.mpi import stream_mpi_data
+from lake.historial import create_historial
 from lake.init_lake import add_new_elements_to_lake
-from lake.load_lake import get_identificaciones_data
+from lake.load_lake import iter_identificaciones_pendientes
 
 
-def ingest_vacunacion(since, until, chunk_size=500000, max_workers=4, use_cache=True):
-    load_lake_db_vacunacion_rutinario(since, until, chunk_size, max_workers, use_cache)
-    
-    # Cargar datos desde el lago para obtener las identificaciones
-    logging.info("|- Cargando datos desde el lago para procesamiento posterior")
-    df = get_identificaciones_data('vacunacion_esquema', 'lk_vacunacion_rutinario', 'NUMEROIDENTIFICACION')
+def _ingest_personas(db: str, table: str, column_id: str, max_workers: int):
+    # las identificaciones pendientes se leen del lago en lotes y cada lote pasa directo a la consulta del MPI
+    identifications = iter_identificaciones_pendientes(db, table, column_id)
+    stream_mpi_data(identifications, partial(add_new_elements_to_lake, db, 'lk_persona', ['IDENTIFIER_VALUE']),
+                    max_workers)
+
+
+def ingest_vacunacion(since, until, chunk_size=500000, max_workers=4, fetch_mode=FETCH_MODE,
+                      array_size=FETCH_ARRAY_SIZE, incremental=False, lookback_days=LOOKBACK_DAYS, resume=False):
+    load_lake_db_vacunacion_rutinario(since, until, chunk_size, max_workers, fetch_mode, array_size,
+                                      incremental, lookback_days, resume)
     
-    # datos del registro civil
+    # datos del registro civil para las identificaciones del lago que aún no están en lk_persona
     logging.info("|- Procesando datos del registro civil (MPI)")
-    unique_identifiers = df['num_iden'].drop_nulls().drop_nans().unique().to_list()
-    logging.info(f" |- Total de identificaciones únicas: {len(unique_identifiers):,}")
-    
-    mpi_df = get_mpi_data(unique_identifiers)
-    add_new_elements_to_lake('vacunacion_esquema', 'lk_persona', ['IDENTIFIER_VALUE'], mpi_df)
+    _ingest_personas('vacunacion_esquema', 'lk_vacunacion_rutinario', 'NUMEROIDENTIFICACION', max_workers)
 
     ## obtener datos geográficos
     logging.info("|- Procesando datos geográficos")
@@ -30,39 +34,40 @@ def ingest_vacunacion(since, until, chunk_size=500000, max_workers=4, use_cache=
     
     
     
-def ingest_vacunacion_covid(since, until, chunk_size=1000000):
+def ingest_vacunacion_covid(since, until, chunk_size=1000000, max_workers=4, fetch_mode=FETCH_MODE,
+                            array_size=FETCH_ARRAY_SIZE, incremental=False, lookback_days=LOOKBACK_DAYS, resume=False):
     """
     Orquestador de ingesta optimizado con parámetros configurables
     """
     logging.info("|- Usando versión paralela con persistencia automática")
     
     # La función ya no retorna DataFrame, persiste directamente en una base de datos duckdb
-    load_lake_db_vacunacion_covid(since, until, chunk_size)
+    load_lake_db_vacunacion_covid(since, until, chunk_size, max_workers, fetch_mode, array_size,
+                                  incremental, lookback_days, resume)
     
     ## obtiene los datos de vacunación de rutina
     ##get_db_vacunaciones_parallel_rutinario(since, until, chunk_size, max_workers)
     
-    # Cargar datos desde el lago para obtener las identificaciones
-    logging.info("|- Cargando datos desde el lago para procesamiento posterior")
-    df = get_identificaciones_data('vacunacion', 'lk_vacunacion_covid', 'num_iden')
-    print(df.head())  # IGNORE
-    
-    # datos del registro civil
+    # datos del registro civil para las identificaciones del lago que aún no están en lk_persona
     logging.info("|- Procesando datos del registro civil (MPI)")
-    unique_identifiers = df['num_iden'].drop_nulls().drop_nans().unique().to_list()
-    logging.info(f" |- Total de identificaciones únicas: {len(unique_identifiers):,}")
-    
-    mpi_df = get_mpi_data(unique_identifiers)
-    add_new_elements_to_lake('vacunacion', 'lk_persona', ['IDENTIFIER_VALUE'], mpi_df)
+    _ingest_personas('vacunacion', 'lk_vacunacion_covid', 'num_iden', max_workers)
 
     ## obtener datos geográficos
     logging.info("|- Procesando datos geográficos")
     geo_df = get_geo_salud_data()
     add_new_elements_to_lake('vacunacion', 'lk_establecimiento', ['uni_codigo'], geo_df)
     
+    for source, stats in get_pool_stats().items():
+        logging.info(f" |- Pool {source}: {stats['checkouts']:,} conexiones, "
+                     f"espera total {stats['wait_seconds']:.2f}s, máxima {stats['max_wait_seconds']:.2f}s")
     logging.info("|- Orquestador de ingesta completado")
 
-def ingest_orchester(since, until, chunk_size=1000000):
-    ingest_vacunacion_covid(since, until, chunk_size)
+def ingest_orchester(since, until, chunk_size=1000000, max_workers=4, fetch_mode=FETCH_MODE,
+                     array_size=FETCH_ARRAY_SIZE, incremental=False, lookback_days=LOOKBACK_DAYS, resume=False):
+    # el historial por persona se mantiene con cada chunk que llega al lago
+    create_historial()
+    ingest_vacunacion_covid(since, until, chunk_size, max_workers, fetch_mode, array_size, incremental, lookback_days,
+                            resume)
     ##
-    ##ingest_vacunacion(since, until, chunk_size)
\ No newline at end of file
+    ##ingest_vacunacion(since, until, chunk_size, max_workers, fetch_mode, array_size, incremental, lookback_days,
+    ##                  resume)
\ No newline at end of file
@@ -1,14 +1,24 @@
 import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
 
 import polars as pl
+import pyarrow as pa
 
-from extract.config.sources import DB_MIP, get_oracle_engine
+from extract.config.sources import DB_MIP, SOURCE_BACKEND, oracle_connection, read_database
 
+# por configuracion solo se puede traer en chunks de 999
+MPI_CHUNK_SIZE = 999
+# 'batches' consulta IN (...) en paralelo, 'temp_table' carga las identificaciones en una tabla temporal de sesión
+MPI_LOOKUP_METHOD = os.getenv("MPI_LOOKUP_METHOD", "batches")
+# filas de personas que se acumulan antes de escribirlas
+MPI_WRITE_ROWS = 100_000
+# identificaciones por INSERT en la tabla temporal de sesión
+MPI_TEMP_TABLE_BATCH = 50_000
 
-def get_mpi_data_chunk(identifications: list[str]) -> pl.DataFrame:
-    db_mpi_data = get_oracle_engine(DB_MIP)
-    query = f"""
-            SELECT
+MPI_COLUMNS = """
                 EC_IDENTIFIER_OID,
                 IDENTIFIER_VALUE,
                 GENDER,
@@ -20,27 +30,135 @@ def get_mpi_data_chunk(identifications: list[str]) -> pl.DataFrame:
                 NAME_USE,
                 NAME_TEXT,
                 NAME_FAMILY,
-                NAME_GIVEN
+                NAME_GIVEN"""
+
+# siempre con el mismo número de variables, Oracle reutiliza el plan de la consulta en todos los chunks
+MPI_CHUNK_QUERY = f"""
+            SELECT{MPI_COLUMNS}
             FROM
                 MPI.PERSON
             WHERE
-                IDENTIFIER_VALUE IN ({','.join(map(repr, identifications))})
-            AND
-            ROWNUM < 10
+                IDENTIFIER_VALUE IN ({', '.join([f':i{i}' for i in range(MPI_CHUNK_SIZE)])})
             """
-    df = pl.read_database(query, connection=db_mpi_data.connect())
+
+
+def get_mpi_data_chunk(identifications: list[str]) -> pl.DataFrame:
+    # los lugares vacíos se completan con NULL, IN (NULL) no coincide con ninguna fila
+    params = {f"i{i}": identifications[i] if i < len(identifications) else None for i in range(MPI_CHUNK_SIZE)}
+    df = read_database(DB_MIP, MPI_CHUNK_QUERY, params)
     return df
 
 
-def get_mpi_data(identifications: list[str]) -> pl.DataFrame:
+def _identification_chunks(batches: Iterable[pa.RecordBatch], size: int,
+                           column: str = 'num_iden') -> Iterator[list[str]]:
+    # solo el lote en curso se convierte a str de Python, en listas del tamaño de la consulta
+    carry: list[str] = []
+    for batch in batches:
+        carry.extend(batch.column(column).to_pylist())
+        # se recorre con un índice y solo la cola sin completar pasa al siguiente lote
+        start = 0
+        while len(carry) - start >= size:
+            yield carry[start:start + size]
+            start += size
+        carry = carry[start:]
+    if carry:
+        yield carry
+
+
+class _PersonBuffer:
+    """
+    Acumula los resultados del MPI y los entrega a write en bloques de MPI_WRITE_ROWS filas
+    """
+
+    def __init__(self, write: Callable[[pl.DataFrame], object]):
+        self.write = write
+        self.frames: list[pl.DataFrame] = []
+        self.rows = 0
+        self.found = 0
+
+    def add(self, df: pl.DataFrame):
+        if df.is_empty():
+            return
+        self.frames.append(df)
+        self.rows += df.height
+        self.found += df.height
+        if self.rows >= MPI_WRITE_ROWS:
+            self.flush()
+
+    def flush(self):
+        if self.frames:
+            self.write(pl.concat(self.frames, how="diagonal_relaxed"))
+        self.frames, self.rows = [], 0
+
+
+def _stream_mpi_data_batches(batches: Iterable[pa.RecordBatch], buffer: _PersonBuffer, max_workers: int) -> int:
+    logging.info(f" |- Consultando chunks de {MPI_CHUNK_SIZE} identificaciones con {max_workers} workers")
+    requested = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # a lo sumo dos consultas por worker en vuelo, la lectura del lago avanza al ritmo del MPI
+        in_flight = deque()
+        for chunk in _identification_chunks(batches, MPI_CHUNK_SIZE):
+            in_flight.append(executor.submit(get_mpi_data_chunk, chunk))
+            requested += len(chunk)
+            if len(in_flight) >= max_workers * 2:
+                buffer.add(in_flight.popleft().result())
+        while in_flight:
+            buffer.add(in_flight.popleft().result())
+    return requested
+
+
+def _stream_mpi_data_temp_table(batches: Iterable[pa.RecordBatch], buffer: _PersonBuffer) -> int:
+    """
+    Carga las identificaciones en una tabla temporal privada de la sesión y resuelve la búsqueda con un solo join
+    """
+    logging.info(" |- Cargando identificaciones en tabla temporal de sesión")
+    requested = 0
+    with oracle_connection(DB_MIP) as connection:
+        connection.exec_driver_sql("""
+            CREATE PRIVATE TEMPORARY TABLE ORA$PTT_MPI_IDS (ID_BUSQUEDA VARCHAR2(64))
+            ON COMMIT PRESERVE DEFINITION
+            """)
+        try:
+            for chunk in _identification_chunks(batches, MPI_TEMP_TABLE_BATCH):
+                connection.exec_driver_sql("INSERT INTO ORA$PTT_MPI_IDS (ID_BUSQUEDA) VALUES (:1)",
+                                           [(identification,) for identification in chunk])
+                requested += len(chunk)
+            query = f"""
+                SELECT{MPI_COLUMNS}
+                FROM
+                    MPI.PERSON P INNER JOIN ORA$PTT_MPI_IDS T ON P.IDENTIFIER_VALUE = T.ID_BUSQUEDA
+                """
+            for df in pl.read_database(query, connection=connection, iter_batches=True, batch_size=MPI_WRITE_ROWS):
+                buffer.add(df)
+        finally:
+            connection.exec_driver_sql("DROP TABLE ORA$PTT_MPI_IDS")
+    return requested
+
+
+def stream_mpi_data(batches: Iterable[pa.RecordBatch], write: Callable[[pl.DataFrame], object],
+                    max_workers: int = 4, method: str = MPI_LOOKUP_METHOD) -> tuple[int, int]:
+    """
+    Consulta en el MPI las identificaciones de la columna num_iden de los record batches a medida que llegan y
+    entrega las personas encontradas a write en bloques de MPI_WRITE_ROWS filas. En memoria solo quedan el lote
+    en curso, las consultas en vuelo y un bloque de personas.
+    Retorna (identificaciones consultadas, personas encontradas).
+    """
+    buffer = _PersonBuffer(write)
+    # la fuente local no soporta tablas temporales privadas de Oracle
+    if method == 'temp_table' and SOURCE_BACKEND != 'local':
+        requested = _stream_mpi_data_temp_table(batches, buffer)
+    else:
+        requested = _stream_mpi_data_batches(batches, buffer, max_workers)
+    buffer.flush()
+    logging.info(f" |- MPI: {requested:,} identificaciones consultadas, {buffer.found:,} personas encontradas")
+    return requested, buffer.found
+
+
+def get_mpi_data(identifications: list[str], max_workers: int = 4, method: str = MPI_LOOKUP_METHOD) -> pl.DataFrame:
     logging.info(f"|- MPI Obteniendo datos del MPI para {len(identifications)} identificaciones")
-    chunk_size = 999
+    if not identifications:
+        return pl.DataFrame()
     dfs = []
-    # por configuracion solo se puede traer en chunks de 999
-    for i in range(0, len(identifications), chunk_size):
-        logging.info(f" |- Fetching chunk {i // chunk_size + 1} de {(len(identifications) - 1) // chunk_size + 1}")
-        chunk = identifications[i:i + chunk_size]
-        df = get_mpi_data_chunk(chunk)
-        dfs.append(df)
-    df = pl.concat(dfs)
-    return df
+    batch = pa.RecordBatch.from_pydict({'num_iden': pa.array(identifications, pa.string())})
+    stream_mpi_data([batch], dfs.append, max_workers, method)
+    return pl.concat(dfs) if dfs else pl.DataFrame()
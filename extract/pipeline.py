@@ -0,0 +1,168 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, Union
+
+import polars as pl
+import pyarrow as pa
+
+from extract.chunking import BatchStream, KeysetChunk
+
+# batches en tránsito por chunk, acota la memoria de los chunks que esperan al escritor en modo arrow
+CHANNEL_SIZE = 4
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException, start: Optional[str] = None, end: Optional[str] = None):
+        self.error = error
+        self.start = start
+        self.end = end
+
+
+class _PartitionDone:
+    def __init__(self, start: str, end: str, rows: int, duration: float):
+        self.start = start
+        self.end = end
+        self.rows = rows
+        self.duration = duration
+
+
+class _ChunkItem:
+    # chunk en la cola con su partición; en modo arrow los batches llegan por channel
+    def __init__(self, start: str, end: str, chunk: KeysetChunk, channel: Optional[queue.Queue] = None):
+        self.start = start
+        self.end = end
+        self.chunk = chunk
+        self.channel = channel
+
+
+class PipelineStopped(Exception):
+    """
+    El escritor detuvo el pipeline, los fetchers abandonan su partición
+    """
+
+
+def _put(target: queue.Queue, item, stop: threading.Event):
+    # put con espera acotada para notar a tiempo que el escritor se detuvo
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise PipelineStopped()
+
+
+def _channel_batches(channel: queue.Queue) -> Iterator[pa.RecordBatch]:
+    while True:
+        item = channel.get()
+        if item is _END:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+def extract_partitions(partitions: list[tuple[str, str]],
+                       fetch_partition: Callable[[str, str], Iterator[Union[KeysetChunk, pl.DataFrame, BatchStream]]],
+                       write_chunk: Callable[[Union[pl.DataFrame, BatchStream]], int],
+                       max_workers: int = 4,
+                       queue_size: int = 0,
+                       manifest=None) -> int:
+    """
+    Pipeline productor/consumidor: max_workers fetchers leen particiones de la fuente y dejan los chunks en una
+    cola acotada, el hilo que llama escribe los chunks al lago uno a la vez. Mientras se escribe el chunk N los
+    fetchers ya están trayendo el N+1; si la cola se llena los fetchers esperan (backpressure).
+    En modo arrow cada chunk viaja como un canal de a lo sumo CHANNEL_SIZE batches, sin materializarse.
+    Un error en un fetcher o en el escritor detiene todo el pipeline y se propaga al llamador.
+    Con manifest (lake.manifest.ChunkManifest) el escritor registra cada chunk escrito y el estado de cada
+    partición, desde el mismo hilo que escribe al lago.
+    Retorna el total de filas escritas.
+    """
+    chunks: queue.Queue = queue.Queue(maxsize=queue_size or max_workers)
+    stop = threading.Event()
+
+    def _produce(start: str, end: str):
+        rows = 0
+        started_at = time.perf_counter()
+        try:
+            for number, chunk in enumerate(fetch_partition(start, end), start=1):
+                if not isinstance(chunk, KeysetChunk):
+                    chunk = KeysetChunk(chunk, number, None, started_at=time.perf_counter())
+                if isinstance(chunk.data, BatchStream):
+                    channel: queue.Queue = queue.Queue(maxsize=CHANNEL_SIZE)
+                    _put(chunks, _ChunkItem(start, end, chunk, channel), stop)
+                    try:
+                        for batch in chunk.data:
+                            _put(channel, batch, stop)
+                    except PipelineStopped:
+                        raise
+                    except BaseException as e:
+                        _put(channel, _Failure(e), stop)
+                        raise PipelineStopped() from e
+                    _put(channel, _END, stop)
+                else:
+                    _put(chunks, _ChunkItem(start, end, chunk), stop)
+                rows += chunk.rows
+            _put(chunks, _PartitionDone(start, end, rows, time.perf_counter() - started_at), stop)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            logging.error(f" |- Error extrayendo la partición [{start}, {end}): {e}")
+            try:
+                _put(chunks, _Failure(e, start, end), stop)
+            except PipelineStopped:
+                pass
+
+    def _write(item: _ChunkItem) -> int:
+        chunk = item.chunk
+        data = chunk.data
+        if item.channel is not None:
+            batches = _channel_batches(item.channel)
+            data = BatchStream(next(batches), batches, [])
+        try:
+            rows = write_chunk(data)
+        except BaseException as e:
+            if manifest is not None:
+                manifest.chunk_failed(item.start, item.end, chunk.number, chunk.key_from, chunk.attempts,
+                                      time.perf_counter() - chunk.started_at, str(e))
+                manifest.partition_failed(item.start, item.end, str(e))
+            raise
+        # el stream del productor ya se agotó al terminar la escritura, key_to es la última llave del chunk
+        if manifest is not None:
+            manifest.chunk_completed(item.start, item.end, chunk.number, chunk.key_from, chunk.key_to, rows,
+                                     chunk.attempts, time.perf_counter() - chunk.started_at)
+        return rows
+
+    processed = 0
+    pending = len(partitions)
+    logging.info(f" |- Extrayendo {len(partitions)} particiones con {max_workers} workers")
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for start, end in partitions:
+            executor.submit(_produce, start, end)
+        while pending:
+            item = chunks.get()
+            if isinstance(item, _Failure):
+                if manifest is not None and item.start is not None:
+                    manifest.partition_failed(item.start, item.end, str(item.error))
+                raise item.error
+            if isinstance(item, _PartitionDone):
+                pending -= 1
+                logging.info(f" |- Partición [{item.start}, {item.end}) completada con {item.rows:,} filas")
+                if manifest is not None:
+                    manifest.partition_completed(item.start, item.end, item.rows, item.duration)
+                continue
+            processed += _write(item)
+            logging.info(f" |- Chunk almacenado en el lago ({processed:,} filas acumuladas)")
+    except BaseException:
+        logging.error(" |- Deteniendo la extracción, se cancelan las particiones pendientes")
+        raise
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+    return processed
@@ -0,0 +1,344 @@
+import logging
+import os
+from datetime import date
+
+import duckdb
+import numpy as np
+import polars as pl
+
+from extract.config.local_source import LOCAL_SOURCE_PATH, LOCAL_SOURCE_SCHEMAS
+
+# filas generadas por bloque, acota la memoria sin importar el tamaño total
+BLOCK_SIZE = 1_000_000
+
+SENTINEL_DATE = date(1900, 1, 1)
+
+# proporciones observadas en producción, aproximadas
+CEDULA_INVALIDA = 0.04
+CEDULA_SIN_CERO = 0.02
+FECHA_CENTINELA = 0.005
+
+# nombres de vacuna con la distribución sesgada de la campaña COVID (pocas marcas concentran casi todo)
+VACUNAS_COVID = {
+    "BNT162B2 PFIZER": 0.46,
+    "CORONAVAC SINOVAC": 0.27,
+    "ASTRAZENECA": 0.12,
+    "OMICROM": 0.05,
+    "CANSINO": 0.03,
+    "SPIKEVAX MAYOR DE 5 AÑOS": 0.025,
+    "COMIRNATY BIVALENTE": 0.02,
+    "SPUTNIK V": 0.005,
+    "JANSSEN": 0.003,
+    "SINOPHARM": 0.001,
+    "OTRA VACUNA": 0.001,
+}
+
+PROVINCIAS = ["AZUAY", "BOLÍVAR", "CAÑAR", "CARCHI", "COTOPAXI", "CHIMBORAZO", "EL ORO", "ESMERALDAS", "GUAYAS",
+              "IMBABURA", "LOJA", "LOS RÍOS", "MANABÍ", "MORONA SANTIAGO", "NAPO", "PASTAZA", "PICHINCHA",
+              "TUNGURAHUA", "ZAMORA CHINCHIPE", "GALÁPAGOS", "SUCUMBÍOS", "ORELLANA", "SANTO DOMINGO DE LOS TSÁCHILAS",
+              "SANTA ELENA"]
+
+APELLIDOS = ["GARCIA", "RODRIGUEZ", "ZAMBRANO", "SANCHEZ", "VERA", "LOPEZ", "MORA", "TORRES", "CEDEÑO", "MOREIRA",
+             "PEREZ", "GONZALEZ", "CHAVEZ", "ALVARADO", "MACIAS", "QUISHPE", "GUAMAN", "CASTRO", "VELEZ", "ORTIZ"]
+NOMBRES_HOMBRE = ["JOSE", "LUIS", "JUAN", "CARLOS", "MIGUEL", "JORGE", "ANGEL", "SEGUNDO", "DAVID", "MATEO"]
+NOMBRES_MUJER = ["MARIA", "ROSA", "ANA", "CARMEN", "GABRIELA", "DIANA", "NANCY", "VALENTINA", "SOFIA", "ELENA"]
+
+ETNIAS = {"MESTIZO/A": 0.78, "MONTUBIO/A": 0.06, "AFROECUATORIANO/AFRODESCENDIENTE": 0.04, "BLANCO/A": 0.03,
+          "OTAVALO": 0.02, "SARAGURO": 0.01, "KAYAMBI": 0.01, "NO SABE/NO RESPONDE": 0.04, "NO APLICA": 0.01}
+NACIONALIDADES = {"ECUATORIANA": 0.93, "VENEZOLANA": 0.04, "COLOMBIANA": 0.02, "PERUANA": 0.01}
+
+
+def _rng(seed: int, *stream: int) -> np.random.Generator:
+    # cada tabla y bloque tiene su propia secuencia, el resultado no depende del orden de generación
+    return np.random.default_rng([seed, *stream])
+
+
+def _choice(rng: np.random.Generator, weights: dict, n: int) -> np.ndarray:
+    p = np.array(list(weights.values()), dtype=float)
+    return np.array(list(weights.keys()), dtype=object)[rng.choice(len(p), size=n, p=p / p.sum())]
+
+
+def _dates(rng: np.random.Generator, n: int, start: date, end: date, sentinel: float = 0.0) -> np.ndarray:
+    days = (end - start).days
+    values = np.datetime64(start, 'D') + rng.integers(0, days + 1, n).astype('timedelta64[D]')
+    if sentinel:
+        values[rng.random(n) < sentinel] = np.datetime64(SENTINEL_DATE, 'D')
+    return values
+
+
+def _with_time(rng: np.random.Generator, values: np.ndarray) -> np.ndarray:
+    # un DATE de Oracle trae hora: las aplicaciones caen entre las 07:00 y las 19:00, la fecha centinela queda a
+    # medianoche. Así la paginación por (fecha, id) se prueba con varias filas por día y horas distintas
+    seconds = rng.integers(7 * 3600, 19 * 3600, len(values)).astype('timedelta64[s]').astype('timedelta64[ms]')
+    values = values.astype('datetime64[ms]')
+    return np.where(values == np.datetime64(SENTINEL_DATE, 'ms'), values, values + seconds)
+
+
+def cedulas(rng: np.random.Generator, n: int, invalid: float = CEDULA_INVALIDA,
+            missing_zero: float = CEDULA_SIN_CERO) -> pl.Series:
+    """
+    Cédulas ecuatorianas con dígito verificador módulo 10. Una fracción invalid tiene el dígito verificador
+    alterado y una fracción missing_zero perdió el cero a la izquierda (9 dígitos), como llegan de la fuente.
+    """
+    provincia = rng.integers(1, 25, n)
+    digits = np.column_stack([provincia // 10, provincia % 10, rng.integers(0, 6, n), rng.integers(0, 10, (n, 6))])
+    products = digits * np.array([2, 1, 2, 1, 2, 1, 2, 1, 2])
+    products = np.where(products >= 10, products - 9, products)
+    check = (10 - products.sum(axis=1) % 10) % 10
+    wrong = rng.random(n) < invalid
+    check = np.where(wrong, (check + rng.integers(1, 10, n)) % 10, check)
+    number = (digits * 10 ** np.arange(9, 0, -1)).sum(axis=1) + check
+    values = pl.Series(number).cast(pl.String).str.zfill(10)
+    # solo las provincias 01 a 09 empiezan con cero y pueden perderlo
+    drop_zero = pl.Series((rng.random(n) < missing_zero) & (provincia < 10))
+    return pl.select(pl.when(drop_zero).then(values.str.slice(1)).otherwise(values)).to_series()
+
+
+def _pasaportes(rng: np.random.Generator, n: int) -> pl.Series:
+    letters = np.array(list("ABCDEFGHJKLMNPRSTVXYZ"), dtype=object)
+    prefix = letters[rng.integers(0, len(letters), n)] + letters[rng.integers(0, len(letters), n)]
+    return pl.Series(prefix) + pl.Series(rng.integers(1_000_000, 9_999_999, n)).cast(pl.String)
+
+
+def _personas(rng: np.random.Generator, first_id: int, n: int) -> pl.DataFrame:
+    tipo = _choice(rng, {"CÉDULA DE IDENTIDAD": 0.92, "PASAPORTE": 0.06, "NO IDENTIFICADO": 0.02}, n)
+    es_hombre = rng.random(n) < 0.49
+    nombres = np.where(es_hombre, np.array(NOMBRES_HOMBRE, dtype=object)[rng.integers(0, 10, n)],
+                       np.array(NOMBRES_MUJER, dtype=object)[rng.integers(0, 10, n)])
+    apellidos = (np.array(APELLIDOS, dtype=object)[rng.integers(0, 20, n)] + " "
+                 + np.array(APELLIDOS, dtype=object)[rng.integers(0, 20, n)])
+    df = pl.DataFrame({
+        "person_id": np.arange(first_id, first_id + n),
+        "tipo_iden": tipo,
+        "cedula": cedulas(rng, n),
+        "pasaporte": _pasaportes(rng, n),
+        "apellidos": apellidos,
+        "nombres": nombres,
+        "sexo": np.where(es_hombre, "HOMBRE", "MUJER"),
+        "fecha_nacimiento": _dates(rng, n, date(1925, 1, 1), date(2018, 12, 31), sentinel=FECHA_CENTINELA),
+        "etnia": _choice(rng, ETNIAS, n),
+        "nacionalidad": _choice(rng, NACIONALIDADES, n),
+        "en_registro_civil": rng.random(n) < 0.9,
+    })
+    return df.with_columns(
+        pl.when(pl.col("tipo_iden") == "CÉDULA DE IDENTIDAD").then(pl.col("cedula"))
+        .when(pl.col("tipo_iden") == "PASAPORTE").then(pl.col("pasaporte"))
+        .otherwise(pl.lit(None, dtype=pl.String)).alias("num_iden"),
+        (pl.col("apellidos") + " " + pl.col("nombres")).alias("nombres_completos"),
+    ).drop("cedula", "pasaporte")
+
+
+def _establecimientos(rng: np.random.Generator, n: int) -> pl.DataFrame:
+    provincia = rng.integers(0, len(PROVINCIAS), n)
+    canton = rng.integers(1, 10, n)
+    parroquia = rng.integers(1, 20, n)
+    tipos = ["CENTRO DE SALUD TIPO A", "CENTRO DE SALUD TIPO B", "CENTRO DE SALUD TIPO C", "PUESTO DE SALUD",
+             "HOSPITAL BASICO", "HOSPITAL GENERAL"]
+    tipo = np.array(tipos, dtype=object)[rng.integers(0, len(tipos), n)]
+    codigo = pl.Series(np.arange(1, n + 1)).cast(pl.String).str.zfill(6)
+    return pl.DataFrame({
+        "UNI_CODIGO": codigo,
+        "UNI_NOMBRE": pl.Series(tipo) + " " + codigo,
+        "PRV_CODIGO": pl.Series(provincia + 1).cast(pl.String).str.zfill(2),
+        "PRV_DESCRIPCION": np.array(PROVINCIAS, dtype=object)[provincia],
+        "CAN_CODIGO": pl.Series((provincia + 1) * 100 + canton).cast(pl.String).str.zfill(4),
+        "CAN_DESCRIPCION": "CANTON " + pl.Series(canton).cast(pl.String),
+        "PAR_CODIGO": pl.Series(((provincia + 1) * 100 + canton) * 100 + parroquia).cast(pl.String).str.zfill(6),
+        "PAR_DESCRIPCION": "PARROQUIA " + pl.Series(parroquia).cast(pl.String),
+        "TIPO_ENTIDAD": _choice(rng, {"MSP": 0.8, "IESS": 0.12, "PRIVADO": 0.08}, n),
+        "MAIL": pl.Series("uni" + codigo + "@salud.gob.ec"),
+        "TIPO_ESTABLECEMIENTO": tipo,
+        "LONGPS": rng.uniform(-81.0, -75.2, n).round(6),
+        "LATGPS": rng.uniform(-5.0, 1.4, n).round(6),
+        "TIPO_ATENCION": _choice(rng, {"AMBULATORIO": 0.85, "HOSPITALARIO": 0.15}, n),
+        "ZONADEFRONTERA": _choice(rng, {"NO": 0.9, "SI": 0.1}, n),
+    })
+
+
+def _skewed_index(rng: np.random.Generator, n: int, size: int) -> np.ndarray:
+    # pocos establecimientos concentran la mayoría de registros (vacunatorios masivos)
+    return (rng.zipf(1.3, n) - 1) % size
+
+
+def _covid_block(rng: np.random.Generator, first_id: int, n: int, personas: int, establecimientos: int) -> pl.DataFrame:
+    dosis = _choice(rng, {"PRIMERA": 0.38, "SEGUNDA": 0.34, "TERCERA": 0.18, "CUARTA": 0.07, "UNICA": 0.03}, n)
+    vacuna = _choice(rng, VACUNAS_COVID, n)
+    return pl.DataFrame({
+        "ID_VAC_DEPU": pl.Series(np.arange(first_id, first_id + n)).cast(pl.String).str.zfill(12),
+        "person_id": rng.integers(0, personas, n),
+        "FECHA_APLICACION": _with_time(rng, _dates(rng, n, date(2021, 1, 21), date(2023, 6, 30),
+                                                   sentinel=FECHA_CENTINELA)),
+        "establecimiento": _skewed_index(rng, n, establecimientos) + 1,
+        "NOMBRE_VACUNA": vacuna,
+        "LOTE_VACUNA": pl.Series(vacuna).str.slice(0, 2) + pl.Series(rng.integers(1000, 1200, n)).cast(pl.String),
+        "DOSIS_APLICADA": dosis,
+        "profesional": rng.integers(0, max(personas // 500, 1), n),
+        "POBLA_VACUNA": _choice(rng, {"POBLACION GENERAL": 0.8, "PERSONAL DE SALUD": 0.05,
+                                      "ADULTOS MAYORES": 0.1, "DOCENTES": 0.05}, n),
+        "GRUPO_RIESGO": _choice(rng, {"NINGUNO": 0.85, "ENFERMEDAD CATASTROFICA": 0.05, "DISCAPACIDAD": 0.04,
+                                      "EMBARAZADA": 0.03, "NO REGISTRA": 0.03}, n),
+        "FASE_VACUNA": _choice(rng, {"FASE 0": 0.02, "FASE 1": 0.18, "FASE 2": 0.6, "PLAN 9/100": 0.2}, n),
+        "SISTEMA": _choice(rng, {"PRAS": 0.7, "HCUE": 0.2, "EXCEL": 0.1}, n),
+    })
+
+
+def _rutinario_block(rng: np.random.Generator, first_id: int, n: int, total: int, pacientes: int,
+                     establecimientos: int) -> pl.DataFrame:
+    # el ID es secuencial y la fecha avanza con él, como en la tabla transaccional
+    ids = np.arange(first_id, first_id + n)
+    start = np.datetime64(date(2015, 1, 1), 'D')
+    span = (date(2024, 12, 31) - date(2015, 1, 1)).days
+    days = (ids / total * span).astype(int) + rng.integers(-15, 16, n)
+    fecha = start + np.clip(days, 0, span).astype('timedelta64[D]')
+    fecha[rng.random(n) < FECHA_CENTINELA] = np.datetime64(SENTINEL_DATE, 'D')
+    return pl.DataFrame({
+        "ID": ids,
+        "PACIENTE_ID": rng.integers(1, pacientes + 1, n),
+        "FECHAVACUNACION": _with_time(rng, fecha),
+        "ENTIDAD_ID": _skewed_index(rng, n, establecimientos) + 1,
+        "ESQUEMAVACUNACION_ID": rng.integers(1, 41, n),
+        "PUNTOVACUNACION_ID": _skewed_index(rng, n, establecimientos) + 1,
+        "LOTE": pl.Series(rng.integers(10000, 10500, n)).cast(pl.String),
+        "FASEVACUNACION": _choice(rng, {"REGULAR": 0.9, "CAMPAÑA": 0.1}, n),
+        "REFUERZO": _choice(rng, {"NO": 0.8, "SI": 0.2}, n),
+    })
+
+
+def _blocks(total: int):
+    if total == 0:
+        # un bloque vacío crea la tabla con sus columnas
+        yield 0, 0, 0
+    for number, first in enumerate(range(0, total, BLOCK_SIZE)):
+        yield number, first, min(BLOCK_SIZE, total - first)
+
+
+def generate_local_source(path: str = LOCAL_SOURCE_PATH, covid_rows: int = 1_000_000, rutinario_rows: int = 1_000_000,
+                          seed: int = 42):
+    """
+    Genera la base local que reemplaza a las fuentes Oracle con las mismas tablas y columnas que consultan los
+    extractores: vacunación COVID, vacunación de rutina (HCUE_AMED, HCUE_SISTEMA, HCUE_CATALOGOS), MPI.PERSON
+    y la vista de establecimientos de GeoSalud. El resultado es el mismo para la misma semilla.
+    Incluye cédulas válidas e inválidas, cédulas sin el cero inicial, fechas centinela 1900-01-01 y nombres de
+    vacuna con distribución sesgada.
+    """
+    logging.info(f"|- Generando fuente local en {path} (covid {covid_rows:,}, rutinario {rutinario_rows:,})")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    personas = max((covid_rows + rutinario_rows) // 3, 1000)
+    establecimientos = min(max(covid_rows // 2000, 50), 4000)
+
+    con = duckdb.connect(path)
+    try:
+        for schema in LOCAL_SOURCE_SCHEMAS:
+            con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+
+        logging.info(f" |- Generando {personas:,} personas y {establecimientos:,} establecimientos")
+        for number, first, n in _blocks(personas):
+            block = _personas(_rng(seed, 1, number), first, n)
+            con.execute("CREATE TABLE IF NOT EXISTS tmp_persona AS SELECT * FROM block LIMIT 0")
+            con.execute("INSERT INTO tmp_persona SELECT * FROM block")
+        geo = _establecimientos(_rng(seed, 2), establecimientos)
+        con.execute("CREATE TABLE SYAPP.VM_ESTABLECIMIENTOS_INGRESADOS AS SELECT * FROM geo")
+
+        logging.info(" |- Generando MPI.PERSON")
+        con.execute("""
+            CREATE TABLE MPI.PERSON AS
+            SELECT
+                '2.16.593.1.1.1' AS EC_IDENTIFIER_OID,
+                num_iden AS IDENTIFIER_VALUE,
+                CASE sexo WHEN 'HOMBRE' THEN 'male' ELSE 'female' END AS GENDER,
+                CAST(fecha_nacimiento AS TIMESTAMP) AS BIRTHDATE,
+                CASE person_id % 4 WHEN 0 THEN 'CASADO' WHEN 1 THEN 'UNION DE HECHO' ELSE 'SOLTERO' END AS MARITAL_STATUS,
+                CAST(person_id // 4 AS VARCHAR) AS EC_FAMILY_GROUP,
+                person_id % 5 AS EC_SON_NUMBER,
+                etnia AS EC_ETHNICITY,
+                'official' AS NAME_USE,
+                nombres_completos AS NAME_TEXT,
+                apellidos AS NAME_FAMILY,
+                nombres AS NAME_GIVEN
+            FROM tmp_persona
+            WHERE tipo_iden = 'CÉDULA DE IDENTIDAD' AND en_registro_civil
+            """)
+
+        logging.info(" |- Generando vacunación COVID")
+        for number, first, n in _blocks(covid_rows):
+            block = _covid_block(_rng(seed, 3, number), first + 1, n, personas, establecimientos)
+            con.execute("CREATE TABLE IF NOT EXISTS tmp_covid AS SELECT * FROM block LIMIT 0")
+            con.execute("INSERT INTO tmp_covid SELECT * FROM block")
+        # ordenada por la llave de paginación, como el índice de la tabla en Oracle
+        con.execute("""
+            CREATE TABLE HCUE_VACUNACION_DEPURADA.DB_VACUNACION_CONSOLIDADA_DEPURADA_COVID AS
+            SELECT
+                c.ID_VAC_DEPU,
+                CAST(c.FECHA_APLICACION AS TIMESTAMP) AS FECHA_APLICACION,
+                g.UNI_NOMBRE AS PUNTO_VACUNACION,
+                g.UNI_CODIGO AS UNICODIGO,
+                p.tipo_iden AS TIPO_IDEN,
+                p.num_iden AS NUM_IDEN,
+                p.apellidos AS APELLIDOS,
+                p.nombres AS NOMBRES,
+                p.nombres_completos AS NOMBRES_COMPLETOS,
+                p.sexo AS SEXO,
+                CAST(p.fecha_nacimiento AS TIMESTAMP) AS FECHA_NACIMIENTO,
+                p.nacionalidad AS NACIONALIDAD,
+                p.etnia AS ETNIA,
+                c.POBLA_VACUNA,
+                c.GRUPO_RIESGO,
+                c.NOMBRE_VACUNA,
+                c.LOTE_VACUNA,
+                c.DOSIS_APLICADA,
+                pr.nombres_completos AS PROFESIONAL_APLICA,
+                pr.num_iden AS IDEN_PROFESIONAL_APLICA,
+                c.FASE_VACUNA,
+                upper(c.FASE_VACUNA) AS FASE_VACUNA_DEPURADA,
+                c.GRUPO_RIESGO AS GRUPO_RIESGO_DEPURADA,
+                c.SISTEMA,
+                CASE WHEN p.en_registro_civil THEN 'SI' ELSE 'NO' END AS REGISTRO_CIVIL,
+                c.ID_VAC_DEPU AS ID_VAC_CONS
+            FROM tmp_covid c
+            JOIN tmp_persona p ON p.person_id = c.person_id
+            JOIN SYAPP.VM_ESTABLECIMIENTOS_INGRESADOS g ON CAST(g.UNI_CODIGO AS INTEGER) = c.establecimiento
+            LEFT JOIN tmp_persona pr ON pr.person_id = c.profesional
+            ORDER BY FECHA_APLICACION, ID_VAC_DEPU
+            """)
+
+        logging.info(" |- Generando vacunación de rutina")
+        con.execute("""
+            CREATE TABLE HCUE_CATALOGOS.DETALLECATALOGO AS
+            SELECT * FROM (VALUES (1, 'HOMBRE'), (2, 'MUJER'), (3, 'INTERSEXUAL')) t(ID, DESCRIPCION)
+            """)
+        con.execute("""
+            CREATE TABLE HCUE_SISTEMA.PERSONA AS
+            SELECT
+                person_id + 1 AS ID,
+                num_iden AS NUMEROIDENTIFICACION,
+                CAST(fecha_nacimiento AS TIMESTAMP) AS FECHANACIMIENTO,
+                1 AS ESTADO,
+                CASE sexo WHEN 'HOMBRE' THEN 1 ELSE 2 END AS CTSEXO_ID,
+                TIMESTAMP '2015-01-01' + to_days(CAST(person_id % 3000 AS INTEGER)) AS FECHACREACION,
+                TIMESTAMP '2015-01-01' + to_days(CAST(person_id % 3000 AS INTEGER) + CAST(person_id % 400 AS INTEGER))
+                    AS FECHAMODIFICACION
+            FROM tmp_persona
+            """)
+        con.execute("""
+            CREATE TABLE HCUE_AMED.PACIENTE AS
+            SELECT ID, ID AS PERSONA_ID, 1 AS ACTIVO, ESTADO, FECHACREACION, FECHAMODIFICACION
+            FROM HCUE_SISTEMA.PERSONA
+            """)
+        for number, first, n in _blocks(rutinario_rows):
+            block = _rutinario_block(_rng(seed, 4, number), first + 1, n, rutinario_rows, personas, establecimientos)
+            con.execute("CREATE TABLE IF NOT EXISTS tmp_rutinario AS SELECT * FROM block LIMIT 0")
+            con.execute("INSERT INTO tmp_rutinario SELECT * FROM block")
+        con.execute("""
+            CREATE TABLE HCUE_AMED.REGISTROVACUNACION AS
+            SELECT * REPLACE (CAST(FECHAVACUNACION AS TIMESTAMP) AS FECHAVACUNACION) FROM tmp_rutinario ORDER BY ID
+            """)
+
+        con.execute("DROP TABLE tmp_persona")
+        con.execute("DROP TABLE tmp_covid")
+        con.execute("DROP TABLE tmp_rutinario")
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+    logging.info("|- Fuente local generada")
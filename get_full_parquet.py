@@ -1,114 +1,191 @@
+import argparse
 import glob
+import logging
 import os
 import time
+from functools import partial
+from typing import Optional
 
 import dotenv
-import duckdb
-import pandas as pd
-import sqlalchemy
-from pyspark.sql import SparkSession
-from sqlalchemy.engine import URL
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from extract.chunking import date_window, keyset_batch_chunks
+from extract.config.sources import FETCH_ARRAY_SIZE
+from extract.db_vacunacion_covid import (VACUNACION_ARROW_SCHEMA, VACUNACION_KEY_COLUMNS,
+                                         get_db_vacunacion_covid_batches)
 
 dotenv.load_dotenv(override=True)
 
+# filas por row group, cada row group lleva sus estadísticas min/max para que los lectores lo puedan saltar
+ROW_GROUP_SIZE = 1_000_000
+# row groups por archivo del dataset, un archivo es la unidad que se confirma y desde donde se retoma
+ROW_GROUPS_PER_FILE = 8
+
+
+def _part_path(output_dir: str, number: int) -> str:
+    return os.path.join(output_dir, f"part-{number:05d}.parquet")
+
+
+def _committed_parts(output_dir: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(output_dir, "part-*.parquet")))
+
+
+def _last_key(part: str) -> Optional[tuple]:
+    """
+    Llave de paginación de la última fila del último row group del archivo
+    """
+    parquet_file = pq.ParquetFile(part)
+    if parquet_file.metadata.num_row_groups == 0:
+        return None
+    last_group = parquet_file.read_row_group(parquet_file.metadata.num_row_groups - 1, columns=VACUNACION_KEY_COLUMNS)
+    return tuple(last_group.column(col)[-1].as_py() for col in VACUNACION_KEY_COLUMNS)
+
+
+class _PartWriter:
+    """
+    Escribe el dataset archivo por archivo: cada archivo se escribe como .tmp y se renombra al cerrarse, un archivo
+    sin renombrar es de una ejecución interrumpida y se descarta al retomar.
+    """
+
+    def __init__(self, output_dir: str, first_part: int, row_group_size: int, row_groups_per_file: int,
+                 compression: str, compression_level: Optional[int]):
+        self.output_dir = output_dir
+        self.part = first_part
+        self.row_group_size = row_group_size
+        self.row_groups_per_file = row_groups_per_file
+        self.compression = compression
+        self.compression_level = compression_level
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._row_groups = 0
+        self._buffer: list[pa.RecordBatch] = []
+        self._buffered = 0
+        self.rows = 0
+
+    def _open(self):
+        self._writer = pq.ParquetWriter(
+            f"{_part_path(self.output_dir, self.part)}.tmp",
+            VACUNACION_ARROW_SCHEMA,
+            compression=self.compression,
+            compression_level=self.compression_level,
+            write_statistics=True,
+            use_dictionary=True,
+            sorting_columns=pq.SortingColumn.from_ordering(
+                VACUNACION_ARROW_SCHEMA, [(col, "ascending") for col in VACUNACION_KEY_COLUMNS]),
+        )
+        self._row_groups = 0
+
+    def write(self, batch: pa.RecordBatch):
+        # los batches del driver son pequeños, se acumulan hasta completar un row group
+        self._buffer.append(batch)
+        self._buffered += batch.num_rows
+        while self._buffered >= self.row_group_size:
+            self._flush_row_group(self.row_group_size)
+
+    def _flush_row_group(self, rows: int):
+        table = pa.Table.from_batches(self._buffer, schema=VACUNACION_ARROW_SCHEMA)
+        group, rest = table.slice(0, rows), table.slice(rows)
+        if self._writer is None:
+            self._open()
+        self._writer.write_table(group, row_group_size=rows)
+        self._row_groups += 1
+        self.rows += group.num_rows
+        self._buffer = rest.to_batches()
+        self._buffered = rest.num_rows
+        if self._row_groups >= self.row_groups_per_file:
+            self._commit()
+
+    def _commit(self):
+        self._writer.close()
+        self._writer = None
+        os.replace(f"{_part_path(self.output_dir, self.part)}.tmp", _part_path(self.output_dir, self.part))
+        logging.info(f" |- Archivo {os.path.basename(_part_path(self.output_dir, self.part))} confirmado "
+                     f"({self.rows:,} filas en esta ejecución)")
+        self.part += 1
+
+    def close(self):
+        if self._buffered:
+            self._flush_row_group(self._buffered)
+        if self._writer is not None:
+            self._commit()
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            os.remove(f"{_part_path(self.output_dir, self.part)}.tmp")
+            self._writer = None
+
+
+def export_full_parquet(output_dir: str, since: str, until: str, chunk_size: int = 1000000,
+                        array_size: int = FETCH_ARRAY_SIZE, row_group_size: int = ROW_GROUP_SIZE,
+                        row_groups_per_file: int = ROW_GROUPS_PER_FILE, compression: str = "zstd",
+                        compression_level: Optional[int] = None, resume: bool = False) -> int:
+    """
+    Exporta la vacunación COVID a un dataset Parquet en output_dir en un solo stream: las páginas por llave se
+    leen como record batches de Arrow y se escriben directo como row groups, sin archivos intermedios.
+    Con resume la exportación continúa después de la última fila del último archivo confirmado.
+    Retorna las filas escritas en esta ejecución.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for leftover in glob.glob(os.path.join(output_dir, "*.parquet.tmp")):
+        os.remove(leftover)
+    parts = _committed_parts(output_dir)
+    start_key = None
+    if parts and resume:
+        start_key = _last_key(parts[-1])
+        logging.info(f"|- Retomando después de {len(parts)} archivos, última llave {start_key}")
+    elif parts:
+        logging.info(f"|- Eliminando {len(parts)} archivos de una exportación anterior")
+        for part in parts:
+            os.remove(part)
+        parts = []
+
+    since, until = date_window(since, until)
+    writer = _PartWriter(output_dir, len(parts), row_group_size, row_groups_per_file, compression, compression_level)
+    fetch_batches = partial(get_db_vacunacion_covid_batches, since, until, array_size=array_size)
+    start_time = time.time()
+    read = 0
+    try:
+        for chunk in keyset_batch_chunks(fetch_batches, VACUNACION_KEY_COLUMNS, chunk_size, start_key):
+            for batch in chunk.data:
+                writer.write(batch)
+            read += chunk.rows
+            elapsed = time.time() - start_time
+            logging.info(f" |- Chunk {chunk.number}: {read:,} filas leídas, {elapsed:.2f} segundos")
+        writer.close()
+    except BaseException:
+        # lo ya confirmado queda en el dataset, el archivo abierto se descarta
+        writer.abort()
+        raise
+    logging.info(f"|- Exportación completada: {writer.rows:,} filas en {time.time() - start_time:.2f} segundos")
+    return writer.rows
+
+
+def parse_arguments():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Exportación completa de vacunación COVID a un dataset Parquet",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--output-dir', type=str, default='./parquets/db_covid_19',
+                        help='Directorio del dataset Parquet')
+    parser.add_argument('--since', type=str, default='1800-01-01', help='Fecha de inicio (formato: YYYY-MM-DD)')
+    parser.add_argument('--until', type=str, default='2025-01-01', help='Fecha de fin (formato: YYYY-MM-DD)')
+    parser.add_argument('--chunk-size', type=int, default=1000000, help='Filas por página de la consulta')
+    parser.add_argument('--fetch-array-size', type=int, default=FETCH_ARRAY_SIZE, help='Filas por record batch')
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE, help='Filas por row group')
+    parser.add_argument('--row-groups-per-file', type=int, default=ROW_GROUPS_PER_FILE,
+                        help='Row groups por archivo, cada archivo confirmado es un punto de reanudación')
+    parser.add_argument('--compression', type=str, default='zstd', help='Compresión de las columnas')
+    parser.add_argument('--compression-level', type=int, default=None, help='Nivel de compresión')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continuar después del último archivo confirmado en lugar de empezar de cero')
+    return parser.parse_args()
+
 
-def merge_parquet_files(input_dir: str, output_file: str):
-    spark = SparkSession.builder.getOrCreate()
-    parquet_files = glob.glob(os.path.join(input_dir, "*.parquet"))
-    print(f"Found {len(parquet_files)} parquet files to merge.")
-    if not parquet_files:
-        print("No parquet files found in the directory.")
-        spark.stop()
-        return
-
-    df = spark.read.parquet(*parquet_files)
-    df.write.mode("overwrite").parquet(output_file)
-    # Eliminar todos los archivos chunk .parquet en el directorio de entrada
-    for f in glob.glob(os.path.join(input_dir, "*.parquet")):
-        if f != output_file:
-            try:
-                os.remove(f)
-            except Exception as e:
-                print(f"No se pudo borrar {f}: {e}")
-    spark.stop()
-
-def fetch_and_save_parquet_oracle(
-    user: str,
-    password: str,
-    host: str,
-    port: int,
-    service_name: str,
-    table_name: str,
-    parquet_file: str,
-<<<<<<< HEAD
-    chunk_size: int = 5000000
-=======
-    chunk_size: int = 100000
->>>>>>> 7e8b8f0 (FEAT: Elimina funciones de caché obsoletas en db_vacunacion.py y optimiza la consulta en get_full_parquet.py aumentando el tamaño del chunk y ajustando la consulta total de filas.)
-):
-
-    connection_string = f'oracle+oracledb://{user}:{password}@{host}:{port}/?service_name={service_name}'
-    engine: sqlalchemy.Engine = sqlalchemy.create_engine(connection_string, pool_pre_ping=True)
-
-    offset = 0
-    # Get total number of rows (only once, at the start)
-<<<<<<< HEAD
-    total_query = f"SELECT COUNT(*) FROM {table_name} where FECHA_APLICACION <= TO_DATE('2025-01-01', 'YYYY-MM-DD')"
-    total_rows = pd.read_sql(total_query, engine).iloc[0, 0]
-    total_iters = (total_rows + chunk_size - 1) // chunk_size
-    
-    # Remove existing parquet file if it exists
-    if os.path.exists(parquet_file):
-        os.remove(parquet_file)
-    
-=======
-    total_query = f"SELECT COUNT(*) FROM {table_name}"
-    total_rows = pd.read_sql(total_query, engine).iloc[0, 0]
-    total_iters = (total_rows + chunk_size - 1) // chunk_size
-    con = duckdb.connect(f"{parquet_file}.duckdb")
->>>>>>> 7e8b8f0 (FEAT: Elimina funciones de caché obsoletas en db_vacunacion.py y optimiza la consulta en get_full_parquet.py aumentando el tamaño del chunk y ajustando la consulta total de filas.)
-    while offset < total_rows:
-        iter_num = (offset // chunk_size) + 1
-        start_time = time.time()
-        query = f"""
-            SELECT * FROM (
-                SELECT a.*, ROWNUM rnum FROM {table_name} a
-                WHERE ROWNUM <= {offset + chunk_size}
-            )
-            WHERE rnum > {offset}
-        """
-        df = pd.read_sql(query, engine)
-        elapsed = time.time() - start_time
-        con.execute(f"CREATE TABLE IF NOT EXISTS data AS SELECT * FROM df LIMIT 0")
-        con.append("data", df)
-        print(f"Iteración {iter_num} de {total_iters} tiempo de iteración: {elapsed:.2f} segundos")
-
-        if not df.empty:
-            # Agrega columna con el número de iteración
-            df['iter_num'] = iter_num
-
-            # Guarda el chunk en un archivo parquet temporal
-            temp_parquet = f"./parquets/{parquet_file}_chunk{iter_num}.parquet"
-            df.to_parquet(temp_parquet, index=False)
-            del df
-
-        offset += chunk_size
-<<<<<<< HEAD
-    print(f"Proceso completado. Archivo parquet guardado: {parquet_file}")
-
-=======
-    con.close()
->>>>>>> 7e8b8f0 (FEAT: Elimina funciones de caché obsoletas en db_vacunacion.py y optimiza la consulta en get_full_parquet.py aumentando el tamaño del chunk y ajustando la consulta total de filas.)
-
-# Example usage:
-fetch_and_save_parquet_oracle(
-    user=os.environ.get("CNN_ORACLE_DB_VACUNACION_USER"),
-    password=os.environ.get("CNN_ORACLE_DB_VACUNACION_PASSWORD"),
-    host=os.environ.get("CNN_ORACLE_DB_VACUNACION_HOST"),
-    port=1521,
-    service_name="DB_VACUNACION",
-    table_name="HCUE_VACUNACION_DEPURADA.DB_VACUNACION_CONSOLIDADA_DEPURADA_COVID",
-    parquet_file="db_covid_19.parquet"
-)
-
-merge_parquet_files("./parquets/", "db_covid_19_full.parquet")
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+    export_full_parquet(args.output_dir, args.since, args.until, args.chunk_size, args.fetch_array_size,
+                        args.row_group_size, args.row_groups_per_file, args.compression, args.compression_level,
+                        args.resume)
@@ -7,7 +7,7 @@ def insert_parquets_to_duckdb(input_dir: str, db_path: str, table_name: str):
     con = duckdb.connect(database=db_path)
     
     con.execute(f"""
-        CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM parquet_scan('./parquets/db_covid_19.parquet_chunk3.parquet')
+        CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM parquet_scan('{os.path.join(input_dir, "*.parquet")}') LIMIT 0
     """)
     con.execute(f"""
         DELETE FROM {table_name}
@@ -20,4 +20,4 @@ def insert_parquets_to_duckdb(input_dir: str, db_path: str, table_name: str):
     con.close()
 
 # Ejemplo de uso:
-insert_parquets_to_duckdb("./parquets", "./parquets/vacunacion.duckdb", "vacunacion")
\ No newline at end of file
+insert_parquets_to_duckdb("./parquets/db_covid_19", "./parquets/vacunacion.duckdb", "vacunacion")
\ No newline at end of file
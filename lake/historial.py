@@ -0,0 +1,196 @@
+import logging
+import time
+from functools import partial
+from typing import Optional
+
+import duckdb
+import polars as pl
+
+from lake.interning import INTERN_NORMALIZE
+from lake.session import lake_reader, lake_write, register_write_hook
+
+HISTORIAL_DB = 'vacunacion'
+HISTORIAL_TABLE = 'ix_historial'
+
+
+def _normalizar_iden(value: str) -> str:
+    """
+    Identificación como se indexa y se busca: la limpieza de las identificaciones internadas y, como en
+    dim_persona, la cédula que perdió el cero inicial completada a 10 dígitos. Rutinario y la búsqueda no traen el
+    tipo de identificación, se completa todo número de menos de 10 dígitos.
+    """
+    limpia = f"trim({INTERN_NORMALIZE['identificacion'].format(value)})"
+    return f"CASE WHEN regexp_full_match({limpia}, '[0-9]{{1,9}}') THEN lpad({limpia}, 10, '0') ELSE {limpia} END"
+
+
+# proyección de cada tabla del lago sobre el historial: fuente, llave y columna de fecha de la tabla y la expresión
+# de cada columna del índice
+HISTORIAL_SOURCES = {
+    "lk_vacunacion_covid": {
+        "fuente": "covid",
+        "key": "id_vac_depu",
+        "date": "fecha_aplicacion",
+        "columns": {
+            "num_iden": _normalizar_iden("num_iden"),
+            "id_origen": "CAST(id_vac_depu AS VARCHAR)",
+            "fecha_aplicacion": "CAST(fecha_aplicacion AS DATE)",
+            "vacuna": "CAST(nombre_vacuna AS VARCHAR)",
+            "dosis": "CAST(dosis_aplicada AS VARCHAR)",
+            "lote": "CAST(lote_vacuna AS VARCHAR)",
+            "establecimiento": "CAST(unicodigo AS VARCHAR)",
+        },
+    },
+    "db_vacunacion_rutinario": {
+        "fuente": "rutinario",
+        "key": "ID",
+        "date": "FECHAVACUNACION",
+        "columns": {
+            "num_iden": _normalizar_iden("NUMEROIDENTIFICACION"),
+            "id_origen": "CAST(ID AS VARCHAR)",
+            "fecha_aplicacion": "CAST(FECHAVACUNACION AS DATE)",
+            "vacuna": "CAST(ESQUEMAVACUNACION_ID AS VARCHAR)",
+            "dosis": "CAST(REFUERZO AS VARCHAR)",
+            "lote": "CAST(LOTE AS VARCHAR)",
+            "establecimiento": "CAST(PUNTOVACUNACION_ID AS VARCHAR)",
+        },
+    },
+}
+
+HISTORIAL_COLUMNS = [
+    "num_iden", "fuente", "id_origen", "fecha_aplicacion", "vacuna", "dosis", "lote", "establecimiento",
+]
+
+
+def _projection(table: str, relation: str) -> str:
+    # una fila por llave de la tabla de origen, sin identificación no hay historial que consultar
+    source = HISTORIAL_SOURCES[table]
+    columns = {**source["columns"], "fuente": f"'{source['fuente']}'"}
+    return f"""
+        SELECT {', '.join(f'{columns[col]} AS {col}' for col in HISTORIAL_COLUMNS)}
+        FROM {relation}
+        WHERE {source['columns']['num_iden']} IS NOT NULL
+        QUALIFY row_number() OVER (PARTITION BY {source['key']}) = 1
+        """
+
+
+def _existing_tables(con: duckdb.DuckDBPyConnection) -> set[str]:
+    # information_schema incluye las vistas de las tablas en Parquet
+    return {row[0].lower() for row in con.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+
+
+def _create_historial(con: duckdb.DuckDBPyConnection) -> bool:
+    """
+    Construye el índice desde las tablas del lago ordenado por identificación, así cada persona queda en pocos
+    bloques contiguos. Los índices ART se crean después de la carga, en bloque.
+    """
+    existing = _existing_tables(con)
+    if HISTORIAL_TABLE in existing:
+        _renormalize_historial(con)
+        return False
+    con.execute(f"""
+        CREATE TABLE {HISTORIAL_TABLE} (
+            num_iden VARCHAR,
+            fuente VARCHAR,
+            id_origen VARCHAR,
+            fecha_aplicacion DATE,
+            vacuna VARCHAR,
+            dosis VARCHAR,
+            lote VARCHAR,
+            establecimiento VARCHAR
+        )
+        """)
+    sources = [table for table in HISTORIAL_SOURCES if table in existing]
+    if sources:
+        union = " UNION ALL ".join(f"({_projection(table, table)})" for table in sources)
+        con.execute(f"INSERT INTO {HISTORIAL_TABLE} SELECT * FROM ({union}) ORDER BY num_iden, fecha_aplicacion")
+    _create_indexes(con)
+    return True
+
+
+def _create_indexes(con: duckdb.DuckDBPyConnection):
+    con.execute(f"CREATE UNIQUE INDEX ux_{HISTORIAL_TABLE}_fuente_id_origen ON {HISTORIAL_TABLE} (fuente, id_origen)")
+    con.execute(f"CREATE INDEX ix_{HISTORIAL_TABLE}_num_iden ON {HISTORIAL_TABLE} (num_iden)")
+
+
+def _renormalize_historial(con: duckdb.DuckDBPyConnection):
+    """
+    Un índice construido antes de normalizar las identificaciones se reescribe normalizado y ordenado por
+    identificación. Se reescribe en lugar de un UPDATE: DuckDB no ve el UPDATE al crear en la misma transacción
+    el índice ART de num_iden.
+    """
+    pending = con.execute(f"SELECT COUNT(*) FROM {HISTORIAL_TABLE} "
+                          f"WHERE num_iden IS DISTINCT FROM {_normalizar_iden('num_iden')}").fetchone()[0]
+    if not pending:
+        return
+    con.execute(f"""
+        CREATE TABLE {HISTORIAL_TABLE}__normalizado AS
+        SELECT * REPLACE ({_normalizar_iden('num_iden')} AS num_iden) FROM {HISTORIAL_TABLE}
+        ORDER BY num_iden, fecha_aplicacion
+        """)
+    con.execute(f"DROP TABLE {HISTORIAL_TABLE}")
+    con.execute(f"ALTER TABLE {HISTORIAL_TABLE}__normalizado RENAME TO {HISTORIAL_TABLE}")
+    _create_indexes(con)
+    logging.info(f" |- {HISTORIAL_TABLE}: {pending:,} identificaciones normalizadas")
+
+
+def _refresh_historial(table: str, con: duckdb.DuckDBPyConnection, changes: str, mode: str,
+                       partition: Optional[tuple[str, str, str]]):
+    """
+    Hook de escritura de las tablas de vacunación: aplica al índice las filas recibidas con la misma semántica de
+    la escritura. Con 'insert' se conservan las llaves ya indexadas, con 'upsert' se reemplazan y con
+    'replace_partition' además se borran del índice las aplicaciones de la partición reemplazada.
+    """
+    source = HISTORIAL_SOURCES[table]
+    if mode == 'replace_partition':
+        column, since, until = partition
+        if column.lower() != source["date"].lower():
+            raise ValueError(f"El historial no puede reemplazar la partición por {column} de {table}")
+        con.execute(f"""
+            DELETE FROM {HISTORIAL_TABLE}
+            WHERE fuente = ? AND fecha_aplicacion >= CAST(? AS DATE) AND fecha_aplicacion < CAST(? AS DATE)
+            """, [source["fuente"], since, until])
+    if mode == 'insert':
+        con.execute(f"INSERT OR IGNORE INTO {HISTORIAL_TABLE} BY NAME {_projection(table, changes)}")
+        return
+    # INSERT OR REPLACE no actualiza num_iden porque lo cubre otro índice, las llaves recibidas se borran antes;
+    # también sale del índice la fila que ahora llega sin identificación
+    con.execute(f"""
+        DELETE FROM {HISTORIAL_TABLE}
+        WHERE fuente = ? AND id_origen IN (SELECT CAST({source['key']} AS VARCHAR) FROM {changes})
+        """, [source["fuente"]])
+    con.execute(f"INSERT INTO {HISTORIAL_TABLE} BY NAME {_projection(table, changes)}")
+
+
+# un hook por tabla creado una sola vez, register_write_hook no registra dos veces el mismo
+_HOOKS = {table: partial(_refresh_historial, table) for table in HISTORIAL_SOURCES}
+
+
+def create_historial():
+    """
+    Crea el índice de historial por persona si no existe y registra su actualización incremental: cada escritura
+    de las tablas de vacunación por el escritor del lago se aplica al índice en la misma transacción.
+    """
+    start_time = time.time()
+    if lake_write(HISTORIAL_DB, _create_historial):
+        with lake_reader(HISTORIAL_DB) as con:
+            rows = con.execute(f"SELECT COUNT(*) FROM {HISTORIAL_TABLE}").fetchone()[0]
+        logging.info(f"|- Índice {HISTORIAL_TABLE} construido con {rows:,} aplicaciones en "
+                     f"{time.time() - start_time:.2f} segundos")
+    for table, hook in _HOOKS.items():
+        register_write_hook(HISTORIAL_DB, table, hook)
+
+
+def get_historial(num_iden: str) -> pl.DataFrame:
+    """
+    Todas las aplicaciones de una persona en las fuentes covid y rutinario, ordenadas por fecha. La búsqueda es
+    puntual sobre el índice ART de num_iden, no recorre las tablas de vacunación; num_iden se normaliza igual que
+    al indexar.
+    """
+    with lake_reader(HISTORIAL_DB) as con:
+        num_iden = con.execute(f"SELECT {_normalizar_iden('$num_iden')}", {"num_iden": str(num_iden)}).fetchone()[0]
+        try:
+            return con.execute(f"""
+                SELECT * FROM {HISTORIAL_TABLE} WHERE num_iden = ? ORDER BY fecha_aplicacion, fuente, id_origen
+                """, [num_iden]).pl()
+        except duckdb.CatalogException as e:
+            raise RuntimeError(f"El índice {HISTORIAL_TABLE} no existe, se crea con create_historial()") from e
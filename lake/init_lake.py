@@ -1,26 +1,33 @@
 import logging
+from typing import Optional, Union
 
 import duckdb
 import polars as pl
+import pyarrow as pa
+
+from lake.interning import intern_chunk
+from lake.parquet_lake import is_parquet_table, write_partitions
+from lake.session import lake_write, run_write_hooks
+
+
+def _execute(con: duckdb.DuckDBPyConnection, query: str):
+    con.execute(query)
 
 
 def generate_lake_schema():
     # Implement the logic to generate the lake schema
-    con = duckdb.connect('./resources/data_lake/vacunacion.duckdb')
-    con.execute("""
+    lake_write('vacunacion', _execute, """
         CREATE TABLE IF NOT EXISTS lake_schema (
             id INTEGER PRIMARY KEY,
             name VARCHAR,
             value DOUBLE
         )
     """)
-    con.close()
 
 
 def generate_bi_schema():
     # Implement the logic to generate the BI schema
-    con = duckdb.connect('./resources/data_lake/vacunacion_schema.duckdb')
-    con.execute("""
+    lake_write('vacunacion_schema', _execute, """
         CREATE TABLE IF NOT EXISTS dim_persona (
             id INTEGER PRIMARY KEY,
             nombres VARCHAR,
@@ -91,31 +98,155 @@ def generate_bi_schema():
             tiempo_id INTEGER,
             fecha_vacunacion DATE,
             centro_vacunacion VARCHAR,
-            FOREIGN KEY (persona_id) REFERENCES dim_persona(id),
-            FOREIGN KEY (dpa_administrativo_id) REFERENCES dim_dpa_administrativo(id),
-            FOREIGN KEY (dpa_geografico_id) REFERENCES dim_dpa_geografico(id),
-            FOREIGN KEY (tiempo_id) REFERENCES dim_tiempo(id),
-            FOREIGN KEY (vacuna_id) REFERENCES dim_vacuna(id),
-            FOREIGN KEY (profesional_id) REFERENCES dim_profesional(id),
-            FOREIGN KEY (establecimiento_id) REFERENCES dim_establecimiento(id)
+            -- sin FOREIGN KEY: DuckDB las verifica fila por fila en cada INSERT, las llaves las asigna
+            -- load.bi_model con joins contra las dimensiones
+            id_origen VARCHAR,
+            dosis_aplicada VARCHAR,
+            grupo_etario VARCHAR
         );
+        -- registro de vacunación de origen, identifica los hechos ya cargados
+        ALTER TABLE fact_vacunacion ADD COLUMN IF NOT EXISTS id_origen VARCHAR;
+        -- dimensiones degeneradas de los rollups
+        ALTER TABLE fact_vacunacion ADD COLUMN IF NOT EXISTS dosis_aplicada VARCHAR;
+        ALTER TABLE fact_vacunacion ADD COLUMN IF NOT EXISTS grupo_etario VARCHAR;
     """)
-    con.close()
-    
-def add_new_elements_to_lake( db:str,
-                              table:str,
-                              keys_columns:list[str],
-                              df:pl.DataFrame):
-    logging.info(f"|-Adding new elements to lake: {db}.{table}")
-    # Implement the logic to add new elements to the lake
-    con = duckdb.connect(f'./resources/data_lake/{db}.duckdb')
-    
-    # aqui hace el llamado al df
-    one_query = f"""CREATE TABLE IF NOT EXISTS {db}.main.{table} AS SELECT * FROM df;
-                    CREATE TABLE IF NOT EXISTS {db}.main.tmp_{table} AS SELECT * FROM df;
-                    INSERT INTO {db}.main.{table} SELECT * FROM {db}.main.tmp_{table} WHERE NOT EXISTS (SELECT 1 FROM {db}.main.{table} WHERE {' AND '.join([f'{table}.{col} = tmp_{table}.{col}' for col in keys_columns])} );
-                    DROP TABLE {db}.main.tmp_{table};"""
-    #
-    con.execute(one_query)
-    con.close()
-    
\ No newline at end of file
+
+
+def _key_index_name(table: str, keys_columns: list[str]) -> str:
+    return f"ux_{table}_{'_'.join(col.lower() for col in keys_columns)}"
+
+
+def _ensure_key_index(con: duckdb.DuckDBPyConnection, table: str, keys_columns: list[str]):
+    """
+    Índice único sobre la llave declarada de la tabla. Los INSERT OR IGNORE / OR REPLACE resuelven los
+    conflictos con búsquedas puntuales en el índice, el costo depende del chunk y no del tamaño de la tabla.
+    """
+    index_name = _key_index_name(table, keys_columns)
+    exists = con.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE table_name = ? AND index_name = ?",
+                         [table, index_name]).fetchone()[0]
+    if exists:
+        return
+    keys = ', '.join(keys_columns)
+    duplicated = con.execute(f"""
+        SELECT COUNT(*) FROM (SELECT 1 FROM {table} GROUP BY {keys} HAVING COUNT(*) > 1)
+    """).fetchone()[0]
+    if duplicated:
+        # tablas cargadas antes de declarar la llave, se conserva una fila por llave
+        logging.warning(f" |- {table} tiene {duplicated:,} llaves duplicadas en ({keys}), se depura antes de indexar")
+        con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {table} QUALIFY "
+                    f"row_number() OVER (PARTITION BY {keys}) = 1")
+    logging.info(f" |- Creando índice {index_name} sobre {table} ({keys})")
+    con.execute(f"CREATE UNIQUE INDEX {index_name} ON {table} ({keys})")
+
+
+def _add_missing_columns(con: duckdb.DuckDBPyConnection, table: str, source: str):
+    # columnas nuevas en la fuente se agregan a la tabla, las filas anteriores quedan en NULL
+    existing = {row[0].lower() for row in con.execute(f"DESCRIBE {table}").fetchall()}
+    for column, column_type, *_ in con.execute(f"DESCRIBE {source}").fetchall():
+        if column.lower() not in existing:
+            logging.info(f" |- Agregando columna {column} {column_type} a {table}")
+            con.execute(f'ALTER TABLE {table} ADD COLUMN "{column}" {column_type}')
+
+
+def _stage_chunks(con: duckdb.DuckDBPyConnection, tmp_table: str, requests: list[tuple]) -> int:
+    # cada df se lee una sola vez, así se admite un RecordBatchReader en streaming
+    for number, (*_, df) in enumerate(requests):
+        con.register('chunk_df', df)
+        if number == 0:
+            con.execute(f"CREATE OR REPLACE TEMP TABLE {tmp_table} AS SELECT * FROM chunk_df")
+        else:
+            _add_missing_columns(con, tmp_table, 'chunk_df')
+            con.execute(f"INSERT INTO {tmp_table} BY NAME SELECT * FROM chunk_df")
+        con.unregister('chunk_df')
+    return con.execute(f"SELECT COUNT(*) FROM {tmp_table}").fetchone()[0]
+
+
+def _merge_into_table(con: duckdb.DuckDBPyConnection, table: str, keys_columns: list[str], mode: str,
+                      partition: Optional[tuple[str, str, str]], tmp_table: str, source: str,
+                      unique: int) -> tuple[int, int, int]:
+    con.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM {tmp_table} LIMIT 0")
+    _add_missing_columns(con, table, tmp_table)
+    _ensure_key_index(con, table, keys_columns)
+
+    before = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    deleted = 0
+    if mode == 'replace_partition':
+        column, since, until = partition
+        deleted = con.execute(f"DELETE FROM {table} WHERE {column} >= ? AND {column} < ?",
+                              [since, until]).fetchone()[0]
+        before -= deleted
+        con.execute(f"INSERT INTO {table} BY NAME {source}")
+    elif mode == 'upsert':
+        con.execute(f"INSERT OR REPLACE INTO {table} BY NAME {source}")
+    else:
+        con.execute(f"INSERT OR IGNORE INTO {table} BY NAME {source}")
+    after = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    # los conteos salen de COUNT(*) antes y después, no de un anti-join contra toda la tabla
+    inserted = after - before
+    return inserted, unique - inserted if mode == 'upsert' else 0, deleted
+
+
+def _append_chunks(con: duckdb.DuckDBPyConnection, requests: list[tuple]) -> dict:
+    """
+    Escribe en una sola transacción los chunks encolados para la misma tabla, llave, modo y partición.
+    Se ejecuta en el hilo escritor de la sesión del lago.
+    """
+    db, table, keys_columns, mode, partition = requests[0][:5]
+    tmp_table = f"tmp_{table}"
+    received = _stage_chunks(con, tmp_table, requests)
+    if not is_parquet_table(table):
+        intern_chunk(con, table, tmp_table)
+
+    # una fila por llave dentro del lote, el índice no admite repetirla en el mismo INSERT
+    source = f"SELECT * FROM {tmp_table} QUALIFY row_number() OVER (PARTITION BY {', '.join(keys_columns)}) = 1"
+    unique = con.execute(f"SELECT COUNT(*) FROM ({source})").fetchone()[0]
+    if is_parquet_table(table):
+        inserted, updated, deleted = write_partitions(con, db, table, keys_columns, mode, partition, source)
+    else:
+        inserted, updated, deleted = _merge_into_table(con, table, keys_columns, mode, partition, tmp_table,
+                                                       source, unique)
+    run_write_hooks(con, db, table, tmp_table, mode, partition)
+    con.execute(f"DROP TABLE {tmp_table}")
+
+    stats = {
+        "inserted": inserted,
+        "updated": updated,
+        "skipped": received - inserted - updated,
+        "deleted": deleted,
+    }
+    batch = f" en lote de {len(requests)} chunks" if len(requests) > 1 else ""
+    logging.info(f" |- {table}: {received:,} recibidas{batch}, {stats['inserted']:,} insertadas, "
+                 f"{stats['updated']:,} actualizadas, {stats['skipped']:,} omitidas, {stats['deleted']:,} borradas")
+    return stats
+
+
+def add_new_elements_to_lake(db: str,
+                             table: str,
+                             keys_columns: list[str],
+                             df: Union[pl.DataFrame, pa.RecordBatchReader],
+                             mode: str = 'insert',
+                             partition: Optional[tuple[str, str, str]] = None) -> dict:
+    """
+    Agrega un chunk a la tabla del lago usando la llave keys_columns, respaldada por un índice único.
+    mode:
+        'insert'            inserta solo las llaves nuevas, las existentes se omiten
+        'upsert'            inserta las llaves nuevas y reemplaza las existentes
+        'replace_partition' borra la partición (columna, desde, hasta) semiabierta e inserta el chunk, df debe
+                            traer la partición completa
+    Las columnas se insertan por nombre, las que no existen en la tabla se agregan.
+    Con LAKE_STORAGE=parquet las tablas de PARTITION_COLUMNS se escriben en su dataset Parquet por año/mes: las
+    filas nuevas se agregan en un archivo por mes, solo se reescriben los meses de los que se quitan filas y los
+    cambios se publican después del COMMIT.
+    La escritura pasa por el hilo escritor de la sesión del lago; si hay varios chunks encolados para la misma
+    tabla se escriben juntos y las cifras retornadas son las del lote.
+    Retorna {'inserted', 'updated', 'skipped', 'deleted'}.
+    """
+    logging.info(f"|-Adding new elements to lake: {db}.{table} ({mode})")
+    keys_columns = list(dict.fromkeys(keys_columns))
+    if mode == 'replace_partition' and partition is None:
+        raise ValueError("mode='replace_partition' requiere partition=(columna, desde, hasta)")
+    if mode not in ('insert', 'upsert', 'replace_partition'):
+        raise ValueError(f"Modo desconocido: {mode}")
+    batch_key = (table, tuple(keys_columns), mode, partition)
+    return lake_write(db, _append_chunks, db, table, keys_columns, mode, partition, df, batch_key=batch_key)
@@ -0,0 +1,125 @@
+import logging
+import time
+
+import duckdb
+
+# columnas de texto que se internan al escribir cada tabla del lago y el dominio de su tabla de internado. Cada
+# columna gana una columna {columna}_id BIGINT con el id compacto del valor normalizado.
+INTERN_COLUMNS = {
+    "lk_vacunacion_covid": {"num_iden": "identificacion", "unicodigo": "establecimiento", "nombre_vacuna": "vacuna"},
+    "db_vacunacion_rutinario": {"NUMEROIDENTIFICACION": "identificacion"},
+    "lk_vacunacion_rutinario": {"NUMEROIDENTIFICACION": "identificacion"},
+    "lk_persona": {"IDENTIFIER_VALUE": "identificacion"},
+    "lk_establecimiento": {"uni_codigo": "establecimiento"},
+}
+
+# normalización de cada dominio antes de internar. Las identificaciones se limpian igual que al consultar el MPI,
+# así el id de num_iden y el de IDENTIFIER_VALUE coinciden cuando coincide la identificación limpia.
+INTERN_NORMALIZE = {
+    "identificacion": "regexp_replace(CAST({} AS VARCHAR), '[:\"'']', '', 'g')",
+    "establecimiento": "trim(CAST({} AS VARCHAR))",
+    "vacuna": "upper(trim(CAST({} AS VARCHAR)))",
+}
+
+
+def intern_table(domain: str) -> str:
+    return f"intern_{domain}"
+
+
+def id_column(column: str) -> str:
+    return f"{column}_id"
+
+
+def _columns(con: duckdb.DuckDBPyConnection, relation: str) -> dict[str, str]:
+    return {row[0].lower(): row[0] for row in con.execute(f"DESCRIBE {relation}").fetchall()}
+
+
+def _table_exists(con: duckdb.DuckDBPyConnection, table: str) -> bool:
+    return con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ? AND NOT temporary",
+                       [table]).fetchone()[0] > 0
+
+
+def _assign_ids(con: duckdb.DuckDBPyConnection, domain: str, relation: str, column: str) -> int:
+    """
+    Agrega al internado del dominio los valores de relation.column que aún no tienen id. Los ids se asignan en
+    bloque a continuación del máximo actual, la búsqueda de los existentes usa el índice único sobre valor.
+    """
+    table = intern_table(domain)
+    con.execute(f"CREATE TABLE IF NOT EXISTS {table} (id BIGINT, valor VARCHAR)")
+    con.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_valor ON {table} (valor)")
+    before = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    con.execute(f"""
+        INSERT INTO {table}
+        SELECT (SELECT coalesce(max(id), 0) FROM {table}) + row_number() OVER (ORDER BY valor), valor
+        FROM (SELECT DISTINCT {INTERN_NORMALIZE[domain].format(column)} AS valor FROM {relation}) n
+        WHERE valor IS NOT NULL AND NOT EXISTS (SELECT 1 FROM {table} i WHERE i.valor = n.valor)
+        """)
+    return con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - before
+
+
+def _backfill(con: duckdb.DuckDBPyConnection, table: str, columns: list[tuple[str, str]]):
+    """
+    La tabla ya existía sin las columnas de id: se internan completas una sola vez, desde ahí cada chunk trae sus
+    ids. DuckDB no admite en una transacción un ALTER después de un UPDATE de la misma tabla, primero van todos
+    los ALTER.
+    """
+    start_time = time.time()
+    for column, domain in columns:
+        _assign_ids(con, domain, table, f'"{column}"')
+    for column, _ in columns:
+        con.execute(f'ALTER TABLE {table} ADD COLUMN "{id_column(column)}" BIGINT')
+    for column, domain in columns:
+        con.execute(f"""
+            UPDATE {table} SET "{id_column(column)}" = i.id
+            FROM {intern_table(domain)} i
+            WHERE i.valor = {INTERN_NORMALIZE[domain].format(f'{table}."{column}"')}
+            """)
+    logging.info(f" |- {table}: columnas {', '.join(column for column, _ in columns)} internadas en "
+                 f"{time.time() - start_time:.2f} segundos")
+
+
+def intern_chunk(con: duckdb.DuckDBPyConnection, table: str, staged: str):
+    """
+    Interna las columnas de INTERN_COLUMNS del chunk en staged antes de escribirlo en table: asigna en bloque los
+    ids de los valores nuevos y reemplaza staged con las columnas {columna}_id. Si table ya existe sin una de esas
+    columnas primero se completa para todas sus filas, una columna de id presente siempre está completa.
+    Se ejecuta en la transacción del escritor del lago.
+    """
+    domains = INTERN_COLUMNS.get(table)
+    if not domains:
+        return
+    staged_columns = _columns(con, staged)
+    table_columns = _columns(con, table) if _table_exists(con, table) else {}
+    ids = [(staged_columns[column.lower()], domain) for column, domain in domains.items()
+           if column.lower() in staged_columns]
+    if not ids:
+        return
+    missing = [(table_columns[name.lower()], domain) for name, domain in ids
+               if name.lower() in table_columns and id_column(name).lower() not in table_columns]
+    if missing:
+        _backfill(con, table, missing)
+    for name, domain in ids:
+        added = _assign_ids(con, domain, staged, f'"{name}"')
+        if added:
+            logging.debug(f" |- {intern_table(domain)}: {added:,} valores nuevos")
+
+    # un chunk leído del lago ya trae columnas de id, se recalculan
+    exclude = ", ".join('"' + staged_columns[id_column(name).lower()] + '"' for name, _ in ids
+                        if id_column(name).lower() in staged_columns)
+    select = f"s.* EXCLUDE ({exclude})" if exclude else "s.*"
+    joins = "\n".join(
+        f"""LEFT JOIN {intern_table(domain)} i{position}
+            ON i{position}.valor = {INTERN_NORMALIZE[domain].format(f's."{name}"')}"""
+        for position, (name, domain) in enumerate(ids))
+    id_columns = ", ".join(f'i{position}.id AS "{id_column(name)}"' for position, (name, _) in enumerate(ids))
+    con.execute(f"CREATE OR REPLACE TEMP TABLE {staged} AS SELECT {select}, {id_columns} FROM {staged} s {joins}")
+
+
+def has_ids(con: duckdb.DuckDBPyConnection, table: str, columns: list[str]) -> bool:
+    """
+    True si table tiene la columna de id de todas las columnas; las columnas de id presentes están completas
+    """
+    if not _table_exists(con, table):
+        return False
+    available = _columns(con, table)
+    return all(id_column(column).lower() in available for column in columns)
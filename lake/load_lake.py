@@ -1,27 +1,221 @@
 import logging
+from typing import Any, Iterator, Optional, Union
 
 import duckdb
 import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+from polars.io.plugins import register_io_source
 
+from lake.interning import has_ids, id_column, intern_table
+from lake.parquet_lake import read_source
+from lake.session import lake_reader
 
-def load_data(db, table) -> pl.DataFrame:
-    # Implement the logic to load data into the lake
-    logging.info("|- Cargando datos al lago")
-    con = duckdb.connect(database=f'./resources/data_lake/{db}.duckdb')
-    df = con.execute(f"SELECT * FROM {table}").fetch_df()
-    df = pl.from_pandas(df)
+# filas por record batch en las lecturas por lotes
+READ_BATCH_SIZE = 100_000
+
+
+def _read_query(db: str, table: str, columns: Optional[list[str]] = None, date_column: Optional[str] = None,
+                since: Optional[str] = None, until: Optional[str] = None,
+                filters: Optional[dict[str, Any]] = None) -> tuple[str, dict]:
+    """
+    Arma la consulta de lectura: solo las columnas pedidas y los filtros en el WHERE, así DuckDB lee únicamente
+    esas columnas y descarta row groups con las estadísticas min/max. El rango de fechas es semiabierto
+    [since, until). En filters un valor escalar se compara por igualdad y una lista con IN.
+    En almacenamiento Parquet el rango de fechas además descarta los meses del dataset fuera del rango.
+    """
+    select = ", ".join(columns) if columns else "*"
+    conditions, params = [], {}
+    if date_column and since:
+        conditions.append(f"{date_column} >= CAST($since AS DATE)")
+        params["since"] = since
+    if date_column and until:
+        conditions.append(f"{date_column} < CAST($until AS DATE)")
+        params["until"] = until
+    for position, (column, value) in enumerate((filters or {}).items()):
+        name = f"filtro_{position}"
+        if isinstance(value, (list, tuple, set, pl.Series)):
+            conditions.append(f"{column} IN (SELECT UNNEST(${name}))")
+            params[name] = list(value)
+        elif value is None:
+            conditions.append(f"{column} IS NULL")
+        else:
+            conditions.append(f"{column} = ${name}")
+            params[name] = value
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {select} FROM {read_source(db, table, date_column, since, until)} {where}", params
+
+
+def _lower_names(names: list[str]) -> list[str]:
     ## convertir los nombres de las columnas a minusculas
-    df.columns = [col.lower() for col in df.columns]
-    logging.info(" |- Datos cargados al lago")
-    return df
+    return [col.lower() for col in names]
+
+
+def load_data(db: str, table: str, columns: Optional[list[str]] = None, date_column: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None, filters: Optional[dict[str, Any]] = None,
+              output: str = "polars") -> Union[pl.DataFrame, pa.Table]:
+    """
+    Lee una tabla del lago con proyección y filtros resueltos en DuckDB. El resultado se entrega en Arrow
+    (output='arrow') o en Polars (output='polars') sin pasar por pandas, las columnas en minúsculas.
+    """
+    logging.info(f"|- Leyendo {table} del lago")
+    query, params = _read_query(db, table, columns, date_column, since, until, filters)
+    with lake_reader(db) as con:
+        data = con.execute(query, params).fetch_arrow_table()
+    data = data.rename_columns(_lower_names(data.column_names))
+    logging.info(f" |- {data.num_rows:,} filas y {data.num_columns} columnas leídas de {table}")
+    if output == "arrow":
+        return data
+    if output == "polars":
+        return pl.from_arrow(data)
+    raise ValueError(f"Salida no soportada: {output}")
+
+
+def iter_data(db: str, table: str, columns: Optional[list[str]] = None, date_column: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None, filters: Optional[dict[str, Any]] = None,
+              batch_size: int = READ_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    """
+    Igual que load_data pero entrega la tabla en record batches de Arrow, el cursor queda abierto mientras se
+    consume el iterador
+    """
+    query, params = _read_query(db, table, columns, date_column, since, until, filters)
+    with lake_reader(db) as con:
+        reader = con.execute(query, params).fetch_record_batch(batch_size)
+        names = _lower_names(reader.schema.names)
+        for batch in reader:
+            yield pa.RecordBatch.from_arrays(batch.columns, names=names)
+
+
+def read_data(db: str, table: str, columns: Optional[list[str]] = None, date_column: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None, filters: Optional[dict[str, Any]] = None,
+              batch_size: int = READ_BATCH_SIZE) -> pa.RecordBatchReader:
+    """
+    Igual que iter_data pero como RecordBatchReader de Arrow: otra conexión de DuckDB (por ejemplo la de otro
+    archivo del lago) lo consume por lotes sin materializar la tabla
+    """
+    query, params = _read_query(db, table, columns, date_column, since, until, filters)
+    with lake_reader(db) as con:
+        empty = con.execute(f"SELECT * FROM ({query}) LIMIT 0", params).fetch_arrow_table()
+    schema = empty.rename_columns(_lower_names(empty.column_names)).schema
+    return pa.RecordBatchReader.from_batches(
+        schema, iter_data(db, table, columns, date_column, since, until, filters, batch_size))
+
+
+def export_data(db: str, table: str, path: str, columns: Optional[list[str]] = None,
+                date_column: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                bucket: Optional[tuple[str, int, int]] = None) -> int:
+    """
+    Igual que load_data pero DuckDB escribe el resultado en un archivo Parquet, sin pasar por memoria de Python.
+    Con bucket=(columna, cubetas, cubeta) solo las filas cuyo hash de la columna cae en esa cubeta, las cubetas
+    de una misma columna no se solapan y cubren la tabla. Columnas en minúsculas. Retorna las filas escritas.
+    """
+    query, params = _read_query(db, table, columns, date_column, since, until)
+    if bucket:
+        column, buckets, number = bucket
+        query = f"SELECT * FROM ({query}) WHERE hash({column}) % {int(buckets)} = {int(number)}"
+    with lake_reader(db) as con:
+        names = [row[0] for row in con.execute(f"DESCRIBE ({query})", params).fetchall()]
+        select = ", ".join(f'"{name}" AS "{name.lower()}"' for name in names)
+        con.execute(f"COPY (SELECT {select} FROM ({query})) TO '{path}' (FORMAT parquet)", params)
+        return pq.ParquetFile(path).metadata.num_rows
+
+
+def scan_data(db: str, table: str, columns: Optional[list[str]] = None, date_column: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              filters: Optional[dict[str, Any]] = None) -> pl.LazyFrame:
+    """
+    LazyFrame sobre la tabla del lago: las columnas que el plan de Polars usa se piden a DuckDB y la tabla se lee
+    por lotes al ejecutar collect. Los filtros por fecha y llave se resuelven en DuckDB, los predicados propios
+    del plan se aplican a cada lote.
+    """
+    query, params = _read_query(db, table, columns, date_column, since, until, filters)
+    with lake_reader(db) as con:
+        empty = con.execute(f"SELECT * FROM ({query}) LIMIT 0", params).fetch_arrow_table()
+    schema = pl.from_arrow(empty.rename_columns(_lower_names(empty.column_names))).schema
+
+    def source(with_columns: Optional[list[str]], predicate: Optional[pl.Expr], n_rows: Optional[int],
+               batch_size: Optional[int]) -> Iterator[pl.DataFrame]:
+        projected = with_columns or list(schema.names())
+        remaining = n_rows
+        for batch in iter_data(db, table, projected, date_column, since, until, filters,
+                               batch_size or READ_BATCH_SIZE):
+            df = pl.from_arrow(batch)
+            if predicate is not None:
+                df = df.filter(predicate)
+            if remaining is not None:
+                df = df.head(remaining)
+                remaining -= df.height
+            yield df
+            if remaining is not None and remaining <= 0:
+                return
+
+    return register_io_source(source, schema=schema)
+
+
+def _identificaciones_query(con: duckdb.DuckDBPyConnection, table: str, column_id: str,
+                           persona_table: Optional[str] = None, persona_column: Optional[str] = None) -> str:
+    """
+    Identificaciones distintas y limpias de la tabla; con persona_table solo las que aún no existen en ella.
+    La limpieza, el DISTINCT y el anti-join se resuelven en DuckDB, que los desborda a disco si no caben en memoria.
+    """
+    persona_exists = persona_table is not None and con.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [persona_table]).fetchone()[0]
+    if has_ids(con, table, [column_id]) and (not persona_exists or has_ids(con, persona_table, [persona_column])):
+        # identificaciones internadas: DISTINCT y anti-join sobre enteros, el texto limpio sale del internado
+        column = id_column(column_id)
+        query = f"SELECT DISTINCT v.{column} AS id FROM {table} v WHERE v.{column} IS NOT NULL"
+        if persona_exists:
+            query = f"""
+                SELECT d.id FROM ({query}) d
+                WHERE NOT EXISTS (SELECT 1 FROM {persona_table} p WHERE p.{id_column(persona_column)} = d.id)
+                """
+        return f"SELECT i.valor AS num_iden FROM ({query}) d JOIN {intern_table('identificacion')} i ON i.id = d.id"
+
+    ## remover : " y ' de las identificaciones
+    query = f"""
+        SELECT DISTINCT regexp_replace(v.{column_id}, '[:"'']', '', 'g') AS num_iden
+        FROM {table} v
+        WHERE v.{column_id} IS NOT NULL
+        """
+    if persona_exists:
+        query = f"""
+            SELECT i.num_iden FROM ({query}) i
+            WHERE NOT EXISTS (SELECT 1 FROM {persona_table} p WHERE p.{persona_column} = i.num_iden)
+            """
+    return query
+
 
 def get_identificaciones_data(db, table, column_id) -> pl.DataFrame:
-    # Implement the logic to load data into the lake
-    logging.info("|- Cargando datos al lago")
-    con = duckdb.connect(database=f'./resources/data_lake/{db}.duckdb')
-    df = con.execute(f"select distinct(v.{column_id}) from {table} v ").fetch_df()
-    ## remover " y ' de las identificaciones :"
-    df['num_iden'] = df['num_iden'].str.replace(':','').str.replace('"','').str.replace("'",'')
-    df = pl.from_pandas(df)
-    logging.info(" |- Datos cargados al lago")
-    return df
\ No newline at end of file
+    logging.info(f"|- Cargando identificaciones de {table}")
+    with lake_reader(db) as con:
+        df = con.execute(_identificaciones_query(con, table, column_id)).pl()
+    logging.info(f" |- Identificaciones distintas: {df.height:,}")
+    return df
+
+
+def get_identificaciones_pendientes(db, table, column_id, persona_table='lk_persona',
+                                    persona_column='IDENTIFIER_VALUE') -> pl.DataFrame:
+    """
+    Identificaciones distintas de la tabla que todavía no existen en la tabla de personas del lago.
+    Solo vuelve el delta a consultar en el MPI.
+    """
+    logging.info("|- Cargando identificaciones pendientes de consultar en el MPI")
+    with lake_reader(db) as con:
+        df = con.execute(_identificaciones_query(con, table, column_id, persona_table, persona_column)).pl()
+    logging.info(f" |- Identificaciones pendientes: {df.height:,}")
+    return df
+
+
+def iter_identificaciones_pendientes(db, table, column_id, persona_table='lk_persona',
+                                     persona_column='IDENTIFIER_VALUE',
+                                     batch_size: int = READ_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    """
+    Igual que get_identificaciones_pendientes pero en record batches de Arrow con la columna num_iden, la memoria
+    no depende de cuántas personas tenga el lago. El cursor lee una foto del lago, las personas que se escriben
+    mientras se consume el iterador no cambian el resultado.
+    """
+    logging.info("|- Leyendo en lotes las identificaciones pendientes de consultar en el MPI")
+    with lake_reader(db) as con:
+        reader = con.execute(_identificaciones_query(con, table, column_id, persona_table,
+                                                     persona_column)).fetch_record_batch(batch_size)
+        yield from reader
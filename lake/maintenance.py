@@ -0,0 +1,225 @@
+import glob
+import logging
+import os
+import re
+import shutil
+from typing import Optional
+
+import duckdb
+
+from lake.parquet_lake import (PARQUET_ROW_GROUP_SIZE, dataset_path, is_parquet_table, parquet_relation,
+                               partition_files, sql_list, swap_partition, work_path)
+from lake.session import LAKE_DIRECTORY, close_session, lake_config, lake_path
+
+# orden físico de las filas al compactar, las consultas filtran por fecha y establecimiento y las zonemaps de
+# cada row group descartan lo que no cae en el filtro. Las tablas sin entrada se ordenan por su llave única.
+CLUSTER_COLUMNS = {
+    "lk_vacunacion_covid": ["fecha_aplicacion", "unicodigo", "num_iden"],
+    "db_vacunacion_rutinario": ["FECHAVACUNACION", "PUNTOVACUNACION_ID", "NUMEROIDENTIFICACION"],
+    "ix_historial": ["num_iden", "fecha_aplicacion"],
+}
+
+# ancho aproximado en bytes de los tipos fijos, para estimar el tamaño sin comprimir
+_TYPE_WIDTHS = {
+    "BOOLEAN": 1, "TINYINT": 1, "SMALLINT": 2, "INTEGER": 4, "BIGINT": 8, "HUGEINT": 16, "FLOAT": 4,
+    "DOUBLE": 8, "DATE": 4, "TIME": 8, "TIMESTAMP": 8, "TIMESTAMP WITH TIME ZONE": 8, "UUID": 16,
+}
+
+
+# columnas de un CREATE [UNIQUE] INDEX nombre ON tabla(columnas);
+_INDEX_KEYS = re.compile(r"\bON\s+\S+?\s*\((.*)\)\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+
+
+def lake_databases() -> list[str]:
+    return sorted(os.path.basename(path)[:-len(".duckdb")]
+                  for path in glob.glob(os.path.join(LAKE_DIRECTORY, "*.duckdb")))
+
+
+def _cluster_columns(con: duckdb.DuckDBPyConnection, database: str, table: str) -> list[str]:
+    columns = {row[0].lower(): row[0] for row in con.execute(
+        "SELECT column_name FROM duckdb_columns() WHERE database_name = ? AND table_name = ?",
+        [database, table]).fetchall()}
+    cluster = [columns[col.lower()] for col in CLUSTER_COLUMNS.get(table, []) if col.lower() in columns]
+    if cluster:
+        return cluster
+    # sin columnas de orden declaradas se ordena por la llave del índice único; expressions es un VARCHAR, las
+    # columnas salen del DDL del índice tal como se escribieron (con comillas si las tienen)
+    index = con.execute("""
+        SELECT sql FROM duckdb_indexes() WHERE database_name = ? AND table_name = ? AND is_unique
+        AND sql IS NOT NULL ORDER BY index_name LIMIT 1
+        """, [database, table]).fetchone()
+    if index is None:
+        return []
+    match = _INDEX_KEYS.search(index[0])
+    return [key.strip() for key in match.group(1).split(",")] if match else []
+
+
+def compact_database(db: str) -> tuple[int, int]:
+    """
+    Reescribe el archivo del lago en uno nuevo: cada tabla se copia ordenada por sus columnas de orden y después se
+    recrean los índices y las vistas. El archivo nuevo no arrastra bloques libres ni el orden de llegada de los
+    chunks. Cierra la sesión del lago de db. Retorna el tamaño en bytes antes y después.
+    """
+    path = lake_path(db)
+    close_session(db)
+    # el WAL se aplica al archivo antes de copiarlo
+    duckdb.connect(path).close()
+    size_before = os.path.getsize(path)
+    compact_path = f"{path}.compact"
+    if os.path.exists(compact_path):
+        os.remove(compact_path)
+
+    logging.info(f"|- Compactando {path}")
+    try:
+        with duckdb.connect(compact_path, config=lake_config()) as con:
+            con.execute(f"ATTACH '{path}' AS origen (READ_ONLY)")
+            tables = con.execute("""
+                SELECT table_name, sql FROM duckdb_tables() WHERE database_name = 'origen' AND NOT temporary
+                ORDER BY table_oid
+                """).fetchall()
+            for table, sql in tables:
+                # el DDL original conserva las restricciones (PRIMARY KEY, FOREIGN KEY) que CREATE TABLE AS pierde
+                con.execute(sql)
+                cluster = _cluster_columns(con, "origen", table)
+                order = f"ORDER BY {', '.join(cluster)}" if cluster else ""
+                con.execute(f"INSERT INTO {table} SELECT * FROM origen.{table} {order}")
+                logging.info(f" |- {table} reescrita" + (f" ordenada por {', '.join(cluster)}" if cluster else ""))
+            for (sql,) in con.execute("""
+                    SELECT sql FROM duckdb_indexes() WHERE database_name = 'origen' AND sql IS NOT NULL
+                    """).fetchall():
+                con.execute(sql)
+            for (sql,) in con.execute("""
+                    SELECT sql FROM duckdb_views() WHERE database_name = 'origen' AND NOT internal ORDER BY view_oid
+                    """).fetchall():
+                con.execute(sql)
+            con.execute("DETACH origen")
+            con.execute("CHECKPOINT")
+
+        os.replace(compact_path, path)
+    finally:
+        # si la copia falla el archivo original queda intacto, el parcial y su WAL no se conservan
+        for leftover in (compact_path, f"{compact_path}.wal"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    size_after = os.path.getsize(path)
+    logging.info(f" |- {path}: {size_before / 2**20:,.1f} MiB -> {size_after / 2**20:,.1f} MiB")
+    return size_before, size_after
+
+
+def compact_dataset(db: str, table: str) -> int:
+    """
+    Reescribe cada mes del dataset Parquet de la tabla en un solo archivo ordenado por sus columnas de orden.
+    Retorna los meses reescritos.
+    """
+    close_session(db)
+    rewritten = 0
+    with duckdb.connect(config=lake_config()) as con:
+        for path in sorted(glob.glob(os.path.join(dataset_path(db, table), "anio=*", "mes=*"))):
+            files = partition_files(path)
+            if not files:
+                continue
+            columns = {row[0].lower(): row[0] for row in con.execute(
+                f"DESCRIBE SELECT * FROM {parquet_relation(files)}").fetchall()}
+            cluster = [columns[col.lower()] for col in CLUSTER_COLUMNS.get(table, []) if col.lower() in columns]
+            order = f"ORDER BY {', '.join(cluster)}" if cluster else ""
+            work = work_path(path, "tmp")
+            shutil.rmtree(work, ignore_errors=True)
+            os.makedirs(work)
+            con.execute(f"""
+                COPY (SELECT * FROM {parquet_relation(files)} {order}) TO '{os.path.join(work, "part-00000.parquet")}'
+                (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {PARQUET_ROW_GROUP_SIZE})
+                """)
+            swap_partition(path)
+            rewritten += 1
+    logging.info(f" |- {table}: {rewritten} meses del dataset reescritos")
+    return rewritten
+
+
+def _logical_bytes(con: duckdb.DuckDBPyConnection, table: str) -> Optional[int]:
+    # tamaño sin comprimir estimado: ancho fijo por tipo y largo real de los textos
+    parts = []
+    for column, column_type, *_ in con.execute(f"DESCRIBE {table}").fetchall():
+        if column_type in _TYPE_WIDTHS:
+            parts.append(f"COUNT(*) * {_TYPE_WIDTHS[column_type]}")
+        elif column_type.startswith("DECIMAL"):
+            parts.append("COUNT(*) * 8")
+        elif column_type == "VARCHAR":
+            parts.append(f'coalesce(SUM(strlen("{column}")), 0)')
+    if not parts:
+        return None
+    return con.execute(f"SELECT {' + '.join(parts)} FROM {table}").fetchone()[0]
+
+
+def table_statistics(db: str) -> list[dict]:
+    """
+    Estadísticas de almacenamiento de cada tabla del lago: filas, bytes en disco, razón de compresión estimada,
+    row groups y compresiones usadas por los segmentos. Las tablas en Parquet se miden con la metadata de sus
+    archivos.
+    """
+    stats = []
+    close_session(db)
+    with duckdb.connect(lake_path(db), read_only=True) as con:
+        block_size = con.execute("SELECT block_size FROM pragma_database_size()").fetchone()[0]
+        tables = [row[0] for row in con.execute("""
+            SELECT table_name FROM information_schema.tables
+            WHERE table_catalog = current_database() ORDER BY table_name
+            """).fetchall()]
+        for table in tables:
+            if is_parquet_table(table):
+                files = glob.glob(os.path.join(dataset_path(db, table), "anio=*", "mes=*", "*.parquet"))
+                if not files:
+                    continue
+                rows, row_groups, compressed, uncompressed = con.execute(f"""
+                    SELECT SUM(row_group_num_rows) FILTER (WHERE column_id = 0),
+                           COUNT(DISTINCT (file_name, row_group_id)),
+                           SUM(total_compressed_size), SUM(total_uncompressed_size)
+                    FROM parquet_metadata({sql_list(files)})
+                    """).fetchone()
+                stats.append({"table": table, "storage": "parquet", "rows": rows,
+                              "bytes": sum(os.path.getsize(file) for file in files), "row_groups": row_groups,
+                              "ratio": uncompressed / compressed if compressed else None,
+                              "compression": "zstd", "files": len(files)})
+                continue
+            if con.execute("SELECT COUNT(*) FROM duckdb_views() WHERE view_name = ?", [table]).fetchone()[0]:
+                continue
+            rows = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            blocks, row_groups = con.execute(f"""
+                SELECT COUNT(DISTINCT block_id), COUNT(DISTINCT row_group_id)
+                FROM pragma_storage_info('{table}') WHERE block_id IS NOT NULL
+                """).fetchone()
+            compression = ", ".join(f"{name} {segments}" for name, segments in con.execute(f"""
+                SELECT compression, COUNT(*) FROM pragma_storage_info('{table}')
+                WHERE segment_type <> 'VALIDITY' GROUP BY compression ORDER BY COUNT(*) DESC
+                """).fetchall())
+            logical = _logical_bytes(con, table)
+            disk = blocks * block_size
+            stats.append({"table": table, "storage": "duckdb", "rows": rows, "bytes": disk, "row_groups": row_groups,
+                          "ratio": logical / disk if logical and disk else None, "compression": compression})
+    return stats
+
+
+def log_statistics(db: str, stats: list[dict]):
+    logging.info(f"|- Estadísticas de {db}")
+    for table in stats:
+        ratio = f"{table['ratio']:.1f}x" if table["ratio"] else "-"
+        rows_per_group = table["rows"] / table["row_groups"] if table["row_groups"] else 0
+        logging.info(f" |- {table['table']} ({table['storage']}): {table['rows']:,} filas, "
+                     f"{table['bytes'] / 2**20:,.1f} MiB, compresión {ratio}, {table['row_groups']:,} row groups "
+                     f"({rows_per_group:,.0f} filas por row group), segmentos: {table['compression']}")
+
+
+def maintain_lake(databases: Optional[list[str]] = None, compact: bool = True) -> dict[str, list[dict]]:
+    """
+    Mantenimiento del lago: compacta y reordena cada archivo (y los datasets Parquet de sus tablas) y reporta sus
+    estadísticas de almacenamiento. Sin compact solo reporta.
+    """
+    report = {}
+    for db in databases or lake_databases():
+        if compact:
+            compact_database(db)
+            for table in CLUSTER_COLUMNS:
+                if is_parquet_table(table) and os.path.isdir(dataset_path(db, table)):
+                    compact_dataset(db, table)
+        report[db] = table_statistics(db)
+        log_statistics(db, report[db])
+    return report
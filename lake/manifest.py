@@ -0,0 +1,163 @@
+import json
+import logging
+from datetime import date, datetime
+from typing import Optional
+
+import duckdb
+
+from lake.session import lake_reader, lake_write
+
+
+def _create_manifest_table(con: duckdb.DuckDBPyConnection):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS lk_chunk_manifest (
+            ejecucion VARCHAR,
+            fuente VARCHAR,
+            particion_inicio VARCHAR,
+            particion_fin VARCHAR,
+            chunk INTEGER,
+            llave_desde VARCHAR,
+            llave_hasta VARCHAR,
+            filas BIGINT,
+            estado VARCHAR,
+            intentos INTEGER,
+            duracion_s DOUBLE,
+            error VARCHAR,
+            actualizado TIMESTAMP
+        )
+    """)
+
+
+def _execute(con: duckdb.DuckDBPyConnection, query: str, params: list):
+    _create_manifest_table(con)
+    con.execute(query, params)
+
+
+def encode_key(key: Optional[tuple]) -> Optional[str]:
+    """
+    Serializa una llave de paginación conservando el tipo de cada valor, para volver a usarla como bind
+    """
+    if key is None:
+        return None
+    values = []
+    for value in key:
+        if isinstance(value, datetime):
+            values.append(["datetime", value.isoformat()])
+        elif isinstance(value, date):
+            values.append(["date", value.isoformat()])
+        else:
+            values.append([type(value).__name__, value])
+    return json.dumps(values)
+
+
+def decode_key(text: Optional[str]) -> Optional[tuple]:
+    if text is None:
+        return None
+    values = []
+    for kind, value in json.loads(text):
+        if kind == "datetime":
+            values.append(datetime.fromisoformat(value))
+        elif kind == "date":
+            values.append(date.fromisoformat(value))
+        else:
+            values.append(value)
+    return tuple(values)
+
+
+class ChunkManifest:
+    """
+    Bitácora de una ejecución de carga en lk_chunk_manifest: una fila por partición (chunk NULL) con su estado
+    y una fila por chunk escrito con su rango de llaves, filas, intentos y duración.
+    """
+
+    def __init__(self, db: str, source: str, run_id: str, chunk_offsets: Optional[dict] = None):
+        self.db = db
+        self.source = source
+        self.run_id = run_id
+        # al retomar una partición la numeración de chunks continúa después del último completado
+        self._chunk_offsets = chunk_offsets or {}
+
+    def chunk_completed(self, start: str, end: str, number: int, key_from: Optional[tuple], key_to: Optional[tuple],
+                        rows: int, attempts: int, duration: float):
+        self._record_chunk(start, end, number, key_from, key_to, rows, 'completado', attempts, duration)
+
+    def chunk_failed(self, start: str, end: str, number: int, key_from: Optional[tuple], attempts: int,
+                     duration: float, error: str):
+        self._record_chunk(start, end, number, key_from, None, None, 'fallido', attempts, duration, error)
+
+    def _record_chunk(self, start, end, number, key_from, key_to, rows, status, attempts, duration, error=None):
+        number += self._chunk_offsets.get((start, end), 0)
+        lake_write(self.db, _execute, """
+            INSERT INTO lk_chunk_manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, now())
+        """, [self.run_id, self.source, start, end, number, encode_key(key_from), encode_key(key_to), rows, status,
+              attempts, duration, error])
+
+    def partition_completed(self, start: str, end: str, rows: int, duration: float):
+        self._update_partition(start, end, 'completado', rows, duration, None)
+
+    def partition_failed(self, start: str, end: str, error: str):
+        self._update_partition(start, end, 'fallido', None, None, error)
+
+    def _update_partition(self, start, end, status, rows, duration, error):
+        lake_write(self.db, _execute, """
+            UPDATE lk_chunk_manifest
+            SET estado = ?, filas = COALESCE(?, filas), duracion_s = COALESCE(?, duracion_s), error = ?,
+                actualizado = now()
+            WHERE ejecucion = ? AND fuente = ? AND particion_inicio = ? AND particion_fin = ? AND chunk IS NULL
+        """, [status, rows, duration, error, self.run_id, self.source, start, end])
+
+
+def _register_partitions(con: duckdb.DuckDBPyConnection, run_id: str, source: str, partitions: list[tuple[str, str]]):
+    _create_manifest_table(con)
+    con.executemany("""
+        INSERT INTO lk_chunk_manifest (ejecucion, fuente, particion_inicio, particion_fin, estado, actualizado)
+        VALUES (?, ?, ?, ?, 'pendiente', now())
+    """, [[run_id, source, start, end] for start, end in partitions])
+
+
+def start_run(db: str, source: str, partitions: list[tuple[str, str]]) -> ChunkManifest:
+    """
+    Registra una nueva ejecución con todas sus particiones en estado pendiente
+    """
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    lake_write(db, _register_partitions, run_id, source, partitions)
+    logging.info(f" |- Ejecución {run_id} de {source} registrada con {len(partitions)} particiones")
+    return ChunkManifest(db, source, run_id)
+
+
+def resume_run(db: str, source: str) -> Optional[tuple[ChunkManifest, list[tuple[str, str]], dict]]:
+    """
+    Retoma la última ejecución de la fuente si quedó incompleta. Retorna el manifiesto, las particiones que no
+    terminaron y, por partición, la llave del último chunk completado desde donde se continúa.
+    """
+    with lake_reader(db) as con:
+        exists = con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'lk_chunk_manifest'").fetchone()
+        if not exists[0]:
+            return None
+        row = con.execute("SELECT MAX(ejecucion) FROM lk_chunk_manifest WHERE fuente = ?", [source]).fetchone()
+        run_id = row[0] if row else None
+        if run_id is None:
+            return None
+        pending = con.execute("""
+            SELECT particion_inicio, particion_fin FROM lk_chunk_manifest
+            WHERE ejecucion = ? AND fuente = ? AND chunk IS NULL AND estado <> 'completado'
+            ORDER BY particion_inicio
+        """, [run_id, source]).fetchall()
+        last_chunks = con.execute("""
+            SELECT particion_inicio, particion_fin, MAX(chunk), arg_max(llave_hasta, chunk) FROM lk_chunk_manifest
+            WHERE ejecucion = ? AND fuente = ? AND chunk IS NOT NULL AND estado = 'completado'
+            GROUP BY particion_inicio, particion_fin
+        """, [run_id, source]).fetchall()
+    if not pending:
+        logging.info(f" |- La última ejecución de {source} ({run_id}) terminó completa, no hay nada que retomar")
+        return None
+
+    partitions = [(start, end) for start, end in pending]
+    resume_keys, chunk_offsets = {}, {}
+    for start, end, last_chunk, last_key in last_chunks:
+        if (start, end) in partitions:
+            resume_keys[(start, end)] = decode_key(last_key)
+            chunk_offsets[(start, end)] = last_chunk
+    logging.info(f" |- Retomando ejecución {run_id} de {source}: {len(partitions)} particiones pendientes, "
+                 f"{len(resume_keys)} con chunks ya completados")
+    return ChunkManifest(db, source, run_id, chunk_offsets), partitions, resume_keys
@@ -0,0 +1,277 @@
+import glob
+import logging
+import os
+import shutil
+import uuid
+from datetime import date
+from functools import partial
+from typing import Optional
+
+import duckdb
+
+from lake.session import LAKE_DIRECTORY, after_commit
+
+# almacenamiento de las tablas particionadas del lago: 'duckdb' (tabla en el archivo .duckdb) o 'parquet'
+# (dataset Parquet particionado por año/mes, con una vista del mismo nombre en el archivo .duckdb)
+LAKE_STORAGE = os.getenv("LAKE_STORAGE", "duckdb")
+
+# columna de fecha que define la partición año/mes de cada tabla que admite el almacenamiento Parquet
+PARTITION_COLUMNS = {
+    "lk_vacunacion_covid": "fecha_aplicacion",
+    "db_vacunacion_rutinario": "FECHAVACUNACION",
+}
+
+# filas por row group, cada row group lleva sus estadísticas min/max
+PARQUET_ROW_GROUP_SIZE = 1_000_000
+
+# partición de las filas sin fecha
+_NULL_PARTITION = (0, 0)
+
+# meses preparados por una escritura confirmada y todavía no publicados en el dataset
+_PENDING_TABLE = "lk_parquet_pendiente"
+
+
+def is_parquet_table(table: str) -> bool:
+    return LAKE_STORAGE == "parquet" and table in PARTITION_COLUMNS
+
+
+def dataset_path(db: str, table: str) -> str:
+    return os.path.join(LAKE_DIRECTORY, db, table)
+
+
+def _partition_path(db: str, table: str, year: int, month: int) -> str:
+    return os.path.join(dataset_path(db, table), f"anio={year:04d}", f"mes={month:02d}")
+
+
+def partition_files(path: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(path, "*.parquet")))
+
+
+def sql_list(values: list[str]) -> str:
+    return "[" + ", ".join("'" + value.replace("'", "''") + "'" for value in values) + "]"
+
+
+def parquet_relation(files: list[str]) -> str:
+    # relación SQL sobre los archivos, las columnas se unen por nombre entre archivos de esquemas distintos
+    return f"read_parquet({sql_list(files)}, hive_partitioning = false, union_by_name = true)"
+
+
+def work_path(path: str, suffix: str) -> str:
+    # directorios de trabajo con prefijo _, el patrón mes=* de la vista y de las lecturas no los incluye
+    return os.path.join(os.path.dirname(path), f"_{os.path.basename(path)}.{suffix}")
+
+
+def _target_path(work: str) -> str:
+    return os.path.join(os.path.dirname(work), os.path.basename(work)[1:].rsplit(".", 1)[0])
+
+
+def _publish_partition(work: str):
+    """
+    Publica un mes preparado: un directorio .tmp reemplaza al mes completo y los archivos de un directorio .add
+    se agregan al mes. Se puede repetir si se interrumpió a medias.
+    """
+    path = _target_path(work)
+    if work.endswith(".add"):
+        os.makedirs(path, exist_ok=True)
+        for file in partition_files(work):
+            os.replace(file, os.path.join(path, os.path.basename(file)))
+        shutil.rmtree(work)
+        return
+    swap_partition(path)
+    if not partition_files(path):
+        shutil.rmtree(path)
+
+
+def _publish_partitions(con: duckdb.DuckDBPyConnection, db: str, table: str, works: list[str]):
+    # después del COMMIT: los meses pasan al dataset y dejan de estar pendientes
+    for work in works:
+        _publish_partition(work)
+    con.execute(f"DELETE FROM {_PENDING_TABLE} WHERE tabla = ?", [table])
+    _ensure_view(con, db, table)
+
+
+def _recover_partitions(con: duckdb.DuckDBPyConnection, db: str, table: str):
+    """
+    Deja el dataset consistente después de una escritura interrumpida: un .old sin su reemplazo vuelve a su
+    lugar, los meses preparados de una transacción confirmada se publican y los demás se descartan
+    """
+    for old in glob.glob(os.path.join(dataset_path(db, table), "anio=*", "_mes=*.old")):
+        current = os.path.join(os.path.dirname(old), os.path.basename(old)[1:-len(".old")])
+        if os.path.exists(current):
+            shutil.rmtree(old)
+        else:
+            os.replace(old, current)
+    con.execute(f"CREATE TABLE IF NOT EXISTS {_PENDING_TABLE} (tabla VARCHAR, ruta VARCHAR)")
+    committed = {row[0] for row in con.execute(f"SELECT ruta FROM {_PENDING_TABLE} WHERE tabla = ?",
+                                               [table]).fetchall()}
+    for suffix in ("tmp", "add"):
+        for work in glob.glob(os.path.join(dataset_path(db, table), "anio=*", f"_mes=*.{suffix}")):
+            if work in committed:
+                _publish_partition(work)
+            else:
+                shutil.rmtree(work)
+    con.execute(f"DELETE FROM {_PENDING_TABLE} WHERE tabla = ?", [table])
+
+
+def swap_partition(path: str):
+    # el directorio nuevo reemplaza al anterior con renombres, un lector ve la partición vieja o la nueva
+    if os.path.exists(path):
+        os.replace(path, work_path(path, "old"))
+    os.replace(work_path(path, "tmp"), path)
+    shutil.rmtree(work_path(path, "old"), ignore_errors=True)
+
+
+def _partition_range(partition: tuple[str, str, str]) -> list[tuple[int, int]]:
+    _, since, until = partition
+    since, until = date.fromisoformat(str(since)[:10]), date.fromisoformat(str(until)[:10])
+    months, current = [], date(since.year, since.month, 1)
+    while current < until:
+        months.append((current.year, current.month))
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+    return months
+
+
+def _ensure_view(con: duckdb.DuckDBPyConnection, db: str, table: str):
+    # la vista expone el dataset con el nombre de la tabla, las lecturas existentes funcionan sin cambios
+    table_type = con.execute("SELECT table_type FROM information_schema.tables WHERE table_name = ?",
+                             [table]).fetchone()
+    if table_type is not None and table_type[0] != "VIEW":
+        raise ValueError(f"{table} ya existe como tabla en {db}.duckdb, no se puede exponer el dataset Parquet")
+    pattern = os.path.join(dataset_path(db, table), "anio=*", "mes=*", "*.parquet")
+    con.execute(f"CREATE OR REPLACE VIEW {table} AS "
+                f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = false, union_by_name = true)")
+
+
+def _months_with_keys(con: duckdb.DuckDBPyConnection, db: str, table: str, keys: str) -> dict[tuple, list[str]]:
+    """
+    Meses del dataset, con sus archivos, que ya tienen alguna de las llaves de tmp_particiones. Solo se leen las
+    columnas de la llave.
+    """
+    files = {file: (int(os.path.basename(os.path.dirname(os.path.dirname(file))).split("=")[1]),
+                    int(os.path.basename(os.path.dirname(file)).split("=")[1]))
+             for file in glob.glob(os.path.join(dataset_path(db, table), "anio=*", "mes=*", "*.parquet"))}
+    if not files:
+        return {}
+    matched = con.execute(f"""
+        SELECT DISTINCT filename FROM read_parquet({sql_list(sorted(files))}, hive_partitioning = false,
+                                                   union_by_name = true, filename = true)
+        SEMI JOIN (SELECT {keys} FROM tmp_particiones) USING ({keys})
+        """).fetchall()
+    months: dict[tuple, list[str]] = {}
+    for (file,) in matched:
+        months.setdefault(files[file], []).append(file)
+    return months
+
+
+def write_partitions(con: duckdb.DuckDBPyConnection, db: str, table: str, keys_columns: list[str], mode: str,
+                     partition: Optional[tuple[str, str, str]], source: str) -> tuple[int, int, int]:
+    """
+    Escribe las filas de source (una por llave) en el dataset Parquet de la tabla. La llave es única en todo el
+    dataset: en 'insert' se omiten las llaves que existen en cualquier mes y en 'upsert' se quitan de los meses
+    donde estaban. Solo se reescribe completo, ordenado por fecha y llave, un mes del que se quitan filas; a los
+    demás las filas nuevas se agregan en un archivo más (compact_dataset los une).
+    Los meses se preparan en directorios de trabajo y se publican después del COMMIT de la escritura, un fallo
+    antes no deja cambios en el dataset.
+    Retorna (insertadas, actualizadas, borradas).
+    """
+    column = PARTITION_COLUMNS[table]
+    keys = ", ".join(keys_columns)
+    _recover_partitions(con, db, table)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE tmp_particiones AS
+        SELECT *, coalesce(year({column}), 0) AS anio__, coalesce(month({column}), 0) AS mes__ FROM ({source})
+        """)
+    months = {tuple(row) for row in con.execute("SELECT DISTINCT anio__, mes__ FROM tmp_particiones").fetchall()}
+    existing_keys = _months_with_keys(con, db, table, keys)
+    if mode == "upsert":
+        months.update(existing_keys)
+    if mode == "replace_partition":
+        months.update(_partition_range(partition))
+
+    matched = [file for month_files in existing_keys.values() for file in month_files]
+    added = removed = 0
+    works = []
+    for year, month in sorted(months):
+        path = _partition_path(db, table, year, month)
+        files = partition_files(path)
+        new_rows = f"SELECT * EXCLUDE (anio__, mes__) FROM tmp_particiones WHERE anio__ = {year} AND mes__ = {month}"
+        if mode == "insert" and matched:
+            new_rows = f"SELECT * FROM ({new_rows}) ANTI JOIN {parquet_relation(matched)} USING ({keys})"
+        if mode == "upsert" and (year, month) in existing_keys:
+            old_rows = (f"SELECT * FROM {parquet_relation(files)} "
+                        f"ANTI JOIN (SELECT {keys} FROM tmp_particiones) USING ({keys})")
+        elif mode == "replace_partition" and files and (year, month) in _partition_range(partition):
+            _, since, until = partition
+            old_rows = (f"SELECT * FROM {parquet_relation(files)} "
+                        f"WHERE NOT coalesce({column} >= CAST('{since}' AS DATE) "
+                        f"AND {column} < CAST('{until}' AS DATE), false)")
+        else:
+            old_rows = None
+
+        if old_rows is None:
+            # sin filas que quitar el mes no se reescribe, las nuevas van en un archivo aparte
+            work = work_path(path, "add")
+            merged, before, kept = new_rows, 0, 0
+            file = f"part-{uuid.uuid4().hex}.parquet"
+        else:
+            work = work_path(path, "tmp")
+            before = con.execute(f"SELECT COUNT(*) FROM {parquet_relation(files)}").fetchone()[0]
+            kept = con.execute(f"SELECT COUNT(*) FROM ({old_rows})").fetchone()[0]
+            merged = f"{old_rows} UNION ALL BY NAME {new_rows}"
+            file = "part-00000.parquet"
+        os.makedirs(work)
+        written = con.execute(f"""
+            COPY (SELECT * FROM ({merged}) ORDER BY {column}, {keys})
+            TO '{os.path.join(work, file)}'
+            (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {PARQUET_ROW_GROUP_SIZE})
+            """).fetchone()[0]
+        if not written:
+            os.remove(os.path.join(work, file))
+        if old_rows is None and not written:
+            shutil.rmtree(work)
+            continue
+        con.execute(f"INSERT INTO {_PENDING_TABLE} VALUES (?, ?)", [table, work])
+        works.append(work)
+        added += written - kept
+        removed += before - kept
+        logging.debug(f" |- {table} anio={year:04d}/mes={month:02d}: {written:,} filas "
+                      f"{'en la partición' if old_rows is not None else 'agregadas'}")
+
+    con.execute("DROP TABLE tmp_particiones")
+    if works:
+        after_commit(db, partial(_publish_partitions, db=db, table=table, works=works))
+
+    # en upsert las llaves quitadas de un mes vuelven en las filas nuevas y cuentan como actualizadas
+    if mode == "replace_partition":
+        return added, 0, removed
+    if mode == "upsert":
+        return added - removed, removed, 0
+    return added, 0, 0
+
+
+def read_source(db: str, table: str, date_column: Optional[str] = None, since: Optional[str] = None,
+                until: Optional[str] = None) -> str:
+    """
+    Relación SQL para leer la tabla. En almacenamiento Parquet, si el filtro de fechas es sobre la columna de
+    partición solo se leen los archivos de los meses del rango [since, until); dentro de cada archivo DuckDB
+    descarta row groups con las estadísticas min/max.
+    """
+    if not is_parquet_table(table) or not date_column or date_column.lower() != PARTITION_COLUMNS[table].lower():
+        return table
+    if not since and not until:
+        return table
+    first = date.fromisoformat(str(since)[:10]) if since else date.min
+    last = date.fromisoformat(str(until)[:10]) if until else date.max
+    files = []
+    for path in sorted(glob.glob(os.path.join(dataset_path(db, table), "anio=*", "mes=*"))):
+        year = int(os.path.basename(os.path.dirname(path)).split("=")[1])
+        month = int(os.path.basename(path).split("=")[1])
+        if (year, month) == _NULL_PARTITION:
+            continue
+        if date(year, month, 1) < last and (year, month) >= (first.year, first.month):
+            files.extend(partition_files(path))
+    if not files:
+        # ningún mes en el rango, se conserva el esquema de la tabla
+        return f"(SELECT * FROM {table} LIMIT 0)"
+    logging.debug(f" |- {table}: {len(files)} archivos del dataset en el rango de fechas")
+    return parquet_relation(files)
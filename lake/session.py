@@ -0,0 +1,248 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+import duckdb
+
+LAKE_DIRECTORY = "./resources/data_lake"
+
+# configuración de DuckDB para las bases del lago, sin definir se usan los valores por defecto de DuckDB
+LAKE_THREADS = os.getenv("LAKE_THREADS")
+LAKE_MEMORY_LIMIT = os.getenv("LAKE_MEMORY_LIMIT")
+LAKE_TEMP_DIRECTORY = os.getenv("LAKE_TEMP_DIRECTORY")
+
+# escrituras encoladas con la misma batch_key que se agrupan en una sola transacción
+LAKE_WRITE_BATCH = int(os.getenv("LAKE_WRITE_BATCH", 8))
+
+_STOP = object()
+
+
+def lake_path(db: str) -> str:
+    return os.path.join(LAKE_DIRECTORY, f"{db}.duckdb")
+
+
+def lake_config() -> dict:
+    # configuración de DuckDB de las conexiones al lago (hilos, memoria y directorio temporal)
+    config = {}
+    if LAKE_THREADS:
+        config["threads"] = int(LAKE_THREADS)
+    if LAKE_MEMORY_LIMIT:
+        config["memory_limit"] = LAKE_MEMORY_LIMIT
+    if LAKE_TEMP_DIRECTORY:
+        config["temp_directory"] = LAKE_TEMP_DIRECTORY
+    return config
+
+
+class _WriteTask:
+    def __init__(self, fn: Callable, args: tuple, batch_key: Optional[Hashable]):
+        self.fn = fn
+        self.args = args
+        self.batch_key = batch_key
+        self.future: Future = Future()
+
+
+class LakeSession:
+    """
+    Una conexión abierta por archivo del lago durante todo el proceso. Los lectores toman cursores propios
+    (cada uno con su transacción) y todas las escrituras pasan en orden por un único hilo escritor, así los
+    extractores en paralelo no compiten por el archivo ni recargan el catálogo en cada llamada.
+    """
+
+    def __init__(self, db: str):
+        self.db = db
+        os.makedirs(LAKE_DIRECTORY, exist_ok=True)
+        self._connection = duckdb.connect(lake_path(db), config=lake_config())
+        self._lock = threading.Lock()
+        self._tasks: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+        # acciones de la transacción en curso del hilo escritor, se ejecutan después del COMMIT
+        self._after_commit: list[Callable] = []
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"La sesión del lago {self.db} está cerrada")
+            return self._connection.cursor()
+
+    @contextmanager
+    def reader(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        cursor = self.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def submit(self, fn: Callable, *args, batch_key: Optional[Hashable] = None) -> Future:
+        """
+        Encola una escritura para el hilo escritor. Sin batch_key se ejecuta fn(cursor, *args) en su propia
+        transacción. Las escrituras consecutivas con la misma batch_key se agrupan: fn(cursor, [args, ...]) se
+        ejecuta una vez en una transacción y su resultado se entrega a todas.
+        """
+        task = _WriteTask(fn, args, batch_key)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"La sesión del lago {self.db} está cerrada")
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name=f"lake-writer-{self.db}", daemon=True)
+                self._writer.start()
+            self._tasks.put(task)
+        return task.future
+
+    def write(self, fn: Callable, *args, batch_key: Optional[Hashable] = None) -> Any:
+        """
+        Igual que submit pero espera a que la escritura termine y retorna su resultado o propaga su error
+        """
+        return self.submit(fn, *args, batch_key=batch_key).result()
+
+    def after_commit(self, fn: Callable):
+        """
+        Registra fn(cursor) para ejecutarse en el hilo escritor cuando la transacción en curso confirme, fuera de
+        ella; si la transacción se revierte fn se descarta. Solo se llama desde una escritura.
+        """
+        self._after_commit.append(fn)
+
+    def _next_batch(self, pending: list) -> Optional[list[_WriteTask]]:
+        task = pending.pop(0) if pending else self._tasks.get()
+        if task is _STOP:
+            return None
+        batch = [task]
+        if task.batch_key is None:
+            return batch
+        while len(batch) < LAKE_WRITE_BATCH:
+            try:
+                following = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if following is _STOP or following.batch_key != task.batch_key:
+                # el orden de las escrituras se respeta, la siguiente tarea distinta corre después del lote
+                pending.append(following)
+                break
+            batch.append(following)
+        return batch
+
+    def _write_loop(self):
+        cursor = self.cursor()
+        pending: list = []
+        try:
+            while True:
+                batch = self._next_batch(pending)
+                if batch is None:
+                    return
+                try:
+                    cursor.execute("BEGIN TRANSACTION")
+                    if batch[0].batch_key is None:
+                        result = batch[0].fn(cursor, *batch[0].args)
+                    else:
+                        if len(batch) > 1:
+                            logging.debug(f" |- Escritor {self.db}: {len(batch)} escrituras en una transacción")
+                        result = batch[0].fn(cursor, [task.args for task in batch])
+                    cursor.execute("COMMIT")
+                    actions, self._after_commit = self._after_commit, []
+                    for action in actions:
+                        action(cursor)
+                except BaseException as e:
+                    self._after_commit = []
+                    try:
+                        cursor.execute("ROLLBACK")
+                    except duckdb.Error:
+                        pass
+                    for task in batch:
+                        task.future.set_exception(e)
+                    continue
+                for task in batch:
+                    task.future.set_result(result)
+        finally:
+            cursor.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            writer = self._writer
+            if writer is not None:
+                self._tasks.put(_STOP)
+        if writer is not None:
+            writer.join()
+        self._connection.close()
+
+
+_sessions: dict[str, LakeSession] = {}
+_sessions_lock = threading.Lock()
+
+# funciones que se ejecutan después de cada escritura de una tabla, en la misma transacción del hilo escritor
+_write_hooks: dict[tuple[str, str], list[Callable]] = {}
+
+
+def register_write_hook(db: str, table: str, hook: Callable):
+    """
+    Registra hook(cursor, cambios, mode, partition) para las escrituras de db.table. cambios es una relación SQL
+    con las filas recibidas; mode y partition son los de la escritura (con 'insert' las llaves que ya existían se
+    omitieron). El hook corre en la transacción de la escritura y si falla la escritura se revierte.
+    """
+    hooks = _write_hooks.setdefault((db, table), [])
+    if hook not in hooks:
+        hooks.append(hook)
+
+
+def run_write_hooks(con: duckdb.DuckDBPyConnection, db: str, table: str, changes: str, mode: str = 'insert',
+                    partition: Optional[tuple[str, str, str]] = None):
+    for hook in _write_hooks.get((db, table), []):
+        hook(con, changes, mode, partition)
+
+
+def after_commit(db: str, fn: Callable):
+    get_session(db).after_commit(fn)
+
+
+def get_session(db: str) -> LakeSession:
+    """
+    Sesión compartida del archivo del lago, se abre en el primer uso y se reutiliza en todo el proceso
+    """
+    with _sessions_lock:
+        session = _sessions.get(db)
+        if session is None:
+            session = LakeSession(db)
+            _sessions[db] = session
+            logging.debug(f" |- Sesión del lago abierta: {lake_path(db)} {lake_config()}")
+    return session
+
+
+@contextmanager
+def lake_reader(db: str) -> Iterator[duckdb.DuckDBPyConnection]:
+    with get_session(db).reader() as cursor:
+        yield cursor
+
+
+def lake_write(db: str, fn: Callable, *args, batch_key: Optional[Hashable] = None) -> Any:
+    return get_session(db).write(fn, *args, batch_key=batch_key)
+
+
+def close_session(db: str):
+    """
+    Cierra la sesión de un archivo del lago, la siguiente operación sobre db abre una nueva
+    """
+    with _sessions_lock:
+        session = _sessions.pop(db, None)
+    if session is not None:
+        session.close()
+
+
+def close_sessions():
+    """
+    Espera las escrituras pendientes y cierra todas las sesiones del lago
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_sessions)
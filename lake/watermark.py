@@ -0,0 +1,77 @@
+import logging
+from typing import Optional
+
+import duckdb
+
+from lake.session import lake_reader, lake_write
+
+
+def _table_exists(con: duckdb.DuckDBPyConnection, table: str) -> bool:
+    # incluye las vistas, con LAKE_STORAGE=parquet las tablas particionadas son vistas sobre el dataset
+    return con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?",
+                       [table]).fetchone()[0] > 0
+
+
+def _create_watermark_table(con: duckdb.DuckDBPyConnection):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS lk_watermark (
+            fuente VARCHAR PRIMARY KEY,
+            fecha TIMESTAMP,
+            llave VARCHAR,
+            actualizado TIMESTAMP
+        )
+    """)
+
+
+def get_watermark(db: str, source: str) -> Optional[dict]:
+    """
+    Retorna el último watermark registrado para la fuente ({'fecha', 'llave'}) o None si nunca se cargó
+    """
+    with lake_reader(db) as con:
+        if not _table_exists(con, 'lk_watermark'):
+            return None
+        row = con.execute("SELECT fecha, llave FROM lk_watermark WHERE fuente = ?", [source]).fetchone()
+    if row is None:
+        return None
+    return {"fecha": row[0], "llave": row[1]}
+
+
+def set_watermark(db: str, source: str, fecha, llave):
+    """
+    Registra el watermark de la fuente, solo debe llamarse cuando la carga terminó sin errores
+    """
+    logging.info(f" |- Watermark {source}: fecha {fecha}, llave {llave}")
+    lake_write(db, _set_watermark, source, fecha, None if llave is None else str(llave))
+
+
+def _set_watermark(con: duckdb.DuckDBPyConnection, source: str, fecha, llave: Optional[str]):
+    _create_watermark_table(con)
+    con.execute("""
+        INSERT OR REPLACE INTO lk_watermark (fuente, fecha, llave, actualizado)
+        VALUES (?, ?, ?, now())
+    """, [source, fecha, llave])
+
+
+def get_last_key_in_lake(db: str, table: str, columns: list[str]) -> Optional[tuple]:
+    """
+    Última llave de la tabla según el orden de paginación de las columnas, None si la tabla no existe o está vacía
+    """
+    order = ', '.join([f'{col} DESC NULLS LAST' for col in columns])
+    return _fetch_lake_row(db, table, f"SELECT {', '.join(columns)} FROM {table} ORDER BY {order} LIMIT 1")
+
+
+def get_max_values_in_lake(db: str, table: str, columns: list[str]) -> Optional[tuple]:
+    """
+    Máximo de cada columna por separado, None si la tabla no existe o está vacía
+    """
+    return _fetch_lake_row(db, table, f"SELECT {', '.join([f'MAX({col})' for col in columns])} FROM {table}")
+
+
+def _fetch_lake_row(db: str, table: str, query: str) -> Optional[tuple]:
+    with lake_reader(db) as con:
+        if not _table_exists(con, table):
+            return None
+        row = con.execute(query).fetchone()
+    if row is None or all(value is None for value in row):
+        return None
+    return row
@@ -0,0 +1,211 @@
+import logging
+import time
+from typing import Optional, Union
+
+import duckdb
+import polars as pl
+import pyarrow as pa
+
+from lake.load_lake import read_data
+from lake.session import lake_reader, lake_write, run_write_hooks
+from process.clean_transform_orchester import PROCESSED_TABLE
+
+# archivo del lago con el modelo estrella, lo crea lake.init_lake.generate_bi_schema
+BI_DB = 'vacunacion_schema'
+
+# columnas de los datos procesados que usa el modelo, las que falten se cargan como NULL
+HECHOS_COLUMNS = [
+    "id_vac_depu", "fecha_aplicacion", "fecha_aplicacion_final", "unicodigo", "punto_vacunacion",
+    "nombre_vacuna", "lote_vacuna", "tipo_iden", "num_iden", "apellidos", "nombres", "sexo", "fecha_nacimiento",
+    "nacionalidad", "etnia", "profesional_aplica", "iden_profesional_aplica", "dosis_aplicada", "grupo_etario",
+]
+
+ESTABLECIMIENTO_COLUMNS = [
+    "uni_codigo", "uni_nombre", "tipo_establecemiento", "mail",
+    "prv_codigo", "prv_descripcion", "can_codigo", "can_descripcion", "par_codigo", "par_descripcion",
+]
+
+_DIAS_SEMANA = "['DOMINGO', 'LUNES', 'MARTES', 'MIÉRCOLES', 'JUEVES', 'VIERNES', 'SÁBADO']"
+
+
+def _projection(con: duckdb.DuckDBPyConnection, relation: str, columns: list[str]) -> str:
+    # proyección con nombres en minúsculas, las columnas que la relación no trae quedan en NULL
+    available = {row[0].lower(): row[0] for row in con.execute(f"DESCRIBE {relation}").fetchall()}
+    return ", ".join(f'"{available[col]}" AS {col}' if col in available else f"NULL AS {col}" for col in columns)
+
+
+def _add_members(con: duckdb.DuckDBPyConnection, dimension: str, natural_keys: list[str], members: str) -> int:
+    """
+    Agrega a la dimensión los miembros de members (una fila por llave natural) que aún no existen. Las llaves
+    subrogadas se asignan en bloque a continuación del máximo id actual, ordenadas por la llave natural.
+    """
+    keys = ", ".join(natural_keys)
+    match = " AND ".join(f"d.{key} IS NOT DISTINCT FROM n.{key}" for key in natural_keys)
+    before = con.execute(f"SELECT COUNT(*) FROM {dimension}").fetchone()[0]
+    con.execute(f"""
+        INSERT INTO {dimension} BY NAME
+        SELECT (SELECT coalesce(max(id), 0) FROM {dimension}) + row_number() OVER (ORDER BY {keys}) AS id, n.*
+        FROM ({members}) n
+        WHERE NOT EXISTS (SELECT 1 FROM {dimension} d WHERE {match})
+        """)
+    added = con.execute(f"SELECT COUNT(*) FROM {dimension}").fetchone()[0] - before
+    logging.info(f" |- {dimension}: {added:,} miembros nuevos, {before + added:,} en total")
+    return added
+
+
+def _load_star(con: duckdb.DuckDBPyConnection, hechos, establecimientos) -> dict:
+    """
+    Carga el modelo estrella en una transacción del escritor del lago: dimensiones y hechos se resuelven con
+    INSERT ... SELECT y hash joins dentro de DuckDB
+    """
+    con.register('hechos_df', hechos)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE tmp_hechos AS
+        SELECT * REPLACE (coalesce(fecha_aplicacion_final, fecha_aplicacion) AS fecha_aplicacion)
+        FROM (SELECT {_projection(con, 'hechos_df', HECHOS_COLUMNS)} FROM hechos_df)
+        """)
+    con.unregister('hechos_df')
+    logging.info(f" |- {con.execute('SELECT COUNT(*) FROM tmp_hechos').fetchone()[0]:,} registros procesados")
+    if establecimientos is not None:
+        con.register('establecimientos_df', establecimientos)
+        projection = _projection(con, 'establecimientos_df', ESTABLECIMIENTO_COLUMNS)
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE tmp_establecimientos AS
+            SELECT {projection} FROM establecimientos_df
+            QUALIFY row_number() OVER (PARTITION BY uni_codigo) = 1
+            """)
+        con.unregister('establecimientos_df')
+    else:
+        con.execute(f"""
+            CREATE OR REPLACE TEMP TABLE tmp_establecimientos AS
+            SELECT {', '.join(f'NULL::VARCHAR AS {col}' for col in ESTABLECIMIENTO_COLUMNS)} LIMIT 0
+            """)
+
+    stats = {}
+    # persona: los atributos del registro más reciente de cada identificación
+    stats["dim_persona"] = _add_members(con, "dim_persona", ["identificacion"], """
+        SELECT num_iden AS identificacion,
+               arg_max(tipo_iden, fecha_aplicacion) AS tipo_identificacion,
+               arg_max(nombres, fecha_aplicacion) AS nombres,
+               arg_max(apellidos, fecha_aplicacion) AS apellidos,
+               arg_max(fecha_nacimiento, fecha_aplicacion) AS fecha_nacimiento,
+               arg_max(nacionalidad, fecha_aplicacion) AS nacionalidad,
+               NULL AS pueblo,
+               arg_max(etnia, fecha_aplicacion) AS etnia,
+               arg_max(sexo, fecha_aplicacion) AS sexo
+        FROM tmp_hechos WHERE num_iden IS NOT NULL
+        GROUP BY num_iden
+        """)
+    stats["dim_vacuna"] = _add_members(con, "dim_vacuna", ["nombre", "lote"], """
+        SELECT DISTINCT nombre_vacuna AS nombre, lote_vacuna AS lote FROM tmp_hechos
+        """)
+    stats["dim_tiempo"] = _add_members(con, "dim_tiempo", ["fecha"], f"""
+        SELECT fecha, day(fecha) AS dia, month(fecha) AS mes, year(fecha) AS anio, quarter(fecha) AS trimestre,
+               CASE WHEN month(fecha) <= 6 THEN 1 ELSE 2 END AS semestre,
+               {_DIAS_SEMANA}[dayofweek(fecha) + 1] AS dia_semana, dayofweek(fecha) IN (0, 6) AS es_fin_de_semana
+        FROM (SELECT DISTINCT CAST(fecha_aplicacion AS DATE) AS fecha FROM tmp_hechos
+              WHERE fecha_aplicacion IS NOT NULL)
+        """)
+    stats["dim_profesional"] = _add_members(con, "dim_profesional", ["identificacion"], """
+        SELECT iden_profesional_aplica AS identificacion, any_value(profesional_aplica) AS nombres
+        FROM tmp_hechos WHERE iden_profesional_aplica IS NOT NULL GROUP BY iden_profesional_aplica
+        """)
+    stats["dim_establecimiento"] = _add_members(con, "dim_establecimiento", ["uni_codigo"], """
+        SELECT u.unicodigo AS uni_codigo, NULL AS pais, e.uni_nombre, e.tipo_establecemiento AS uni_tipo,
+               e.mail AS correo
+        FROM (SELECT DISTINCT unicodigo FROM tmp_hechos WHERE unicodigo IS NOT NULL) u
+        LEFT JOIN tmp_establecimientos e ON e.uni_codigo = u.unicodigo
+        """)
+    stats["dim_dpa_geografico"] = _add_members(
+        con, "dim_dpa_geografico", ["codigo_provincia", "codigo_canton", "codigo_parroquia"], """
+        SELECT DISTINCT e.prv_codigo AS codigo_provincia, e.prv_descripcion AS provincia,
+               e.can_codigo AS codigo_canton, e.can_descripcion AS canton,
+               e.par_codigo AS codigo_parroquia, e.par_descripcion AS parroquia
+        FROM tmp_establecimientos e
+        WHERE e.par_codigo IS NOT NULL AND e.uni_codigo IN (SELECT unicodigo FROM tmp_hechos)
+        QUALIFY row_number() OVER (PARTITION BY e.prv_codigo, e.can_codigo, e.par_codigo) = 1
+        """)
+
+    # los hechos ya cargados se reconocen por el registro de origen; zona, circuito y distrito no llegan en los
+    # datos de establecimientos, dpa_administrativo_id queda en NULL
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE tmp_fact_nuevos AS
+        SELECT (SELECT coalesce(max(id), 0) FROM fact_vacunacion) + row_number() OVER () AS id,
+               h.id_vac_depu AS id_origen,
+               p.id AS persona_id,
+               v.id AS vacuna_id,
+               pr.id AS profesional_id,
+               es.id AS establecimiento_id,
+               NULL::INTEGER AS dpa_administrativo_id,
+               g.id AS dpa_geografico_id,
+               t.id AS tiempo_id,
+               CAST(h.fecha_aplicacion AS DATE) AS fecha_vacunacion,
+               h.punto_vacunacion AS centro_vacunacion,
+               h.dosis_aplicada,
+               h.grupo_etario
+        FROM tmp_hechos h
+        LEFT JOIN dim_persona p ON p.identificacion = h.num_iden
+        LEFT JOIN dim_vacuna v ON v.nombre IS NOT DISTINCT FROM h.nombre_vacuna
+                              AND v.lote IS NOT DISTINCT FROM h.lote_vacuna
+        LEFT JOIN dim_profesional pr ON pr.identificacion = h.iden_profesional_aplica
+        LEFT JOIN dim_establecimiento es ON es.uni_codigo = h.unicodigo
+        LEFT JOIN tmp_establecimientos e ON e.uni_codigo = h.unicodigo
+        LEFT JOIN dim_dpa_geografico g ON g.codigo_provincia = e.prv_codigo AND g.codigo_canton = e.can_codigo
+                                      AND g.codigo_parroquia = e.par_codigo
+        LEFT JOIN dim_tiempo t ON t.fecha = CAST(h.fecha_aplicacion AS DATE)
+        WHERE NOT EXISTS (SELECT 1 FROM fact_vacunacion f WHERE f.id_origen = h.id_vac_depu)
+        """)
+    con.execute("INSERT INTO fact_vacunacion BY NAME SELECT * FROM tmp_fact_nuevos")
+    stats["fact_vacunacion"] = con.execute("SELECT COUNT(*) FROM tmp_fact_nuevos").fetchone()[0]
+    logging.info(f" |- fact_vacunacion: {stats['fact_vacunacion']:,} hechos nuevos")
+    # los rollups registrados se actualizan con los hechos nuevos en esta misma transacción
+    run_write_hooks(con, BI_DB, "fact_vacunacion", "tmp_fact_nuevos")
+    con.execute("DROP TABLE tmp_fact_nuevos")
+    con.execute("DROP TABLE tmp_hechos")
+    con.execute("DROP TABLE tmp_establecimientos")
+    return stats
+
+
+def _load_establecimientos() -> Optional[pl.DataFrame]:
+    with lake_reader('vacunacion') as con:
+        exists = con.execute("SELECT COUNT(*) FROM information_schema.tables WHERE table_name = 'lk_establecimiento'"
+                             ).fetchone()[0]
+        if not exists:
+            logging.warning(" |- lk_establecimiento no existe, los establecimientos quedan sin atributos")
+            return None
+        return con.execute("SELECT * FROM lk_establecimiento").pl()
+
+
+def load_bi_model(df: Union[pl.DataFrame, pa.RecordBatchReader],
+                  establecimientos: Optional[pl.DataFrame] = None) -> dict:
+    """
+    Carga el modelo estrella desde los datos procesados (una fila por id_vac_depu como en el lago, un DataFrame
+    o un RecordBatchReader que se consume por lotes): agrega los miembros nuevos de cada dimensión y los hechos
+    de los registros de vacunación que aún no están en fact_vacunacion.
+    Los establecimientos salen de lk_establecimiento si no se pasan. Una nueva ejecución solo agrega lo nuevo.
+    Retorna los miembros y hechos agregados por tabla.
+    """
+    logging.info("|- Cargando modelo BI")
+    start_time = time.time()
+    if establecimientos is None:
+        establecimientos = _load_establecimientos()
+    hechos = df.to_arrow() if isinstance(df, pl.DataFrame) else df
+    stats = lake_write(BI_DB, _load_star, hechos, None if establecimientos is None else establecimientos.to_arrow())
+    logging.info(f" |- Modelo BI cargado en {time.time() - start_time:.2f} segundos")
+    return stats
+
+
+def load_bi_model_from_lake(since: Optional[str] = None, until: Optional[str] = None, db: str = 'vacunacion',
+                            table: str = PROCESSED_TABLE) -> dict:
+    """
+    Carga el modelo estrella desde la tabla procesada del lago (la que escribe main_process.py), opcionalmente
+    solo las aplicaciones en [since, until). Solo se leen las columnas del modelo y pasan por lotes de un
+    archivo del lago al otro, sin volver a procesar ni tener los datos completos en memoria.
+    """
+    with lake_reader(db) as con:
+        available = {row[0].lower() for row in con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = ?", [table]).fetchall()}
+    if not available:
+        raise ValueError(f"{table} no existe en {db}, ejecute main_process.py antes de cargar el modelo BI")
+    columns = [col for col in HECHOS_COLUMNS if col in available]
+    return load_bi_model(read_data(db, table, columns, 'fecha_aplicacion', since, until))
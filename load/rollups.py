@@ -0,0 +1,186 @@
+import logging
+import time
+from datetime import date
+from typing import Any, Optional
+
+import duckdb
+import polars as pl
+
+from lake.session import lake_reader, lake_write, register_write_hook
+from load.bi_model import BI_DB
+
+# expresión de cada dimensión de los rollups sobre el modelo estrella
+STAR_DIMENSIONS = {
+    "provincia": "g.provincia",
+    "vacuna": "v.nombre",
+    "dosis": "f.dosis_aplicada",
+    "grupo_etario": "f.grupo_etario",
+}
+
+STAR_RELATION = """
+    fact_vacunacion f
+    LEFT JOIN dim_dpa_geografico g ON g.id = f.dpa_geografico_id
+    LEFT JOIN dim_vacuna v ON v.id = f.vacuna_id
+    """
+
+# rollups de la más fina a la más gruesa. grano 'dia' (columna fecha) o 'mes' (columnas anio, mes); source es el
+# rollup del que se deriva, sin source se calcula desde el modelo estrella. La medida es aplicaciones.
+ROLLUPS = {
+    "rp_vacunacion_dia": {
+        "grain": "dia", "dimensions": ["provincia", "vacuna", "dosis", "grupo_etario"], "source": None,
+    },
+    "rp_vacunacion_mes": {
+        "grain": "mes", "dimensions": ["provincia", "vacuna", "dosis", "grupo_etario"], "source": "rp_vacunacion_dia",
+    },
+    "rp_vacunacion_mes_provincia": {
+        "grain": "mes", "dimensions": ["provincia"], "source": "rp_vacunacion_mes",
+    },
+}
+
+
+def _rollup_query(name: str, days: Optional[str] = None) -> str:
+    """
+    Consulta que calcula el rollup completo o, con days (relación con una columna fecha), solo los días o meses
+    que tocan esas fechas. Los hechos sin fecha no entran en los rollups.
+    """
+    rollup = ROLLUPS[name]
+    dimensions = rollup["dimensions"]
+    if rollup["source"] is None:
+        select = ", ".join(f"{STAR_DIMENSIONS[dim]} AS {dim}" for dim in dimensions)
+        where = "f.fecha_vacunacion IS NOT NULL"
+        if days is not None:
+            where += f" AND f.fecha_vacunacion IN (SELECT fecha FROM {days})"
+        return f"""
+            SELECT f.fecha_vacunacion AS fecha, {select}, COUNT(*) AS aplicaciones
+            FROM {STAR_RELATION}
+            WHERE {where}
+            GROUP BY ALL
+            """
+    source = ROLLUPS[rollup["source"]]
+    period = ("year(fecha) AS anio, month(fecha) AS mes" if source["grain"] == "dia" else "anio, mes")
+    where = "true"
+    if days is not None:
+        months = f"SELECT DISTINCT year(fecha), month(fecha) FROM {days}"
+        where = (f"(year(fecha), month(fecha)) IN ({months})" if source["grain"] == "dia"
+                 else f"(anio, mes) IN ({months})")
+    return f"""
+        SELECT {period}, {', '.join(dimensions)}, CAST(SUM(aplicaciones) AS BIGINT) AS aplicaciones
+        FROM {rollup['source']}
+        WHERE {where}
+        GROUP BY ALL
+        """
+
+
+def _period_filter(name: str, days: str) -> str:
+    if ROLLUPS[name]["grain"] == "dia":
+        return f"fecha IN (SELECT fecha FROM {days})"
+    return f"(anio, mes) IN (SELECT DISTINCT year(fecha), month(fecha) FROM {days})"
+
+
+def _refresh_rollups(con: duckdb.DuckDBPyConnection, changes: str, mode: str,
+                     partition: Optional[tuple[str, str, str]]):
+    """
+    Hook de escritura de fact_vacunacion: recalcula en cada rollup solo los días (o meses) de los hechos nuevos
+    """
+    start_time = time.time()
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE tmp_rollup_dias AS
+        SELECT DISTINCT fecha_vacunacion AS fecha FROM {changes} WHERE fecha_vacunacion IS NOT NULL
+        """)
+    days = con.execute("SELECT COUNT(*) FROM tmp_rollup_dias").fetchone()[0]
+    if days:
+        for name in ROLLUPS:
+            con.execute(f"DELETE FROM {name} WHERE {_period_filter(name, 'tmp_rollup_dias')}")
+            con.execute(f"INSERT INTO {name} BY NAME {_rollup_query(name, 'tmp_rollup_dias')}")
+        logging.info(f" |- Rollups actualizados para {days:,} días en {time.time() - start_time:.2f} segundos")
+    con.execute("DROP TABLE tmp_rollup_dias")
+
+
+def _create_rollups(con: duckdb.DuckDBPyConnection):
+    existing = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    for name in ROLLUPS:
+        if name not in existing:
+            logging.info(f" |- Construyendo {name}")
+            con.execute(f"CREATE TABLE {name} AS {_rollup_query(name)}")
+
+
+def create_rollups():
+    """
+    Crea los rollups que no existen a partir del modelo estrella y registra su actualización incremental: cada
+    escritura de fact_vacunacion por el escritor del lago recalcula los días afectados en la misma transacción
+    """
+    logging.info("|- Preparando rollups del modelo BI")
+    lake_write(BI_DB, _create_rollups)
+    register_write_hook(BI_DB, "fact_vacunacion", _refresh_rollups)
+
+
+def _parse_date(value) -> Optional[date]:
+    return None if value is None else date.fromisoformat(str(value)[:10])
+
+
+def _fits(name: str, needed: set[str], by_day: bool, since: Optional[date], until: Optional[date]) -> bool:
+    rollup = ROLLUPS[name]
+    if not needed <= set(rollup["dimensions"]):
+        return False
+    if rollup["grain"] == "mes":
+        # un rollup mensual solo responde rangos de meses completos
+        return not by_day and all(value is None or value.day == 1 for value in (since, until))
+    return True
+
+
+def query_rollup(group_by: list[str], filters: Optional[dict[str, Any]] = None, since: Optional[str] = None,
+                 until: Optional[str] = None) -> pl.DataFrame:
+    """
+    Aplicaciones agrupadas por group_by (fecha, anio, mes y las dimensiones de los rollups), con filtros por
+    igualdad o lista y rango de fechas semiabierto [since, until). Responde desde el rollup más grueso que
+    cubre la consulta y, si ninguno la cubre, desde el modelo estrella.
+    """
+    filters = filters or {}
+    since, until = _parse_date(since), _parse_date(until)
+    needed = (set(group_by) | set(filters)) - {"fecha", "anio", "mes"}
+    by_day = "fecha" in group_by
+    name = next((name for name in reversed(ROLLUPS) if _fits(name, needed, by_day, since, until)), None)
+
+    if name is None:
+        relation = f"""(
+            SELECT f.fecha_vacunacion AS fecha, year(f.fecha_vacunacion) AS anio, month(f.fecha_vacunacion) AS mes,
+                   {', '.join(f'{expression} AS {dim}' for dim, expression in STAR_DIMENSIONS.items())},
+                   1 AS aplicaciones
+            FROM {STAR_RELATION})"""
+        period = {"fecha": "fecha", "anio": "anio", "mes": "mes"}
+        date_column = "fecha"
+    elif ROLLUPS[name]["grain"] == "dia":
+        relation = name
+        period = {"fecha": "fecha", "anio": "year(fecha)", "mes": "month(fecha)"}
+        date_column = "fecha"
+    else:
+        relation = name
+        period = {"anio": "anio", "mes": "mes"}
+        date_column = "make_date(anio, mes, 1)"
+
+    columns = [f"{period[col]} AS {col}" if col in period else col for col in group_by]
+    conditions, params = [], {}
+    if since is not None:
+        conditions.append(f"{date_column} >= $since")
+        params["since"] = since
+    if until is not None:
+        conditions.append(f"{date_column} < $until")
+        params["until"] = until
+    for position, (column, value) in enumerate(filters.items()):
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f"{column} IN (SELECT UNNEST($filtro_{position}))")
+            params[f"filtro_{position}"] = list(value)
+        else:
+            conditions.append(f"{column} = $filtro_{position}")
+            params[f"filtro_{position}"] = value
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    select = ", ".join(columns + ["CAST(SUM(aplicaciones) AS BIGINT) AS aplicaciones"])
+    group = f"GROUP BY {', '.join(str(position + 1) for position in range(len(columns)))}" if columns else ""
+    order = f"ORDER BY {', '.join(str(position + 1) for position in range(len(columns)))}" if columns else ""
+
+    start_time = time.time()
+    with lake_reader(BI_DB) as con:
+        df = con.execute(f"SELECT {select} FROM {relation} {where} {group} {order}", params).pl()
+    logging.debug(f" |- Consulta respondida desde {name or 'fact_vacunacion'} en {time.time() - start_time:.3f} "
+                  f"segundos")
+    return df
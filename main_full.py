@@ -4,6 +4,7 @@ from datetime import datetime
 
 from dotenv import load_dotenv
 
+from extract.config.sources import FETCH_ARRAY_SIZE, FETCH_MODE, LOOKBACK_DAYS
 from extract.ingest_orchester import ingest_orchester
 from lake.init_lake import add_new_elements_to_lake
 from load.profilers.persona_profiler import profiler_orchester
@@ -41,8 +42,28 @@ def parse_arguments():
     parser.add_argument(
         '--until', 
         type=str, 
-        default='2022-01-01',
-        help='Fecha de fin para la extracción de datos (formato: YYYY-MM-DD)'
+        default=None,
+        help='Fecha de fin para la extracción de datos (formato: YYYY-MM-DD), por defecto 2022-01-01 '
+             'o la fecha actual en modo incremental'
+    )
+    
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Extraer solo los registros posteriores al watermark de cada fuente registrado en el lago'
+    )
+    
+    parser.add_argument(
+        '--lookback-days',
+        type=int,
+        default=LOOKBACK_DAYS,
+        help='Días que se vuelven a leer antes del watermark para registros que llegan tarde'
+    )
+    
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Retomar la última ejecución interrumpida, omitiendo las particiones y chunks ya completados'
     )
     
     parser.add_argument(
@@ -59,6 +80,21 @@ def parse_arguments():
         help='Número máximo de workers para procesamiento paralelo (default: 4)'
     )
     
+    parser.add_argument(
+        '--fetch-mode',
+        type=str,
+        choices=['dataframe', 'arrow'],
+        default=FETCH_MODE,
+        help='Modo de lectura de la fuente: dataframe (polars.read_database) o arrow (record batches en streaming)'
+    )
+    
+    parser.add_argument(
+        '--fetch-array-size',
+        type=int,
+        default=FETCH_ARRAY_SIZE,
+        help='Filas por record batch al leer la fuente en modo arrow'
+    )
+    
     parser.add_argument(
         '--no-cache',
         action='store_true',
@@ -74,18 +110,24 @@ def main():
     
     # Parsear argumentos
     args = parse_arguments()
+    if args.until is None:
+        args.until = datetime.now().strftime('%Y-%m-%d') if args.incremental else '2022-01-01'
     
     logging.info(f"Iniciando procesamiento con parámetros:")
     logging.info(f"  - since: {args.since}")
     logging.info(f"  - until: {args.until}")
     logging.info(f"  - chunk_size: {args.chunk_size:,}")
     logging.info(f"  - max_workers: {args.max_workers}")
+    logging.info(f"  - fetch_mode: {args.fetch_mode} (array size {args.fetch_array_size:,})")
+    logging.info(f"  - incremental: {args.incremental} (lookback {args.lookback_days} días)")
+    logging.info(f"  - resume: {args.resume}")
     logging.info(f"  - cache habilitado: {not args.no_cache}")
     
     try:
         # Ejecutar ingesta de datos con parámetros optimizados
         logging.info("Iniciando ingesta de datos")
-        ingest_orchester(args.since, args.until, args.chunk_size)
+        ingest_orchester(args.since, args.until, args.chunk_size, args.max_workers, args.fetch_mode,
+                         args.fetch_array_size, args.incremental, args.lookback_days, args.resume)
         
         # Ejecutar procesamiento
         logging.info("Iniciando procesamiento de datos")
@@ -1,3 +1,31 @@
-from lake.init_lake import generare_bi_echema
+import argparse
+import logging
 
-generare_bi_echema()
+from dotenv import load_dotenv
+
+from lake.init_lake import generate_bi_schema
+from load.bi_model import load_bi_model_from_lake
+from load.rollups import create_rollups
+
+load_dotenv(override=True)
+
+
+def parse_arguments():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Carga del modelo BI desde los datos procesados del lago (main_process.py)",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--since', type=str, default=None,
+                        help='Procesar solo las aplicaciones desde esta fecha (formato: YYYY-MM-DD)')
+    parser.add_argument('--until', type=str, default=None,
+                        help='Procesar solo las aplicaciones antes de esta fecha (formato: YYYY-MM-DD)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+    generate_bi_schema()
+    create_rollups()
+    load_bi_model_from_lake(args.since, args.until)
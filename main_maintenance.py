@@ -0,0 +1,26 @@
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from lake.maintenance import maintain_lake
+
+load_dotenv(override=True)
+
+
+def parse_arguments():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Mantenimiento del lago: compactación, orden físico y estadísticas de almacenamiento",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--db', type=str, action='append', default=None,
+                        help='Archivo del lago a mantener (sin .duckdb), se puede repetir; por defecto todos')
+    parser.add_argument('--stats-only', action='store_true', help='Solo reportar estadísticas, sin compactar')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+    maintain_lake(args.db, compact=not args.stats_only)
@@ -0,0 +1,52 @@
+import argparse
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+from process.clean_transform.dim_persona import ESTRATEGIAS_IMPUTACION, IMPUTACION_FECHA_APLICACION
+from process.clean_transform_orchester import PROCESSED_TABLE, explain_process, sink_process
+from process.partition_runner import PROCESS_WORKER_MEMORY_MB, PROCESS_WORKERS, run_partitions
+
+load_dotenv(override=True)
+
+
+def parse_arguments():
+    """Parsear argumentos de línea de comandos"""
+    parser = argparse.ArgumentParser(
+        description="Procesamiento en streaming de lk_vacunacion_covid hacia el lago",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--since', type=str, default=None,
+                        help='Procesar solo las aplicaciones desde esta fecha (formato: YYYY-MM-DD)')
+    parser.add_argument('--until', type=str, default=None,
+                        help='Procesar solo las aplicaciones antes de esta fecha (formato: YYYY-MM-DD)')
+    parser.add_argument('--table', type=str, default=PROCESSED_TABLE, help='Tabla del lago para los datos procesados')
+    parser.add_argument('--imputacion', type=str, default=','.join(IMPUTACION_FECHA_APLICACION),
+                        help=f"Estrategias para imputar la fecha de aplicación 1900-01-01, separadas por coma y en "
+                             f"orden de prioridad ({', '.join(ESTRATEGIAS_IMPUTACION)})")
+    parser.add_argument('--explain', action='store_true', help='Solo mostrar el plan optimizado, sin ejecutarlo')
+    parser.add_argument('--partitioned', action='store_true',
+                        help='Procesar por meses de fecha_aplicacion en un pool de procesos')
+    parser.add_argument('--workers', type=int, default=PROCESS_WORKERS, help='Procesos del pool con --partitioned')
+    parser.add_argument('--memory-mb', type=int, default=PROCESS_WORKER_MEMORY_MB,
+                        help='Memoria por worker con --partitioned, los meses más grandes se dividen en cubetas')
+    parser.add_argument('--month', type=str, action='append', default=None,
+                        help='Reprocesar solo este mes (formato: YYYY-MM) con --partitioned, se puede repetir')
+    parser.add_argument('--resume', action='store_true',
+                        help='Reprocesar las particiones pendientes o fallidas de la última ejecución')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    args = parse_arguments()
+    estrategias = args.imputacion.split(',')
+    if args.explain:
+        print(explain_process(args.since, args.until, estrategias))
+    elif args.partitioned or args.month or args.resume:
+        stats = run_partitions(args.since, args.until, args.month, args.resume, args.workers, args.memory_mb,
+                               table=args.table, estrategias=estrategias)
+        sys.exit(1 if stats['failed'] else 0)
+    else:
+        sink_process(args.since, args.until, table=args.table, estrategias=estrategias)
@@ -1,28 +1,29 @@
 
 import logging
+import os
+from datetime import date
+from typing import Optional, Union
 
 import polars as pl
 
 from process.clean_transform.dim_establecimiento import limpiar_columnas_geograficas
+from utils.clean.identification_transform import cedula_valida
 
 # Define qué funciones son públicas
 __all__ = [
+    'conteo_imputacion',
+    'fechas_imputadas',
+    'imputar_fecha_aplicacion',
     'persona_orchester',
 ]
 
-def _limpiar_columnas_texto(df: pl.DataFrame, cols: list[str] = []):
+def _limpiar_columnas_texto(df: pl.LazyFrame, cols: list[str] = []):
     logging.info("|- EST Limpiando columnas de texto")
-    for col in cols:
-        
-        logging.debug(f" |- Limpiando columna {col} caracteres especiales")
-        df = df.with_columns(pl.col(col).str.strip_chars().alias(col))
+    logging.debug(f" |- Limpiando columnas {', '.join(cols)}: caracteres especiales y mayúsculas")
+    return df.with_columns([pl.col(col).str.strip_chars().str.to_uppercase().alias(col) for col in cols])
 
-        logging.debug(f" |- Limpiando columna {col} mayusculas")
-        df = df.with_columns(pl.col(col).str.to_uppercase().alias(col))
-    return df
 
-
-def _limpiar_columnas_fecha(df: pl.DataFrame, cols: list[str] = []):
+def _limpiar_columnas_fecha(df: pl.LazyFrame, cols: list[str] = []):
     logging.info("|- EST Estandarizando columnas fecha")
     for col in cols:
         logging.debug(f" |- Estandarizando columna {col}")
@@ -30,26 +31,7 @@ def _limpiar_columnas_fecha(df: pl.DataFrame, cols: list[str] = []):
     return df
 
 
-def _es_cedula_valida(cedula: str) -> bool:    
-    # Implementación de la validación de cédula
-    if not cedula or len(cedula) != 10 or not cedula.isdigit():
-        return False
-
-    coeficientes = [2, 1, 2, 1, 2, 1, 2, 1, 2]
-    total = 0
-
-    for i in range(9):
-        val = int(cedula[i]) * coeficientes[i]
-        if val >= 10:
-            val -= 9
-        total += val
-
-    digito_verificador = 10 - (total % 10) if (total % 10) != 0 else 0
-
-    return digito_verificador == int(cedula[9])
-
-
-def _limpiar_identificacion(df: pl.DataFrame):
+def _limpiar_identificacion(df: pl.LazyFrame):
     logging.info("|- LIM Limpiando columnas identificación")
     
     ## Eliminar registros sin cédula
@@ -68,182 +50,222 @@ def _limpiar_identificacion(df: pl.DataFrame):
 )
     
     ## valida si las cédulas cumple con el digito verfificador crear una columna nueva
+    ## num_iden se convierte a entero una sola vez en una columna temporal, cada dígito la reutiliza
     logging.debug(f" |- Identificando cédulas válidas e inválidas")
     df = df.with_columns(
+        pl.col("num_iden").str.to_integer(strict=False).alias("_num_iden_entero")
+    ).with_columns(
         pl.when(pl.col("tipo_iden") == "CÉDULA DE IDENTIDAD")
-            .then(pl.col("num_iden").map_elements(_es_cedula_valida, return_dtype=pl.Boolean))
+            .then(cedula_valida("num_iden", pl.col("_num_iden_entero")))
             .otherwise(None)
             .alias("cedula_es_valida")
-    )
+    ).drop("_num_iden_entero")
     
     return df
 
 
-def _calcular_diferencia_fechas(fecha_nacimiento, fecha_aplicacion):
+def _edad_exacta(fecha_nacimiento: pl.Expr, fecha_referencia: pl.Expr) -> tuple[pl.Expr, pl.Expr, pl.Expr]:
     """
-    Calcula la diferencia exacta entre dos fechas en años, meses y días
+    Edad exacta en años, meses y días a partir de las partes de las fechas. Si el día de la referencia es menor
+    al de nacimiento se toma un mes y se suman los días del mes anterior a la referencia (28, 29, 30 o 31 según
+    el mes y el año bisiesto); si los meses quedan negativos se toma un año. Nulos si alguna fecha es nula.
     """
-    from datetime import date
-    
-    if fecha_nacimiento is None or fecha_aplicacion is None:
-        return None, None, None
-    
-    # Convertir a objetos date si no lo son ya
-    if not isinstance(fecha_nacimiento, date):
-        return None, None, None
-    if not isinstance(fecha_aplicacion, date):
-        return None, None, None
-    
-    # Calcular años
-    años = fecha_aplicacion.year - fecha_nacimiento.year
-    
-    # Calcular meses
-    meses = fecha_aplicacion.month - fecha_nacimiento.month
-    
-    # Calcular días
-    dias = fecha_aplicacion.day - fecha_nacimiento.day
-    
-    # Ajustar si los días son negativos
-    if dias < 0:
-        meses -= 1
-        # Obtener el número de días del mes anterior
-        if fecha_aplicacion.month == 1:
-            mes_anterior = 12
-            año_anterior = fecha_aplicacion.year - 1
-        else:
-            mes_anterior = fecha_aplicacion.month - 1
-            año_anterior = fecha_aplicacion.year
-        
-        # Días del mes anterior
-        if mes_anterior in [1, 3, 5, 7, 8, 10, 12]:
-            dias_mes_anterior = 31
-        elif mes_anterior in [4, 6, 9, 11]:
-            dias_mes_anterior = 30
-        else:  # febrero
-            if (año_anterior % 4 == 0 and año_anterior % 100 != 0) or (año_anterior % 400 == 0):
-                dias_mes_anterior = 29
-            else:
-                dias_mes_anterior = 28
-        
-        dias += dias_mes_anterior
-    
-    # Ajustar si los meses son negativos
-    if meses < 0:
-        años -= 1
-        meses += 12
-    
-    return años, meses, dias
+    anios = fecha_referencia.dt.year() - fecha_nacimiento.dt.year()
+    meses = fecha_referencia.dt.month().cast(pl.Int32) - fecha_nacimiento.dt.month().cast(pl.Int32)
+    dias = fecha_referencia.dt.day().cast(pl.Int32) - fecha_nacimiento.dt.day().cast(pl.Int32)
 
-def _calcular_edad(df: pl.DataFrame):
-    logging.info("|- ENR Agregando edad, descomponiendo en años, meses y días")
-    
-    # Calcular diferencia total en días para referencia
-    df = df.with_columns(
-        (pl.col("fecha_aplicacion") - pl.col("fecha_nacimiento")).dt.total_days().alias("edad_total_dias")
-    )
-    
-    # Aplicar la función de cálculo de edad exacta
-    logging.debug(" |- Calculando edad exacta en años, meses y días")
-    
-    df = df.with_columns([
-        pl.struct(["fecha_nacimiento", "fecha_aplicacion"])
-        .map_elements(
-            lambda x: _calcular_diferencia_fechas(x["fecha_nacimiento"], x["fecha_aplicacion"])[0] if x["fecha_nacimiento"] is not None and x["fecha_aplicacion"] is not None else None,
-            return_dtype=pl.Int32
-        ).alias("edad_anios"),
-        
-        pl.struct(["fecha_nacimiento", "fecha_aplicacion"])
-        .map_elements(
-            lambda x: _calcular_diferencia_fechas(x["fecha_nacimiento"], x["fecha_aplicacion"])[1] if x["fecha_nacimiento"] is not None and x["fecha_aplicacion"] is not None else None,
-            return_dtype=pl.Int32
-        ).alias("edad_meses"),
-        
-        pl.struct(["fecha_nacimiento", "fecha_aplicacion"])
-        .map_elements(
-            lambda x: _calcular_diferencia_fechas(x["fecha_nacimiento"], x["fecha_aplicacion"])[2] if x["fecha_nacimiento"] is not None and x["fecha_aplicacion"] is not None else None,
-            return_dtype=pl.Int32
-        ).alias("edad_dias")
-    ])
-    logging.debug(" |- Cálculo de edad completado")
-    return df
+    # el último día del mes anterior a la referencia es su cantidad de días
+    dias_mes_anterior = fecha_referencia.dt.month_start().dt.offset_by("-1d").dt.day().cast(pl.Int32)
+    toma_mes = dias < 0
+    dias = pl.when(toma_mes).then(dias + dias_mes_anterior).otherwise(dias)
+    meses = meses - toma_mes.cast(pl.Int32)
 
+    toma_anio = meses < 0
+    meses = pl.when(toma_anio).then(meses + 12).otherwise(meses)
+    anios = anios - toma_anio.cast(pl.Int32)
+    return anios.cast(pl.Int32), meses.cast(pl.Int32), dias.cast(pl.Int32)
 
-def _calcular_grupo_etario(df: pl.DataFrame):
+
+def _grupo_etario(edad_anios: pl.Expr) -> pl.Expr:
     """
-    Agrega la columna GRUPO_ETARIO basada en la edad en años
+    Grupo etario según la edad en años
     Clasificación estándar epidemiológica por grupos quinquenales
     """
-    logging.info("|- ENR Agregando grupo etario")
-    
-    # Verificar que la columna EDAD_ANIOS existe
-    if "edad_anios" not in df.columns:
-        logging.error(" |- Error: La columna EDAD_ANIOS no existe en el DataFrame")
-        return df
-    
-    logging.debug(" |- Calculando grupos etarios basados en EDAD_ANIOS")
-    
-    df = df.with_columns(
-        pl.when(pl.col("edad_anios").is_null())
+    return (
+        pl.when(edad_anios.is_null())
         .then(pl.lit("NO DEFINIDO"))
-        .when(pl.col("edad_anios") < 1)
+        .when(edad_anios < 1)
         .then(pl.lit("MENOR DE 1 AÑO"))
-        .when(pl.col("edad_anios").is_between(1, 4, closed="both"))
+        .when(edad_anios.is_between(1, 4, closed="both"))
         .then(pl.lit("DE 1 A 4 AÑOS"))
-        .when(pl.col("edad_anios").is_between(5, 9, closed="both"))
+        .when(edad_anios.is_between(5, 9, closed="both"))
         .then(pl.lit("DE 5 A 9 AÑOS"))
-        .when(pl.col("edad_anios").is_between(10, 14, closed="both"))
+        .when(edad_anios.is_between(10, 14, closed="both"))
         .then(pl.lit("DE 10 A 14 AÑOS"))
-        .when(pl.col("edad_anios").is_between(15, 19, closed="both"))
+        .when(edad_anios.is_between(15, 19, closed="both"))
         .then(pl.lit("DE 15 A 19 AÑOS"))
-        .when(pl.col("edad_anios").is_between(20, 64, closed="both"))
+        .when(edad_anios.is_between(20, 64, closed="both"))
         .then(pl.lit("DE 20 A 64 AÑOS"))
-        .when(pl.col("edad_anios") >= 65)
+        .when(edad_anios >= 65)
         .then(pl.lit("DE 65 AÑOS Y MÁS"))
         .otherwise(pl.lit("NO DEFINIDO"))
-        .alias("grupo_etario")
     )
-    
 
-    
-    logging.debug(" |- Grupos etarios calculados correctamente")
+
+def _calcular_edad(df: pl.LazyFrame, fecha_referencia: Optional[date] = None):
+    """
+    Agrega edad_total_dias, edad_anios, edad_meses, edad_dias y grupo_etario en una sola proyección. La edad se
+    calcula a la fecha de aplicación o, con fecha_referencia, a esa fecha (por ejemplo el corte de una campaña).
+    """
+    logging.info("|- ENR Agregando edad, descomponiendo en años, meses y días, y grupo etario")
+    referencia = pl.col("fecha_aplicacion") if fecha_referencia is None else pl.lit(fecha_referencia)
+    anios, meses, dias = _edad_exacta(pl.col("fecha_nacimiento"), referencia)
+
+    # las partes de las fechas y la edad en años se calculan una vez para todas las columnas
+    df = df.with_columns(
+        (referencia - pl.col("fecha_nacimiento")).dt.total_days().alias("edad_total_dias"),
+        anios.alias("edad_anios"),
+        meses.alias("edad_meses"),
+        dias.alias("edad_dias"),
+        _grupo_etario(anios).alias("grupo_etario"),
+    )
+    logging.debug(" |- Cálculo de edad completado")
     return df
 
-def _crear_dataframe_con_moda_fecha(df: pl.DataFrame) -> pl.DataFrame:
-    print(df.columns)
-    df_moda = (
-        df.filter(pl.col("fecha_aplicacion") != pl.date(1900, 1, 1))
-        .group_by("unicodigo", "nombre_vacuna")
-        .agg(pl.col("fecha_aplicacion").mode().first().alias("moda"))
+# fecha que la fuente usa cuando no se registró la fecha de aplicación
+FECHA_CENTINELA = date(1900, 1, 1)
+
+# estrategias para imputar la fecha centinela, en orden de prioridad; cada una completa las que la anterior no pudo
+#   moda     fecha más frecuente del establecimiento y la vacuna, en un empate la más antigua
+#   mediana  fecha mediana del establecimiento y la vacuna
+#   vecina   fecha de la dosis anterior de la misma persona o, si no la hay, de la siguiente
+ESTRATEGIAS_IMPUTACION = ["moda", "mediana", "vecina"]
+IMPUTACION_FECHA_APLICACION = os.getenv("IMPUTACION_FECHA_APLICACION", "moda").split(",")
+
+# orden de las dosis para buscar la vecina, las que no están aquí van al final
+_ORDEN_DOSIS = {"PRIMERA": 1, "UNICA": 1, "SEGUNDA": 2, "TERCERA": 3, "CUARTA": 4, "QUINTA": 5}
+
+_COLUMNAS_IMPUTACION = ["FECHA_APLICACION_FINAL", "imputacion_fecha_aplicacion"]
+
+
+def _clave(df: pl.LazyFrame, ids: list[str], columnas: list[str]) -> list[str]:
+    # con las columnas internadas se agrupa sobre sus ids enteros en lugar del texto
+    return ids if all(col in df.collect_schema().names() for col in ids) else columnas
+
+
+def _fecha_candidata(df: pl.LazyFrame, estrategia: str) -> pl.Expr:
+    fecha = pl.col("fecha_aplicacion")
+    valida = fecha.filter(fecha != FECHA_CENTINELA)
+    grupo = _clave(df, ["unicodigo_id", "nombre_vacuna_id"], ["unicodigo", "nombre_vacuna"])
+    if estrategia == "moda":
+        # la fecha trae hora, la moda se busca sobre el día
+        return valida.dt.truncate("1d").mode().min().over(grupo)
+    if estrategia == "mediana":
+        # la mediana de fechas puede caer entre dos días y de Date pasa a Datetime
+        return valida.median().dt.truncate("1d").cast(df.collect_schema()["fecha_aplicacion"]).over(grupo)
+    if estrategia == "vecina":
+        persona = _clave(df, ["num_iden_id"], ["num_iden"])
+        orden = pl.col("dosis_aplicada").str.strip_chars().str.to_uppercase().replace_strict(
+            _ORDEN_DOSIS, default=len(_ORDEN_DOSIS) + 1, return_dtype=pl.Int32)
+        conocida = pl.when(fecha != FECHA_CENTINELA).then(fecha)
+        return (
+            conocida.forward_fill().over(persona, order_by=[orden, pl.col("id_vac_depu")])
+            .fill_null(conocida.backward_fill().over(persona, order_by=[orden, pl.col("id_vac_depu")]))
+        )
+    raise ValueError(f"Estrategia de imputación desconocida: {estrategia}, opciones: {ESTRATEGIAS_IMPUTACION}")
+
+
+def imputar_fecha_aplicacion(df: pl.LazyFrame, estrategias: Optional[list[str]] = None) -> pl.LazyFrame:
+    """
+    Agrega FECHA_APLICACION_FINAL, con la fecha centinela 1900-01-01 reemplazada por la primera estrategia que
+    encuentra una fecha, e imputacion_fecha_aplicacion con el nombre de esa estrategia (nulo si la fecha no se
+    imputó). Cada estrategia es una expresión de ventana sobre df, una sola proyección sin joins.
+    """
+    estrategias = estrategias or IMPUTACION_FECHA_APLICACION
+    logging.info(f"|- ENR Imputando fechas de aplicación centinela: {', '.join(estrategias)}")
+    centinela = pl.col("fecha_aplicacion") == FECHA_CENTINELA
+    # cada ventana se evalúa una vez en una columna temporal, dentro de las cadenas when/then se repetiría
+    candidatas = [f"_fecha_{estrategia}" for estrategia in estrategias]
+    df = df.with_columns(_fecha_candidata(df, estrategia).alias(columna)
+                         for estrategia, columna in zip(estrategias, candidatas))
+
+    fecha_final = pl.when(~centinela).then(pl.col("fecha_aplicacion"))
+    imputacion = pl.when(~centinela).then(pl.lit(None, dtype=pl.String))
+    for estrategia, columna in zip(estrategias, candidatas):
+        fecha_final = fecha_final.when(pl.col(columna).is_not_null()).then(pl.col(columna))
+        imputacion = imputacion.when(pl.col(columna).is_not_null()).then(pl.lit(estrategia))
+    return df.with_columns(
+        fecha_final.alias("FECHA_APLICACION_FINAL"), imputacion.alias("imputacion_fecha_aplicacion")
+    ).drop(candidatas)
+
+
+def fechas_imputadas(df: pl.LazyFrame, estrategias: Optional[list[str]] = None) -> pl.LazyFrame:
+    """
+    Solo las filas con fecha centinela y su imputación (id_vac_depu y las columnas de imputar_fecha_aplicacion).
+    Procesando por particiones se calcula una vez sobre toda la tabla, donde están los grupos y las dosis de
+    cada persona, y se entrega a persona_orchester de cada partición.
+    """
+    columnas = ["id_vac_depu", "fecha_aplicacion", "dosis_aplicada", "unicodigo", "nombre_vacuna", "num_iden",
+                "unicodigo_id", "nombre_vacuna_id", "num_iden_id"]
+    df = df.select([col for col in columnas if col in df.collect_schema().names()])
+    return (
+        imputar_fecha_aplicacion(df, estrategias)
+        .filter(pl.col("fecha_aplicacion") == FECHA_CENTINELA)
+        .select(["id_vac_depu"] + _COLUMNAS_IMPUTACION)
     )
-    df_moda.write_csv("df_moda.csv")
 
-    df_unido = df.join(df_moda, on=["unicodigo", "nombre_vacuna"], how="left")
 
-    df_final = df_unido.with_columns(
-        pl.when(pl.col("fecha_aplicacion") == pl.date(1900, 1, 1))
-        .then(pl.col("moda"))
+def _aplicar_fechas_imputadas(df: pl.LazyFrame, imputadas: pl.LazyFrame) -> pl.LazyFrame:
+    # la partición solo trae parte de la tabla, las imputaciones precalculadas se unen por id (pocas filas)
+    df = df.join(imputadas, on="id_vac_depu", how="left")
+    return df.with_columns(
+        pl.when(pl.col("fecha_aplicacion") == FECHA_CENTINELA)
+        .then(pl.col("FECHA_APLICACION_FINAL"))
         .otherwise(pl.col("fecha_aplicacion"))
         .alias("FECHA_APLICACION_FINAL")
-    ).drop("moda")
-    
-    return df_final
+    )
+
 
-def _homologar_etnia(df: pl.DataFrame):
+def conteo_imputacion(df: Union[pl.DataFrame, pl.LazyFrame]) -> dict[str, int]:
+    """
+    Filas que completó cada estrategia y fechas centinela que ninguna pudo completar ('sin_imputar')
+    """
+    conteo = (
+        df.lazy()
+        .filter(pl.col("fecha_aplicacion") == FECHA_CENTINELA)
+        .group_by(pl.col("imputacion_fecha_aplicacion").fill_null("sin_imputar"))
+        .len()
+        .collect()
+    )
+    return dict(conteo.iter_rows())
+
+
+def _homologar_etnia(df: pl.LazyFrame):
     logging.info("|- ENR Homologando etnia")
     logging.debug(" |- Homologando etnia")
-    etnia_map = pl.read_csv("resources/homologations/per_etnia.csv")
+    etnia_map = pl.scan_csv("resources/homologations/per_etnia.csv")
     df = df.join(etnia_map, left_on="etnia", right_on="valor_original", suffix="_map")
     df = df.with_columns(pl.col("valor_homologado").alias("etnia_homologada"))
     df = df.drop("etnia", "valor_homologado") 
     df = df.rename({"etnia_homologada": "etnia"})
     return df
 
-def persona_orchester(df: pl.DataFrame):
-    df = _crear_dataframe_con_moda_fecha(df)
+def persona_orchester(df: Union[pl.DataFrame, pl.LazyFrame], fecha_referencia: Optional[date] = None,
+                      estrategias: Optional[list[str]] = None,
+                      imputadas: Optional[Union[pl.DataFrame, pl.LazyFrame]] = None):
+    """
+    Etapas de persona como un solo plan lazy. Con un LazyFrame retorna el plan sin ejecutarlo, con un DataFrame
+    lo ejecuta y retorna el resultado. imputadas es la salida de fechas_imputadas sobre toda la tabla cuando df
+    es solo una parte de ella, en ese caso estrategias no se usa.
+    """
+    lazy = isinstance(df, pl.LazyFrame)
+    if imputadas is None:
+        df = imputar_fecha_aplicacion(df.lazy(), estrategias)
+    else:
+        df = _aplicar_fechas_imputadas(df.lazy(), imputadas.lazy())
     df = _limpiar_columnas_texto(df, cols=["tipo_iden", "num_iden", "apellidos", "nombres","nombres_completos", "sexo", "etnia", "nacionalidad"])
     df = _limpiar_columnas_fecha(df, cols=["fecha_nacimiento"])
     df = _limpiar_identificacion(df)
-    df = _calcular_edad(df)
-    df = _calcular_grupo_etario(df)
+    df = _calcular_edad(df, fecha_referencia)
     df = _homologar_etnia(df)
-    return df
+    return df if lazy else df.collect()
@@ -1,17 +1,94 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
 import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from lake.load_lake import load_data
-from process.clean_transform.dim_persona import persona_orchester
+from lake.init_lake import add_new_elements_to_lake
+from lake.load_lake import READ_BATCH_SIZE, scan_data
+from lake.session import LAKE_DIRECTORY
+from process.clean_transform.dim_persona import conteo_imputacion, persona_orchester
 from process.clean_transform.dim_vacuna import vacuna_orchester
 from process.clean_transform.dim_vacunacion import vacunacion_orchester
 
+# tabla del lago donde sink_process escribe los datos procesados
+PROCESSED_TABLE = 'lk_vacunacion_procesada'
+
 
-def process_orchester():
+def transform(df: pl.LazyFrame, estrategias: Optional[list[str]] = None,
+              imputadas: Optional[pl.LazyFrame] = None) -> pl.LazyFrame:
     '''
-    Orquesta el procesamiento de datos de vacunación
+    Etapas de persona, vacuna y vacunación sobre un LazyFrame de lk_vacunacion_covid. estrategias son las de
+    imputación de la fecha centinela; imputadas, las fechas ya imputadas cuando df es solo una partición.
     '''
-    df = load_data('vacunacion', 'lk_vacunacion_covid')
-    df = persona_orchester(df)
+    df = persona_orchester(df, estrategias=estrategias, imputadas=imputadas)
     df = vacuna_orchester(df)
     df = vacunacion_orchester(df)
-    return df
\ No newline at end of file
+    return df
+
+
+def process_plan(since: Optional[str] = None, until: Optional[str] = None,
+                 estrategias: Optional[list[str]] = None) -> pl.LazyFrame:
+    '''
+    Plan lazy del procesamiento sobre un scan del lago, sin ejecutarlo. Las columnas y el rango de fechas se
+    resuelven en DuckDB, el resto de las etapas corre por lotes en el motor de streaming de Polars.
+    '''
+    # todas las columnas de la tabla: la salida conserva las que las etapas no usan, y los ids enteros de las
+    # columnas internadas viajan con los datos para agrupar y unir sobre ellos. Un plan que solo usa algunas
+    # columnas, como fechas_imputadas, le pide a DuckDB únicamente esas
+    df = scan_data('vacunacion', 'lk_vacunacion_covid', date_column='fecha_aplicacion', since=since, until=until)
+    return transform(df, estrategias)
+
+
+def explain_process(since: Optional[str] = None, until: Optional[str] = None,
+                    estrategias: Optional[list[str]] = None) -> str:
+    '''
+    Plan optimizado del procesamiento tal como lo ejecuta el motor de streaming
+    '''
+    return process_plan(since, until, estrategias).explain(engine="streaming")
+
+
+def log_imputacion(conteo: dict[str, int]):
+    for estrategia, filas in sorted(conteo.items()):
+        logging.info(f" |- Fechas de aplicación centinela, {estrategia}: {filas:,}")
+
+
+def process_orchester(since: Optional[str] = None, until: Optional[str] = None,
+                      estrategias: Optional[list[str]] = None) -> pl.DataFrame:
+    '''
+    Orquesta el procesamiento de datos de vacunación, opcionalmente solo de las aplicaciones en [since, until)
+    '''
+    df = process_plan(since, until, estrategias).collect(engine="streaming")
+    log_imputacion(conteo_imputacion(df))
+    return df
+
+
+def sink_process(since: Optional[str] = None, until: Optional[str] = None, db: str = 'vacunacion',
+                 table: str = PROCESSED_TABLE, estrategias: Optional[list[str]] = None) -> dict:
+    '''
+    Procesa en streaming y escribe el resultado en db.table con upsert por id_vac_depu sin tenerlo completo en
+    memoria: el plan se vuelca a un Parquet de staging en el directorio del lago y el escritor lo lee por lotes.
+    '''
+    logging.info(f"|- Procesando lk_vacunacion_covid hacia {db}.{table}")
+    start_time = time.time()
+    os.makedirs(LAKE_DIRECTORY, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix="_staging_", dir=LAKE_DIRECTORY)
+    try:
+        path = os.path.join(staging, f"{table}.parquet")
+        process_plan(since, until, estrategias).sink_parquet(path, engine="streaming")
+        parquet = pq.ParquetFile(path)
+        logging.info(f" |- {parquet.metadata.num_rows:,} registros procesados en "
+                     f"{time.time() - start_time:.2f} segundos")
+        log_imputacion(conteo_imputacion(pl.scan_parquet(path)))
+        reader = pa.RecordBatchReader.from_batches(parquet.schema_arrow,
+                                                   parquet.iter_batches(batch_size=READ_BATCH_SIZE))
+        stats = add_new_elements_to_lake(db, table, ['id_vac_depu'], reader, mode='upsert')
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    logging.info(f" |- Procesamiento escrito en el lago en {time.time() - start_time:.2f} segundos")
+    return stats
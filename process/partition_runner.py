@@ -0,0 +1,250 @@
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from typing import Optional
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from lake.init_lake import add_new_elements_to_lake
+from lake.load_lake import READ_BATCH_SIZE, export_data, scan_data
+from lake.manifest import resume_run, start_run
+from lake.parquet_lake import read_source
+from lake.session import LAKE_DIRECTORY, lake_reader
+from process.clean_transform.dim_persona import conteo_imputacion, fechas_imputadas
+from process.clean_transform_orchester import PROCESSED_TABLE, log_imputacion, transform
+
+SOURCE_DB = 'vacunacion'
+SOURCE_TABLE = 'lk_vacunacion_covid'
+DATE_COLUMN = 'fecha_aplicacion'
+# columna por la que se subdivide un mes que no cabe en la memoria de un worker, una persona queda en una cubeta
+BUCKET_COLUMN = 'num_iden'
+
+# workers del pool y memoria que cada uno puede usar para su unidad de trabajo
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", os.cpu_count() or 1))
+PROCESS_WORKER_MEMORY_MB = int(os.getenv("PROCESS_WORKER_MEMORY_MB", 2048))
+
+# memoria del procesamiento por byte leído: la entrada, las columnas que se agregan y las tablas hash de los joins
+_MEMORY_FACTOR = 4
+_SAMPLE_ROWS = 10_000
+
+
+def _manifest_source(table: str) -> str:
+    return f"proceso_{SOURCE_TABLE}_{table}"
+
+
+def _month_partitions(since: Optional[str], until: Optional[str]) -> list[tuple[str, str, int]]:
+    """
+    Meses con datos en [since, until) como particiones semiabiertas (inicio, fin, filas), recortadas al rango
+    """
+    conditions, params = [f"{DATE_COLUMN} IS NOT NULL"], []
+    if since:
+        conditions.append(f"{DATE_COLUMN} >= CAST(? AS DATE)")
+        params.append(since)
+    if until:
+        conditions.append(f"{DATE_COLUMN} < CAST(? AS DATE)")
+        params.append(until)
+    with lake_reader(SOURCE_DB) as con:
+        months = con.execute(f"""
+            SELECT CAST(date_trunc('month', {DATE_COLUMN}) AS DATE) AS mes, COUNT(*) AS filas
+            FROM {read_source(SOURCE_DB, SOURCE_TABLE, DATE_COLUMN, since, until)}
+            WHERE {' AND '.join(conditions)}
+            GROUP BY ALL ORDER BY mes
+            """, params).fetchall()
+        if not since and not until:
+            undated = con.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE} WHERE {DATE_COLUMN} IS NULL").fetchone()[0]
+            if undated:
+                logging.warning(f" |- {undated:,} registros sin {DATE_COLUMN} no pertenecen a ninguna partición")
+    partitions = []
+    for month, rows in months:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        start = max(month, date.fromisoformat(since)) if since else month
+        end = min(next_month, date.fromisoformat(until)) if until else next_month
+        partitions.append((start.isoformat(), end.isoformat(), rows))
+    return partitions
+
+
+def _rows_per_unit(memory_mb: int) -> int:
+    # bytes por fila estimados con una muestra de la tabla, en Arrow como los lee el worker
+    with lake_reader(SOURCE_DB) as con:
+        sample = con.execute(f"SELECT * FROM {SOURCE_TABLE} LIMIT {_SAMPLE_ROWS}").arrow()
+    bytes_per_row = sample.nbytes / max(sample.num_rows, 1)
+    return max(int(memory_mb * 1024 ** 2 / (bytes_per_row * _MEMORY_FACTOR)), 1)
+
+
+def _process_unit(input_path: str, imputadas_path: str, output_path: str) -> dict[str, int]:
+    """
+    Trabajo de un worker: procesa una cubeta de una partición desde su Parquet de entrada y escribe el resultado
+    en otro Parquet. No abre el lago, el archivo de DuckDB lo tiene abierto el proceso principal.
+    Retorna el conteo de fechas imputadas por estrategia.
+    """
+    df = transform(pl.scan_parquet(input_path), imputadas=pl.scan_parquet(imputadas_path))
+    df.sink_parquet(output_path, engine="streaming")
+    return conteo_imputacion(pl.scan_parquet(output_path))
+
+
+def _write_partition(db: str, table: str, start: str, end: str, paths: list[str]) -> dict:
+    # las cubetas de la partición se escriben juntas, reemplazando la partición completa en una transacción
+    schema = pq.ParquetFile(paths[0]).schema_arrow
+    batches = (batch for path in paths for batch in pq.ParquetFile(path).iter_batches(batch_size=READ_BATCH_SIZE))
+    reader = pa.RecordBatchReader.from_batches(schema, batches)
+    return add_new_elements_to_lake(db, table, ['id_vac_depu'], reader, mode='replace_partition',
+                                    partition=(DATE_COLUMN, start, end))
+
+
+def run_partitions(since: Optional[str] = None, until: Optional[str] = None,
+                   months: Optional[list[str]] = None, resume: bool = False,
+                   workers: int = PROCESS_WORKERS, memory_mb: int = PROCESS_WORKER_MEMORY_MB,
+                   db: str = SOURCE_DB, table: str = PROCESSED_TABLE, estrategias: Optional[list[str]] = None) -> dict:
+    """
+    Procesa lk_vacunacion_covid por meses de fecha_aplicacion en un pool de procesos y escribe cada mes en
+    db.table con replace_partition, así reprocesar un mes reemplaza exactamente sus filas.
+    - El proceso principal exporta cada unidad a un Parquet de staging y escribe los resultados al lago; los
+      workers solo leen y escriben Parquet, con a lo sumo `workers` unidades exportadas a la vez.
+    - Un mes que no cabe en memory_mb por worker se divide en cubetas por hash de num_iden.
+    - Las fechas 1900-01-01 se imputan una vez sobre todo [since, until) con las estrategias y se entregan a
+      cada worker, así quedan igual que procesando la tabla completa. Al reprocesar particiones sueltas se debe
+      usar el mismo rango y las mismas estrategias que la ejecución original.
+    - Cada partición queda registrada en lk_chunk_manifest; una partición fallida no detiene las demás y se
+      reprocesa sola con months=['AAAA-MM'] o con resume=True.
+    Retorna {'partitions', 'failed', 'rows', 'inserted', 'deleted', 'imputacion'}.
+    """
+    logging.info(f"|- Procesando {SOURCE_TABLE} por particiones hacia {db}.{table}")
+    start_time = time.time()
+    source = _manifest_source(table)
+    rows_by_partition = {(start, end): rows for start, end, rows in _month_partitions(since, until)}
+    if resume:
+        resumed = resume_run(db, source)
+        if resumed is None:
+            return {'partitions': 0, 'failed': [], 'rows': 0, 'inserted': 0, 'deleted': 0, 'imputacion': {}}
+        manifest, selected, _ = resumed
+    else:
+        if months:
+            unknown = set(months) - {start[:7] for start, _ in rows_by_partition}
+            if unknown:
+                raise ValueError(f"Meses sin datos en el rango [{since}, {until}): {', '.join(sorted(unknown))}")
+        selected = [partition for partition in rows_by_partition if not months or partition[0][:7] in months]
+        manifest = start_run(db, source, selected)
+    unknown = [partition for partition in selected if partition not in rows_by_partition]
+    if unknown:
+        raise ValueError(f"Particiones de la ejecución retomada fuera del rango [{since}, {until}): {unknown}")
+
+    rows_per_unit = _rows_per_unit(memory_mb)
+    units = deque()
+    for start, end in selected:
+        buckets = max(math.ceil(rows_by_partition[(start, end)] / rows_per_unit), 1)
+        units.extend((start, end, buckets, bucket) for bucket in range(buckets))
+    logging.info(f" |- {len(selected)} particiones en {len(units)} unidades de hasta {rows_per_unit:,} filas, "
+                 f"{workers} workers")
+
+    os.makedirs(LAKE_DIRECTORY, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix="_staging_", dir=LAKE_DIRECTORY)
+    # los hilos de Polars se reparten entre los workers, que heredan el entorno al crearse
+    polars_threads = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(max((os.cpu_count() or 1) // workers, 1))
+    remaining = {partition: 0 for partition in selected}
+    for start, end, _, _ in units:
+        remaining[(start, end)] += 1
+    outputs = {partition: [] for partition in selected}
+    failed, stats = [], {'rows': 0, 'inserted': 0, 'deleted': 0}
+    imputacion = {}
+    try:
+        imputadas_path = os.path.join(staging, "imputadas.parquet")
+        imputadas = fechas_imputadas(scan_data(SOURCE_DB, SOURCE_TABLE, date_column=DATE_COLUMN,
+                                               since=since, until=until), estrategias)
+        imputadas.sink_parquet(imputadas_path, engine="streaming")
+
+        def _fail(partition: tuple[str, str], error: BaseException):
+            if partition not in failed:
+                logging.error(f" |- Error procesando la partición [{partition[0]}, {partition[1]}): {error}")
+                failed.append(partition)
+                manifest.partition_failed(partition[0], partition[1], str(error))
+
+        def _complete(partition: tuple[str, str]):
+            start, end = partition
+            partition_start = time.time()
+            try:
+                written = _write_partition(db, table, start, end, outputs[partition])
+            except Exception as e:
+                _fail(partition, e)
+                return
+            finally:
+                for path in outputs[partition]:
+                    os.remove(path)
+            rows = rows_by_partition[partition]
+            manifest.partition_completed(start, end, rows, time.time() - partition_start)
+            stats['rows'] += rows
+            stats['inserted'] += written['inserted']
+            stats['deleted'] += written['deleted']
+            logging.info(f" |- Partición [{start}, {end}) procesada con {rows:,} filas")
+
+        # spawn: los workers no heredan la conexión de DuckDB ni los hilos del escritor del lago
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        running = {}
+        try:
+            while units or running:
+                while units and len(running) < workers:
+                    start, end, buckets, bucket = units.popleft()
+                    if (start, end) in failed:
+                        continue
+                    name = os.path.join(staging, f"{start}_{end}_{bucket}")
+                    try:
+                        export_data(SOURCE_DB, SOURCE_TABLE, f"{name}_entrada.parquet", date_column=DATE_COLUMN,
+                                    since=start, until=end,
+                                    bucket=(BUCKET_COLUMN, buckets, bucket) if buckets > 1 else None)
+                        future = executor.submit(_process_unit, f"{name}_entrada.parquet", imputadas_path,
+                                                 f"{name}.parquet")
+                    except Exception as e:
+                        _fail((start, end), e)
+                        continue
+                    running[future] = (start, end, name)
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    start, end, name = running.pop(future)
+                    partition = (start, end)
+                    os.remove(f"{name}_entrada.parquet")
+                    remaining[partition] -= 1
+                    try:
+                        for estrategia, filas in future.result().items():
+                            imputacion[estrategia] = imputacion.get(estrategia, 0) + filas
+                        outputs[partition].append(f"{name}.parquet")
+                    except BrokenProcessPool as e:
+                        # un worker terminó sin aviso (por ejemplo sin memoria), fallan las unidades en curso
+                        broken = True
+                        _fail(partition, e)
+                    except Exception as e:
+                        _fail(partition, e)
+                    if not remaining[partition] and partition not in failed:
+                        _complete(partition)
+                if broken:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    finally:
+        if polars_threads is None:
+            os.environ.pop("POLARS_MAX_THREADS", None)
+        else:
+            os.environ["POLARS_MAX_THREADS"] = polars_threads
+        shutil.rmtree(staging, ignore_errors=True)
+
+    logging.info(f" |- {len(selected) - len(failed)} de {len(selected)} particiones procesadas en "
+                 f"{time.time() - start_time:.2f} segundos")
+    log_imputacion(imputacion)
+    if failed:
+        logging.error(f" |- Particiones fallidas, se reprocesan con resume: "
+                      f"{', '.join(f'[{start}, {end})' for start, end in failed)}")
+    return {'partitions': len(selected), 'failed': failed, **stats, 'imputacion': imputacion}
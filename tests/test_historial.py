@@ -0,0 +1,40 @@
+import datetime
+
+import polars as pl
+import pytest
+
+from lake.historial import create_historial, get_historial
+from lake.init_lake import add_new_elements_to_lake
+from lake.session import close_sessions
+
+
+@pytest.fixture
+def lago(tmp_path, monkeypatch):
+    # el lago vive en ./resources/data_lake, cada prueba en su directorio y con sesiones nuevas
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    close_sessions()
+
+
+def _rutinario(identificacion: str) -> pl.DataFrame:
+    return pl.DataFrame({
+        "ID": [1],
+        "FECHAVACUNACION": [datetime.datetime(2021, 3, 1, 9)],
+        "NUMEROIDENTIFICACION": [identificacion],
+        "ESQUEMAVACUNACION_ID": [10],
+        "REFUERZO": [0],
+        "LOTE": ["L1"],
+        "PUNTOVACUNACION_ID": [5],
+    })
+
+
+def test_upsert_cambia_identificacion(lago):
+    add_new_elements_to_lake('vacunacion', 'db_vacunacion_rutinario', ['ID'], _rutinario("1710034065"))
+    create_historial()
+    assert get_historial("1710034065")["id_origen"].to_list() == ["1"]
+
+    add_new_elements_to_lake('vacunacion', 'db_vacunacion_rutinario', ['ID'], _rutinario("0912345678"),
+                             mode='upsert')
+
+    assert get_historial("0912345678")["id_origen"].to_list() == ["1"]
+    assert get_historial("1710034065").is_empty()
@@ -0,0 +1,120 @@
+from typing import Optional, Union
+
+import polars as pl
+
+# códigos de provincia de la cédula y el RUC: 01 a 24 y 30 para ecuatorianos registrados en el exterior
+PROVINCIAS_VALIDAS = list(range(1, 25)) + [30]
+
+_COEFICIENTES_CEDULA = [2, 1, 2, 1, 2, 1, 2, 1, 2]
+_COEFICIENTES_RUC_PUBLICO = [3, 2, 7, 6, 5, 4, 3, 2]
+_COEFICIENTES_RUC_PRIVADO = [4, 3, 2, 7, 6, 5, 4, 3, 2]
+
+
+def es_cedula_valida(cedula: str) -> bool:
+    """
+    Validación de una cédula: 10 dígitos, provincia válida, tercer dígito menor a 6 y dígito verificador
+    módulo 10. Versión escalar de referencia de cedula_valida, para valores sueltos.
+    """
+    if not cedula or len(cedula) != 10 or not cedula.isdigit():
+        return False
+    if int(cedula[:2]) not in PROVINCIAS_VALIDAS or int(cedula[2]) >= 6:
+        return False
+
+    total = 0
+    for i in range(9):
+        val = int(cedula[i]) * _COEFICIENTES_CEDULA[i]
+        if val >= 10:
+            val -= 9
+        total += val
+
+    digito_verificador = 10 - (total % 10) if (total % 10) != 0 else 0
+
+    return digito_verificador == int(cedula[9])
+
+
+def _as_expr(column: Union[str, pl.Expr]) -> pl.Expr:
+    return pl.col(column) if isinstance(column, str) else column
+
+
+def _digito(numero: pl.Expr, posicion: int, largo: int) -> pl.Expr:
+    # dígito en la posición (0 a la izquierda) de un número de largo dígitos, sin volver a recorrer el texto
+    return (numero // 10 ** (largo - 1 - posicion)) % 10
+
+
+def _verificador_modulo_10(numero: pl.Expr) -> pl.Expr:
+    # numero son los 10 dígitos de la cédula. Con coeficiente 2 el producto reducido es 2d - 9 * (d // 5); solo
+    # importa el total módulo 10 y -9 ≡ 1, así que se suma 2d + d // 5 y se ahorran operaciones por fila
+    total = pl.lit(0, dtype=pl.Int64)
+    for posicion, coeficiente in enumerate(_COEFICIENTES_CEDULA):
+        digito = _digito(numero, posicion, 10)
+        total = total + (digito if coeficiente == 1 else 2 * digito + digito // 5)
+    return (10 - total % 10) % 10
+
+
+def _verificador_modulo_11(numero: pl.Expr, coeficientes: list[int]) -> pl.Expr:
+    # numero son los 13 dígitos del RUC, un verificador 10 no corresponde a ningún dígito y el RUC es inválido
+    total = pl.lit(0, dtype=pl.Int64)
+    for posicion, coeficiente in enumerate(coeficientes):
+        total = total + _digito(numero, posicion, 13) * coeficiente
+    return (11 - total % 11) % 11
+
+
+def _cedula_numero_valida(numero: pl.Expr) -> pl.Expr:
+    return (
+        (numero // 10 ** 8).is_in(PROVINCIAS_VALIDAS)
+        & (_digito(numero, 2, 10) < 6)
+        & (_verificador_modulo_10(numero) == _digito(numero, 9, 10))
+    )
+
+
+def cedula_valida(column: Union[str, pl.Expr], numero: Optional[pl.Expr] = None) -> pl.Expr:
+    """
+    Expresión que valida cédulas ecuatorianas con las mismas reglas de es_cedula_valida. El texto se convierte
+    a entero y los dígitos salen con aritmética entera, Polars la evalúa en paralelo sin pasar por Python.
+    Polars no comparte la conversión entre los dígitos y la repite en cada uso; numero recibe el texto ya
+    convertido con str.to_integer(strict=False), por ejemplo una columna temporal, para convertirlo una sola vez.
+    Nulo si el valor es nulo.
+    """
+    value = _as_expr(column)
+    if numero is None:
+        numero = value.str.to_integer(strict=False)
+    return value.str.contains(r"^\d{10}$") & _cedula_numero_valida(numero)
+
+
+def ruc_valido(column: Union[str, pl.Expr], numero: Optional[pl.Expr] = None) -> pl.Expr:
+    """
+    Expresión que valida RUC ecuatorianos de 13 dígitos según el tercer dígito:
+        0 a 5  persona natural, los 10 primeros dígitos son su cédula y el establecimiento no es 000
+        6      sociedad pública, verificador módulo 11 en el noveno dígito y establecimiento distinto de 0000
+        9      sociedad privada o extranjera, verificador módulo 11 en el décimo dígito y establecimiento no 000
+    numero, como en cedula_valida, es el texto ya convertido a entero para no repetir la conversión.
+    Nulo si el valor es nulo.
+    """
+    value = _as_expr(column)
+    if numero is None:
+        numero = value.str.to_integer(strict=False)
+    tercero = _digito(numero, 2, 13)
+    natural = (tercero < 6) & _cedula_numero_valida(numero // 1000) & (numero % 1000 > 0)
+    publica = (
+        (tercero == 6)
+        & (_verificador_modulo_11(numero, _COEFICIENTES_RUC_PUBLICO) == _digito(numero, 8, 13))
+        & (numero % 10000 > 0)
+    )
+    privada = (
+        (tercero == 9)
+        & (_verificador_modulo_11(numero, _COEFICIENTES_RUC_PRIVADO) == _digito(numero, 9, 13))
+        & (numero % 1000 > 0)
+    )
+    return (
+        value.str.contains(r"^\d{13}$")
+        & (numero // 10 ** 11).is_in(PROVINCIAS_VALIDAS)
+        & (natural | publica | privada)
+    )
+
+
+def pasaporte_valido(column: Union[str, pl.Expr]) -> pl.Expr:
+    """
+    Expresión que valida la forma de un pasaporte: 5 a 20 letras o dígitos, sin espacios ni signos. No hay
+    dígito verificador común a todos los países. Nulo si el valor es nulo.
+    """
+    return _as_expr(column).str.contains(r"^[A-Za-z0-9]{5,20}$")